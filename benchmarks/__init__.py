@@ -0,0 +1 @@
+""" Package with the benchmark suite of the database classes. Run it with `python -m benchmarks`. """
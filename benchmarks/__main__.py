@@ -0,0 +1,43 @@
+""" Command line interface of the benchmark suite
+
+Examples:
+    python -m benchmarks --output benchmarks/results/baseline.json
+    python -m benchmarks --compare benchmarks/results/baseline.json --threshold 0.2
+    python -m benchmarks --quick --filter insert
+"""
+import sys
+import argparse
+
+from benchmarks import cases  # noqa: F401, registers the benchmarks
+from benchmarks.harness import run, compare, dump, load, format_results, format_comparison
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', action='append', default=[], help="Run only the benchmarks whose name contains this string. Repeatable.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per parameter set. Defaults to 5.")
+    parser.add_argument('--quick', action='store_true', help="Run the smallest parameter set of each benchmark only.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare the medians against a stored JSON baseline. Exits with 1 on regressions.")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Relative slowdown flagged as a regression. Defaults to 0.2.")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, repeat=args.repeat, quick=args.quick,
+                  progress=lambda key: print(f"Running {key}", file=sys.stderr))
+    print(format_results(results))
+
+    if args.output:
+        dump(results, args.output)
+
+    if args.compare:
+        comparisons = compare(results, load(args.compare), threshold=args.threshold)
+        print()
+        print(format_comparison(comparisons))
+        regressions = [comparison.key for comparison in comparisons if comparison.regression]
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
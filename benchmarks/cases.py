@@ -0,0 +1,236 @@
+""" Module with the benchmarks of the database classes against local SQLite files """
+import random
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, ForeignKey
+from alembic.script import ScriptDirectory
+
+from sqltoolbox.database import DeclarativeLiteDatabase, AutoMappedLiteDatabase, EngineRegistry
+from sqltoolbox.models.base import Base
+from sqltoolbox.models import User, Role, Address
+from sqltoolbox.pagination import encode_cursor
+from sqltoolbox.lite import build_template
+from sqltoolbox.migrations import upgrade_to_head
+
+from benchmarks.harness import benchmark
+
+BASE_DIR = Path(__file__).parents[1].resolve()
+SCRIPT_DIRECTORY = BASE_DIR / 'single-alembic'
+
+def lite_database(directory: Path, name: str = 'bench.db', create_tables: bool = False,
+                  **kwargs: typing.Any) -> DeclarativeLiteDatabase:
+    """Function creating a declarative lite database with the package models in the directory."""
+    database = DeclarativeLiteDatabase(
+        dialect='sqlite',
+        driver='pysqlite',
+        name=str(directory / name),
+        Base=Base,
+        **kwargs,
+    )
+    if create_tables:
+        # Created here rather than with create_tables=True, which logs a warning per instance
+        Base.metadata.create_all(database.engine)
+    return database
+
+def user_rows(count: int, roles: int) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Function generating user rows, deterministic for the seed set by the runner."""
+    return [
+        dict(
+            id=index,
+            name=f"user{index}",
+            fullname=f"User {index}",
+            password=f"{random.getrandbits(64):016x}",
+            phone=f"+34 6{random.randrange(10**8):08d}",
+            role_id=random.randrange(1, roles + 1),
+        )
+        for index in range(1, count + 1)
+    ]
+
+# Engines and sessions
+@benchmark('generate_engine', params=[dict(names=10), dict(names=100), dict(names=1000)])
+def generate_engine(directory: Path, names: int) -> typing.Callable[[], int]:
+    """Create one engine per database name with generate_engine."""
+    database = lite_database(directory)
+    database_names = [str(directory / f"db{index}.db") for index in range(names)]
+
+    def timed() -> int:
+        for name in database_names:
+            database.generate_engine(name)
+        return names
+    return timed
+
+@benchmark('get_engines_from_list', params=[
+    dict(names=100, registry=False), dict(names=100, registry=True),
+    dict(names=1000, registry=False), dict(names=1000, registry=True),
+])
+def get_engines_from_list(directory: Path, names: int, registry: bool) -> typing.Callable[[], int]:
+    """Create the engines of a list of databases twice, with or without a warm engine registry."""
+    database = lite_database(directory, registry=EngineRegistry(max_engines=names) if registry else None)
+    database_names = [str(directory / f"db{index}.db") for index in range(names)]
+
+    def timed() -> int:
+        for _ in range(2):
+            database.get_engines_from_list(database_names)
+        return 2 * names
+    return timed
+
+@benchmark('session_open_close', params=[dict(sessions=1000), dict(sessions=10000)])
+def session_open_close(directory: Path, sessions: int) -> typing.Callable[[], int]:
+    """Open a session, run a trivial query and close it."""
+    database = lite_database(directory, create_tables=True)
+    statement = sqlalchemy.select(sqlalchemy.literal(1))
+
+    def timed() -> int:
+        for _ in range(sessions):
+            with database.session as session:
+                session.execute(statement)
+        return sessions
+    return timed
+
+# Inserts
+def _insert_setup(directory: Path, users: int) -> typing.Tuple[DeclarativeLiteDatabase, typing.List[typing.Dict[str, typing.Any]]]:
+    """ Create the tables and the roles, returning the database and the user rows """
+    database = lite_database(directory, create_tables=True)
+    roles = max(1, users // 100)
+    with database.engine.begin() as connection:
+        connection.execute(sqlalchemy.insert(Role), [dict(id=index, name=f"role{index}") for index in range(1, roles + 1)])
+    return database, user_rows(users, roles)
+
+@benchmark('orm_insert', params=[dict(users=1000), dict(users=10000)])
+def orm_insert(directory: Path, users: int) -> typing.Callable[[], int]:
+    """Insert users with one address each through the ORM unit of work."""
+    database, rows = _insert_setup(directory, users)
+
+    def timed() -> int:
+        with database.autocommit_session as session:
+            for row in rows:
+                user = User(**row)
+                session.add(user)
+                session.add(Address(address=f"{row['name']} street", user_id=row['id']))
+        return 2 * users
+    return timed
+
+@benchmark('core_insert', params=[dict(users=1000), dict(users=10000)])
+def core_insert(directory: Path, users: int) -> typing.Callable[[], int]:
+    """Insert users with one address each through Core executemany."""
+    database, rows = _insert_setup(directory, users)
+    addresses = [dict(address=f"{row['name']} street", user_id=row['id']) for row in rows]
+
+    def timed() -> int:
+        with database.engine.begin() as connection:
+            connection.execute(sqlalchemy.insert(User), rows)
+            connection.execute(sqlalchemy.insert(Address), addresses)
+        return 2 * users
+    return timed
+
+@benchmark('bulk_insert', params=[dict(users=1000), dict(users=10000)])
+def bulk_insert(directory: Path, users: int) -> typing.Callable[[], int]:
+    """Insert users with one address each through BulkMixin.bulk_insert."""
+    database, rows = _insert_setup(directory, users)
+    addresses = [dict(address=f"{row['name']} street", user_id=row['id']) for row in rows]
+
+    def timed() -> int:
+        database.bulk_insert(User, rows)
+        database.bulk_insert(Address, addresses)
+        return 2 * users
+    return timed
+
+# Pagination
+@benchmark('deep_page', params=[
+    dict(page=10, keyset=False), dict(page=10, keyset=True),
+    dict(page=1000, keyset=False), dict(page=1000, keyset=True),
+    dict(page=10, keyset=True, composite=True), dict(page=1000, keyset=True, composite=True),
+], quick_params=[dict(page=10, keyset=False), dict(page=10, keyset=True), dict(page=10, keyset=True, composite=True)])
+def deep_page(directory: Path, page: int, keyset: bool, composite: bool = False) -> typing.Callable[[], int]:
+    """Read 20 users at a given page depth, with OFFSET or with a keyset cursor on the id or on (role_id, id)."""
+    database, rows = _insert_setup(directory, 20 * (page + 1))
+    database.bulk_insert(User, rows)
+    statement = sqlalchemy.select(User)
+    key = [User.role_id, User.id] if composite else [User.id]
+    if composite:
+        with database.engine.begin() as connection:
+            connection.exec_driver_sql("CREATE INDEX ix_users_role_id_id ON users (role_id, id)")
+        boundary = sorted((row['role_id'], row['id']) for row in rows)[20 * page - 1]
+    else:
+        boundary = (20 * page,)
+    cursor = encode_cursor(boundary)
+
+    def timed() -> int:
+        for _ in range(100):
+            if keyset:
+                database.paginate(statement, limit=20, cursor=cursor, key=key)
+            else:
+                with database.session as session:
+                    session.scalars(statement.order_by(User.id).offset(20 * page).limit(20)).all()
+        return 100
+    return timed
+
+# Template databases
+@benchmark('lite_database_setup', params=[
+    dict(method='migrate'), dict(method='create_all'), dict(method='file_clone'), dict(method='memory_clone'),
+], quick_params=[dict(method='create_all'), dict(method='memory_clone')])
+def lite_database_setup(directory: Path, method: str, databases: int = 100) -> typing.Callable[[], int]:
+    """Create fresh databases with the models tables, by running DDL or the revisions, or by cloning a template."""
+    template = build_template(directory / 'templates', script_location=str(SCRIPT_DIRECTORY))
+    counter = iter(range(10**9))
+
+    def timed() -> int:
+        for _ in range(databases):
+            path = directory / f"setup{next(counter)}.db"
+            if method == 'migrate':
+                database = lite_database(directory, name=path.name)
+                with database.engine.begin() as connection:
+                    upgrade_to_head(connection, str(SCRIPT_DIRECTORY))
+            elif method == 'create_all':
+                database = lite_database(directory, name=path.name, create_tables=True)
+            else:
+                name = ':memory:' if method == 'memory_clone' else str(path)
+                database = DeclarativeLiteDatabase.from_template(template, name=name, Base=Base)
+                with database.engine.connect():
+                    pass
+            database.engine.dispose()
+        return databases
+    return timed
+
+# Reflection
+def create_tables(path: Path, tables: int) -> None:
+    """Function creating a database with the given number of tables, each referencing the previous one."""
+    metadata = sqlalchemy.MetaData()
+    for index in range(tables):
+        columns = [Column('id', Integer, primary_key=True), Column('name', String(50))]
+        if index:
+            columns.append(Column('parent_id', ForeignKey(f"table{index - 1}.id")))
+        sqlalchemy.Table(f"table{index}", metadata, *columns)
+
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    metadata.create_all(engine)
+    engine.dispose()
+
+@benchmark('automap_reflection', params=[dict(tables=10), dict(tables=50), dict(tables=200)])
+def automap_reflection(directory: Path, tables: int) -> typing.Callable[[], int]:
+    """Reflect and automap a database with a growing number of tables."""
+    path = directory / 'reflect.db'
+    create_tables(path, tables)
+
+    def timed() -> int:
+        database = AutoMappedLiteDatabase(dialect='sqlite', driver='pysqlite', name=str(path))
+        database.engine.dispose()
+        return tables
+    return timed
+
+# Migrations
+@benchmark('alembic_upgrade', params=[dict(databases=10), dict(databases=50)])
+def alembic_upgrade(directory: Path, databases: int) -> typing.Callable[[], int]:
+    """Upgrade many databases to head with the single-alembic scripts, without going through env.py."""
+    script = ScriptDirectory(str(SCRIPT_DIRECTORY))
+    engines = [sqlalchemy.create_engine(f"sqlite:///{directory / f'db{index}.db'}") for index in range(databases)]
+
+    def timed() -> int:
+        for engine in engines:
+            with engine.begin() as connection:
+                upgrade_to_head(connection, script)
+            engine.dispose()
+        return databases
+    return timed
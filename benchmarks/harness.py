@@ -0,0 +1,216 @@
+""" Module with the benchmark registry, runner and baseline comparison
+
+A benchmark is a setup function registered with ``@benchmark``. It receives a fresh
+temporary directory and its parameters, prepares the data outside of the measurement and
+returns the callable to time. The callable returns the number of operations it performed,
+used to report the throughput. Every repeat runs the setup again on a new directory.
+"""
+import gc
+import json
+import time
+import typing
+import random
+import sqlite3
+import platform
+import tempfile
+import statistics
+from pathlib import Path
+from dataclasses import dataclass, field
+
+import alembic
+import sqlalchemy
+
+__all__ = [
+    'BENCHMARKS',
+    'Benchmark',
+    'benchmark',
+    'compare',
+    'run',
+]
+
+Case = typing.Callable[..., typing.Callable[[], int]]
+
+SEED = 20230404
+
+@dataclass
+class Benchmark:
+    """A registered benchmark.
+
+    Attributes:
+        name (str): The name of the benchmark.
+        setup (Callable[..., Callable[[], int]]): The setup function returning the timed callable.
+        params (List[Dict[str, Any]]): The parameter sets the benchmark runs with.
+        quick_params (List[Dict[str, Any]]): The parameter sets of the quick mode.
+    """
+    name:           str
+    setup:          Case
+    params:         typing.List[typing.Dict[str, typing.Any]] = field(default_factory=lambda: [{}])
+    quick_params:   typing.List[typing.Dict[str, typing.Any]] = field(default_factory=lambda: [{}])
+
+BENCHMARKS: typing.Dict[str, Benchmark] = {}
+
+def benchmark(name: str, params: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+              quick_params: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None) -> typing.Callable[[Case], Case]:
+    """Decorator registering a benchmark setup function.
+
+    Args:
+        name (str): The name of the benchmark.
+        params (Optional[List[Dict[str, Any]]], optional): The parameter sets. Defaults to None, a single run without parameters.
+        quick_params (Optional[List[Dict[str, Any]]], optional): The parameter sets of the quick mode. Defaults to None, the first parameter set.
+
+    Returns:
+        Callable: The decorator.
+    """
+    params = params or [{}]
+
+    def decorator(setup: Case) -> Case:
+        BENCHMARKS[name] = Benchmark(name, setup, params, quick_params or params[:1])
+        return setup
+    return decorator
+
+def result_key(name: str, params: typing.Dict[str, typing.Any]) -> str:
+    """Function returning the key identifying a benchmark run, e.g. 'orm_insert[rows=1000]'."""
+    if not params:
+        return name
+    return f"{name}[{','.join(f'{key}={value}' for key, value in sorted(params.items()))}]"
+
+def environment() -> typing.Dict[str, str]:
+    """Function describing the environment of the run, stored with the results."""
+    return dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        sqlalchemy=sqlalchemy.__version__,
+        alembic=alembic.__version__,
+        sqlite=sqlite3.sqlite_version,
+    )
+
+def measure(bench: Benchmark, params: typing.Dict[str, typing.Any], repeat: int) -> typing.Dict[str, typing.Any]:
+    """Function running a benchmark with a parameter set and summarizing the timings.
+
+    Args:
+        bench (Benchmark): The benchmark.
+        params (Dict[str, Any]): The parameter set.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        Dict[str, Any]: The timings in seconds and the throughput.
+    """
+    timings = []
+    operations = 0
+    for _ in range(repeat):
+        random.seed(SEED)
+        with tempfile.TemporaryDirectory(prefix='sqltoolbox-bench-') as directory:
+            timed = bench.setup(Path(directory), **params)
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                operations = timed()
+                timings.append(time.perf_counter() - start)
+            finally:
+                gc.enable()
+
+    median = statistics.median(timings)
+    return dict(
+        name=bench.name,
+        params=params,
+        repeat=repeat,
+        operations=operations,
+        min=min(timings),
+        median=median,
+        mean=statistics.fmean(timings),
+        stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        ops_per_second=operations / median if median else 0.0,
+    )
+
+def run(names: typing.Optional[typing.Iterable[str]] = None, repeat: int = 5, quick: bool = False,
+        progress: typing.Optional[typing.Callable[[str], None]] = None) -> typing.Dict[str, typing.Any]:
+    """Function running the registered benchmarks.
+
+    Args:
+        names (Optional[Iterable[str]], optional): Substrings selecting the benchmarks to run. Defaults to None, all of them.
+        repeat (int, optional): Number of timed runs per parameter set. Defaults to 5.
+        quick (bool, optional): If True, the quick parameter sets are used. Defaults to False.
+        progress (Optional[Callable[[str], None]], optional): Called with the key of each run before it starts. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The environment and the results keyed by run, JSON serializable.
+    """
+    names = list(names or [])
+    results = {}
+    for bench in BENCHMARKS.values():
+        if names and not any(name in bench.name for name in names):
+            continue
+        for params in (bench.quick_params if quick else bench.params):
+            key = result_key(bench.name, params)
+            if progress:
+                progress(key)
+            results[key] = measure(bench, params, repeat)
+
+    return dict(environment=environment(), repeat=repeat, quick=quick, results=results)
+
+@dataclass
+class Comparison:
+    """Comparison of a run against its baseline.
+
+    Attributes:
+        key (str): The key of the run.
+        baseline (float): The baseline median in seconds.
+        current (float): The current median in seconds.
+        ratio (float): current / baseline.
+        regression (bool): True if the ratio exceeds 1 + threshold.
+    """
+    key:        str
+    baseline:   float
+    current:    float
+    ratio:      float
+    regression: bool
+
+def compare(current: typing.Dict[str, typing.Any], baseline: typing.Dict[str, typing.Any],
+            threshold: float = 0.2) -> typing.List[Comparison]:
+    """Function comparing the medians of the runs present in both result sets.
+
+    Args:
+        current (Dict[str, Any]): The results of run.
+        baseline (Dict[str, Any]): The stored results of a previous run.
+        threshold (float, optional): Relative slowdown flagged as a regression. Defaults to 0.2, i.e. 20 % slower.
+
+    Returns:
+        List[Comparison]: One comparison per common run.
+    """
+    comparisons = []
+    for key, result in current['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        ratio = result['median'] / reference['median'] if reference['median'] else float('inf')
+        comparisons.append(Comparison(key, reference['median'], result['median'], ratio, ratio > 1 + threshold))
+    return comparisons
+
+def format_results(results: typing.Dict[str, typing.Any]) -> str:
+    """Function formatting the results as a text table."""
+    lines = [f"{'benchmark':<48} {'median':>10} {'min':>10} {'stdev':>10} {'ops/s':>12}"]
+    for key, result in results['results'].items():
+        lines.append(f"{key:<48} {result['median']:>10.4f} {result['min']:>10.4f} "
+                     f"{result['stdev']:>10.4f} {result['ops_per_second']:>12.0f}")
+    return '\n'.join(lines)
+
+def format_comparison(comparisons: typing.List[Comparison]) -> str:
+    """Function formatting the comparisons as a text table."""
+    lines = [f"{'benchmark':<48} {'baseline':>10} {'current':>10} {'ratio':>8}"]
+    for comparison in comparisons:
+        flag = '  REGRESSION' if comparison.regression else ''
+        lines.append(f"{comparison.key:<48} {comparison.baseline:>10.4f} {comparison.current:>10.4f} "
+                     f"{comparison.ratio:>8.2f}{flag}")
+    return '\n'.join(lines)
+
+def load(path: typing.Union[str, Path]) -> typing.Dict[str, typing.Any]:
+    """Function reading results stored as JSON."""
+    return json.loads(Path(path).read_text())
+
+def dump(results: typing.Dict[str, typing.Any], path: typing.Union[str, Path]) -> None:
+    """Function storing results as JSON."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(results, indent=2))
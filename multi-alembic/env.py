@@ -1,13 +1,25 @@
 import copy
 import logging
+from contextlib import nullcontext
 from logging.config import fileConfig
 
 from alembic import context
 
 from sqltoolbox.config import database
+from sqltoolbox import migrations
+from sqltoolbox.backfill import include_name
 
 USE_TWOPHASE = False
 
+# Migrate each database in its own worker process instead of one after another.
+USE_CONCURRENCY = False
+MAX_WORKERS = 8
+# Maximum number of connections open at the same time. None means one per worker.
+MAX_CONNECTIONS = None
+
+# Directory of the offline (--sql) scripts and of their manifest.json.
+SQL_OUTPUT_DIR = "sql"
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -23,6 +35,11 @@ logger = logging.getLogger("alembic.env")
 # in the sample .ini file.
 db_names = database.get_database_names(starts_with="database")
 
+# A worker process migrates the single database given with -x database=<name>
+worker = migrations.current_worker()
+if worker is not None:
+    db_names = [worker.name]
+
 # add your model's MetaData objects here
 # for 'autogenerate' support.  These must be set
 # up to hold just those tables targeting a
@@ -57,28 +74,66 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    # for the --sql use case, run migrations for each URL into
-    # individual files.
-
-    engines = {}
-    for name in db_names:
-        engines[name] = rec = {}
-        rec["url"] = context.config.get_section_option(name, "sqlalchemy.url")
-
-    for name, rec in engines.items():
-        logger.info("Migrating database %s" % name)
-        file_ = "%s.sql" % name
-        logger.info("Writing output to %s" % file_)
-        with open(file_, "w") as buffer:
-            context.configure(
-                url=rec["url"],
-                output_buffer=buffer,
-                target_metadata=target_metadata.get(name),
-                literal_binds=True,
-                dialect_opts={"paramstyle": "named"},
-            )
-            with context.begin_transaction():
-                context.run_migrations(engine_name=name)
+    # for the --sql use case, render every database in worker processes
+    # and write the identical scripts once.
+    if worker is None:
+        cmd_opts = config.cmd_opts
+        command_name = cmd_opts.cmd[0].__name__ if cmd_opts is not None and hasattr(cmd_opts, "cmd") else "upgrade"
+        revision = context.get_revision_argument()
+        if context.get_starting_revision_argument() is not None:
+            revision = "%s:%s" % (context.get_starting_revision_argument(), revision)
+        migrations.render_offline_scripts(
+            config,
+            db_names,
+            output_dir=SQL_OUTPUT_DIR,
+            command_name=command_name,
+            revision=revision,
+            max_workers=MAX_WORKERS,
+        )
+        return
+
+    name = worker.name
+    logger.info("Rendering database %s to %s" % (name, worker.sql_output))
+    with open(worker.sql_output, "w") as buffer:
+        context.configure(
+            url=context.config.get_section_option(name, "sqlalchemy.url"),
+            output_buffer=buffer,
+            target_metadata=target_metadata,
+            literal_binds=True,
+            dialect_opts={"paramstyle": "named"},
+            starting_rev=context.config.get_section_option(name, migrations.STARTING_REV_OPTION),
+        )
+        with context.begin_transaction():
+            context.run_migrations(engine_name=name)
+
+
+def run_migrations_concurrently() -> None:
+    """Run migrations in 'online' mode with one worker process per database.
+
+    Each worker runs this env.py again for a single database. Without
+    USE_TWOPHASE every database commits on its own; with USE_TWOPHASE
+    all of them are committed only if all of them are prepared.
+
+    """
+    cmd_opts = config.cmd_opts
+    command_name = cmd_opts.cmd[0].__name__ if cmd_opts is not None and hasattr(cmd_opts, "cmd") else "upgrade"
+
+    results = migrations.run_concurrent_migrations(
+        config,
+        db_names,
+        command_name=command_name,
+        revision=context.get_revision_argument(),
+        max_workers=MAX_WORKERS,
+        max_connections=MAX_CONNECTIONS,
+        twophase=USE_TWOPHASE,
+    )
+
+    for line in migrations.format_report(results):
+        logger.info(line)
+
+    failed = [result.name for result in results if not result.ok]
+    if failed:
+        raise migrations.MigrationError("Migration not committed for databases: %s" % ", ".join(failed))
 
 
 def run_migrations_online() -> None:
@@ -88,6 +143,16 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    if USE_CONCURRENCY and worker is None:
+        run_migrations_concurrently()
+        return
+
+    with worker.connection_slot() if worker is not None else nullcontext():
+        _run_migrations_online()
+
+
+def _run_migrations_online() -> None:
+    """Run migrations in 'online' mode over every database of db_names."""
 
     # for the direct-to-DB use case, start a transaction on all
     # engines, then run all migrations, then commit all transactions.
@@ -106,7 +171,8 @@ def run_migrations_online() -> None:
                 connection=engine_dict.get("connection"),
                 upgrade_token=f"{name}_upgrades",
                 downgrade_token=f"{name}_downgrades",
-                target_metadata=target_metadata
+                target_metadata=target_metadata,
+                include_name=include_name,
             )
             context.run_migrations(engine_name=name)
 
@@ -114,6 +180,10 @@ def run_migrations_online() -> None:
             for engine_dict in engines_data.values():
                 engine_dict["transaction"].prepare()
 
+            # Wait for every other worker to be prepared as well
+            if worker is not None and not worker.vote():
+                raise migrations.TwoPhaseRollback()
+
         for engine_dict in engines_data.values():
             engine_dict["transaction"].commit()
 
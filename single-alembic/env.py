@@ -20,6 +20,9 @@ if config.config_file_name is not None:
 from sqltoolbox.factory import Base
 target_metadata = Base.metadata
 
+# Tables of the package which are not models, e.g. the backfill progress table
+from sqltoolbox.backfill import include_name
+
 # ENGINE
 from sqltoolbox.factory import get_declarative_database
 connectable = get_declarative_database().engine
@@ -65,6 +68,7 @@ def run_migrations_online() -> None:
         context.configure(
             connection=connection, 
             target_metadata=target_metadata,
+            include_name=include_name,
         )
 
         with context.begin_transaction():
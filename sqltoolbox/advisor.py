@@ -0,0 +1,340 @@
+""" Module with the index advisor driven by a captured workload
+
+The statements executed on an engine are recorded over a block of code or a time window,
+one sample per normalized shape. Each shape is explained with the plan statement of the
+dialect (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` on MySQL and MariaDB, ``EXPLAIN (FORMAT
+JSON)`` on PostgreSQL). When a table is fully scanned, the columns the statement filters or
+joins it on, which do not already lead an index, are suggested for a new index. The
+suggestions are written as an alembic revision named with the ``ix`` naming convention of the
+metadata, e.g. ``op.f('ix_addresses_user_id')``.
+
+Example:
+    recorder = WorkloadRecorder()
+    with recorder.recording(database.engine):
+        run_the_workload()
+    suggestions = suggest_indexes(database.engine, recorder.shapes)
+    write_revision(suggestions, 'single-alembic')
+"""
+import re
+import json
+import time
+import typing
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import conv
+from alembic import util as alembic_util
+from alembic.config import Config
+from alembic.operations import ops
+from alembic.autogenerate import render_python_code
+from alembic.script import ScriptDirectory
+
+from sqltoolbox.instrumentation import normalize_statement
+
+__all__ = [
+    'EXPLAIN_DIALECTS',
+    'IndexSuggestion',
+    'StatementShape',
+    'WorkloadRecorder',
+    'index_name',
+    'render_revision',
+    'suggest_indexes',
+    'write_revision',
+]
+
+logger = logging.getLogger('database')
+
+# Statements worth explaining
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH|UPDATE|DELETE)\b", re.IGNORECASE)
+# Comparisons an index can serve
+_COMPARISONS = {
+    operators.eq, operators.lt, operators.le, operators.gt, operators.ge,
+    operators.in_op, operators.between_op, operators.like_op, operators.startswith_op,
+}
+# Dialects whose plans are read by the advisor
+EXPLAIN_DIALECTS = ('sqlite', 'mysql', 'mariadb', 'postgresql')
+# SQLite plan lines of a full table scan, or of an index SQLite had to build for the query
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\S+)(?: AS (\S+))?$")
+_SQLITE_AUTOMATIC = re.compile(r"^(?:SCAN|SEARCH) (?:TABLE )?(\S+)(?: AS (\S+))? USING AUTOMATIC")
+
+@dataclass
+class StatementShape:
+    """A recorded statement shape.
+
+    Attributes:
+        key (str): The normalized statement.
+        statement (str): The SQL of the first execution.
+        parameters (Any): The parameters of the first execution, in the format of the driver.
+        clause (Optional[ClauseElement]): The SQLAlchemy construct of the statement, None for textual SQL.
+        count (int): Number of executions.
+    """
+    key:        str
+    statement:  str
+    parameters: typing.Any
+    clause:     typing.Optional[sqlalchemy.ClauseElement] = None
+    count:      int = 0
+
+@dataclass
+class IndexSuggestion:
+    """An index suggested by the advisor.
+
+    Attributes:
+        table (str): The table name.
+        columns (Tuple[str, ...]): The indexed columns.
+        name (str): The index name following the naming convention.
+        executions (int): Number of executions of the statements which scanned the table.
+        statements (List[str]): The normalized statements which scanned the table.
+    """
+    table:      str
+    columns:    typing.Tuple[str, ...]
+    name:       str
+    executions: int = 0
+    statements: typing.List[str] = field(default_factory=list)
+
+@dataclass
+class WorkloadRecorder:
+    """Recorder of the distinct statement shapes executed on engines.
+
+    Attributes:
+        max_shapes (int, optional): Maximum number of shapes kept, the least recent ones are dropped. Defaults to 1000.
+        duration (Optional[float], optional): Seconds after attach during which statements are recorded. Defaults to None, until detach.
+    """
+    max_shapes:     int = 1000
+    duration:       typing.Optional[float] = None
+    _shapes:        'OrderedDict[str, StatementShape]' = field(default_factory=OrderedDict, init=False, repr=False)
+    _engines:       typing.List[sqlalchemy.engine.Engine] = field(default_factory=list, init=False, repr=False)
+    _deadline:      float = field(default=float('inf'), init=False, repr=False)
+    _lock:          threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def shapes(self) -> typing.List[StatementShape]:
+        """The recorded shapes, most executed first."""
+        with self._lock:
+            return sorted(self._shapes.values(), key=lambda shape: -shape.count)
+
+    def attach(self, engine: sqlalchemy.engine.Engine) -> None:
+        """Method for recording the statements of an engine.
+
+        Args:
+            engine (Engine): The engine.
+        """
+        if self.duration is not None:
+            self._deadline = time.monotonic() + self.duration
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        self._engines.append(engine)
+
+    def detach(self) -> None:
+        """Method for removing the listeners from every attached engine. The shapes are kept."""
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+        self._engines.clear()
+
+    @contextlib.contextmanager
+    def recording(self, engine: sqlalchemy.engine.Engine) -> typing.Iterator['WorkloadRecorder']:
+        """Method for recording the statements of an engine within a with block."""
+        self.attach(engine)
+        try:
+            yield self
+        finally:
+            self.detach()
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        if executemany or not _EXPLAINABLE.match(statement) or time.monotonic() > self._deadline:
+            return
+        key = normalize_statement(statement)
+        with self._lock:
+            shape = self._shapes.get(key)
+            if shape is None:
+                compiled = getattr(context, 'compiled', None)
+                shape = self._shapes[key] = StatementShape(key, statement, parameters, getattr(compiled, 'statement', None))
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(key)
+            shape.count += 1
+
+def index_name(table: str, columns: typing.Sequence[str], metadata: typing.Optional[sqlalchemy.MetaData] = None) -> str:
+    """Function naming an index with the ix naming convention of the metadata.
+
+    Args:
+        table (str): The table name.
+        columns (Sequence[str]): The indexed columns.
+        metadata (Optional[MetaData], optional): The metadata holding the convention. Defaults to None, the metadata of the models.
+
+    Returns:
+        str: The index name, e.g. 'ix_users_role_id'.
+    """
+    if metadata is None:
+        from sqltoolbox.models.base import meta as metadata
+    convention = metadata.naming_convention.get('ix', 'ix_%(column_0_label)s')
+    labels = [f"{table}_{column}" for column in columns]
+    return convention % dict(
+        table_name=table,
+        column_0_name=columns[0], column_0_label=labels[0], column_0_key=columns[0],
+        column_0N_name=''.join(columns), column_0_N_name='_'.join(columns),
+        column_0N_label=''.join(labels), column_0_N_label='_'.join(labels),
+    )
+
+def _table_column(element: typing.Any) -> typing.Optional[typing.Tuple[str, str]]:
+    """ The table and column names of a column of a table or of an alias of a table """
+    if not isinstance(element, sqlalchemy.ColumnClause) or element.table is None:
+        return None
+    table = element.table
+    while isinstance(table, sqlalchemy.Alias):
+        table = table.element
+    if not isinstance(table, sqlalchemy.Table):
+        return None
+    return table.name, element.name
+
+def _aliases(clause: sqlalchemy.ClauseElement) -> typing.Dict[str, str]:
+    """ The table name behind each name of a FROM item of a statement """
+    aliases = {}
+    for element in visitors.iterate(clause):
+        if isinstance(element, sqlalchemy.Table):
+            aliases[element.name] = element.name
+        elif isinstance(element, sqlalchemy.Alias) and isinstance(element.element, sqlalchemy.Table):
+            aliases[element.name] = element.element.name
+    return aliases
+
+def _searched_columns(clause: sqlalchemy.ClauseElement) -> typing.Dict[str, typing.List[str]]:
+    """ The columns of each table the statement filters or joins on, in order of appearance """
+    columns: typing.Dict[str, typing.List[str]] = {}
+    for element in visitors.iterate(clause):
+        if not isinstance(element, sqlalchemy.BinaryExpression) or element.operator not in _COMPARISONS:
+            continue
+        for side in (element.left, element.right):
+            column = _table_column(side)
+            if column is not None and column[1] not in columns.setdefault(column[0], []):
+                columns[column[0]].append(column[1])
+    return columns
+
+def _scanned_tables(connection: sqlalchemy.engine.Connection, shape: StatementShape) -> typing.Set[str]:
+    """ The names, or aliases, of the tables fully scanned by the plan of a shape """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {shape.statement}", shape.parameters).all()
+        scanned = set()
+        for row in rows:
+            match = _SQLITE_SCAN.match(row[-1]) or _SQLITE_AUTOMATIC.match(row[-1])
+            if match:
+                scanned.add(match.group(2) or match.group(1))
+        return scanned
+    if dialect in ('mysql', 'mariadb'):
+        rows = connection.exec_driver_sql(f"EXPLAIN {shape.statement}", shape.parameters).mappings().all()
+        return {row['table'] for row in rows if row.get('type') == 'ALL' and row.get('table')}
+    if dialect == 'postgresql':
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {shape.statement}", shape.parameters).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        scanned, nodes = set(), [entry['Plan'] for entry in plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') == 'Seq Scan':
+                scanned.add(node.get('Alias') or node.get('Relation Name'))
+            nodes.extend(node.get('Plans', []))
+        return scanned
+    raise ValueError(f"The index advisor does not support the {dialect} dialect. Expected one of {list(EXPLAIN_DIALECTS)}")
+
+def suggest_indexes(engine: sqlalchemy.engine.Engine, shapes: typing.Iterable[StatementShape],
+                    metadata: typing.Optional[sqlalchemy.MetaData] = None) -> typing.List[IndexSuggestion]:
+    """Function explaining the recorded shapes and suggesting single column indexes for the fully scanned tables.
+
+    Shapes recorded from textual SQL are skipped, their filtered columns being unknown.
+
+    Args:
+        engine (Engine): The engine the statements ran on.
+        shapes (Iterable[StatementShape]): The shapes, e.g. WorkloadRecorder.shapes.
+        metadata (Optional[MetaData], optional): The metadata holding the naming convention. Defaults to None, the metadata of the models.
+
+    Returns:
+        List[IndexSuggestion]: The suggestions, the most executed first.
+
+    Raises:
+        ValueError: Raised if the plans of the dialect of the engine cannot be read.
+    """
+    if engine.dialect.name not in EXPLAIN_DIALECTS:
+        raise ValueError(f"The index advisor does not support the {engine.dialect.name} dialect. Expected one of {list(EXPLAIN_DIALECTS)}")
+
+    suggestions: typing.Dict[typing.Tuple[str, str], IndexSuggestion] = {}
+    with engine.connect() as connection:
+        inspector = sqlalchemy.inspect(connection)
+        indexed: typing.Dict[str, typing.Set[str]] = {}
+
+        for shape in shapes:
+            if shape.clause is None:
+                continue
+            try:
+                scanned = _scanned_tables(connection, shape)
+            except sqlalchemy.exc.DBAPIError as e:
+                logger.warning(f"Could not explain {shape.key}. {e}")
+                connection.rollback()
+                continue
+
+            aliases, searched = _aliases(shape.clause), _searched_columns(shape.clause)
+            for table in {aliases.get(name, name) for name in scanned}:
+                if table not in indexed:
+                    leading = {index['column_names'][0] for index in inspector.get_indexes(table) if index['column_names']}
+                    indexed[table] = leading | set(inspector.get_pk_constraint(table)['constrained_columns'][:1])
+                for column in searched.get(table, []):
+                    if column in indexed[table]:
+                        continue
+                    suggestion = suggestions.get((table, column))
+                    if suggestion is None:
+                        suggestion = suggestions[(table, column)] = IndexSuggestion(table, (column,), index_name(table, [column], metadata))
+                    suggestion.executions += shape.count
+                    suggestion.statements.append(shape.key)
+
+    result = sorted(suggestions.values(), key=lambda suggestion: -suggestion.executions)
+    for suggestion in result:
+        logger.info(f"Suggested index {suggestion.name} on {suggestion.table}({', '.join(suggestion.columns)}) "
+                    f"for {suggestion.executions} executions of {len(suggestion.statements)} statement(s).")
+    return result
+
+def render_revision(suggestions: typing.Iterable[IndexSuggestion]) -> typing.Tuple[str, str]:
+    """Function rendering the upgrade and downgrade code creating the suggested indexes.
+
+    Args:
+        suggestions (Iterable[IndexSuggestion]): The suggestions.
+
+    Returns:
+        Tuple[str, str]: The bodies of upgrade and downgrade, in the format of the script.py.mako templates.
+    """
+    suggestions = list(suggestions)
+    upgrade = ops.UpgradeOps(ops=[
+        ops.CreateIndexOp(conv(suggestion.name), suggestion.table, list(suggestion.columns)) for suggestion in suggestions
+    ])
+    downgrade = ops.DowngradeOps(ops=[
+        ops.DropIndexOp(conv(suggestion.name), table_name=suggestion.table) for suggestion in reversed(suggestions)
+    ])
+    return render_python_code(upgrade), render_python_code(downgrade)
+
+def write_revision(suggestions: typing.Iterable[IndexSuggestion], config: typing.Union[Config, str],
+                   message: str = 'add suggested indexes') -> typing.Optional[str]:
+    """Function writing the suggested indexes as a new alembic revision on top of the head.
+
+    The script template must render ``upgrades`` and ``downgrades``, as the single-alembic one does.
+
+    Args:
+        suggestions (Iterable[IndexSuggestion]): The suggestions.
+        config (Union[Config, str]): The alembic config, or the script location, e.g. 'single-alembic'.
+        message (str, optional): The message of the revision. Defaults to 'add suggested indexes'.
+
+    Returns:
+        Optional[str]: The path of the revision file, None if there is nothing to suggest.
+    """
+    suggestions = list(suggestions)
+    if not suggestions:
+        logger.info("No index to suggest.")
+        return None
+
+    script_directory = ScriptDirectory.from_config(config) if isinstance(config, Config) else ScriptDirectory(config)
+    upgrades, downgrades = render_revision(suggestions)
+    script = script_directory.generate_revision(alembic_util.rev_id(), message, head='head',
+                                                upgrades=upgrades, downgrades=downgrades)
+    logger.info(f"Wrote revision {script.revision} with {len(suggestions)} index(es) to {script.path}.")
+    return script.path
@@ -0,0 +1,224 @@
+""" Asyncio counterparts of the classes for Engine+Base combinations
+
+The async classes keep the construction API of the sync ones. Work that needs the
+database (creating tables, reflecting the schema) cannot run in ``__post_init__``,
+so it is deferred to ``prepare``. The objects can be used as async context managers
+which prepare the database on enter and dispose the engine on exit.
+"""
+import abc
+import typing
+import logging
+from dataclasses import dataclass
+
+import sqlalchemy
+from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from sqltoolbox.lite import install_pragmas
+from sqltoolbox.database import (
+    DatabaseConnection,
+    LiteDatabaseConnection,
+    AuthDatabaseConnection,
+    DeclarativeDatabaseBase,
+    AutoMappedDatabaseBase,
+)
+
+__all__ = [
+    'AsyncDeclarativeDatabase',
+    'AsyncDeclarativeLiteDatabase',
+    'AsyncAutoMappedDatabase',
+    'AsyncAutoMappedLiteDatabase',
+]
+
+logger = logging.getLogger('database')
+
+@dataclass(kw_only=True)
+class AsyncDatabaseConnection(DatabaseConnection, abc.ABC):
+    """Base abstract class for database connections built on an AsyncEngine.
+
+    Attributes:
+        session (AsyncSession): An async session object. It generates a new session for each call. Use it with an async context manager.
+        autocommit_session (AsyncSession): An async session object that begins a transaction. Use it with an async context manager.
+        engine (AsyncEngine): An async engine object.
+    """
+
+    @property
+    def session(self) -> AsyncSession:
+        """Property for an async session object that generates a new session for each call.
+
+        Only read access is allowed and it must be used with an async context manager.
+
+        Returns:
+            AsyncSession: An async session object
+        """
+        return self._session_factory()
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """Property for the async engine associated to the object
+
+        Returns:
+            AsyncEngine: A SQLAlchemy async engine object
+        """
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine: AsyncEngine) -> None:
+        """Setter for the engine property. It checks if the engine is a valid SQLAlchemy async engine.
+
+        Args:
+            engine (AsyncEngine): A SQLAlchemy async engine object
+
+        Raises:
+            TypeError: Raised if the engine is not a valid SQLAlchemy async engine.
+        """
+        if not isinstance(engine, AsyncEngine):
+            raise TypeError(f"Expected sqlalchemy.ext.asyncio.AsyncEngine, got {type(engine)}")
+        self._engine = engine
+
+    async def dispose(self) -> None:
+        """Method for disposing the connection pool of the engine."""
+        await self.engine.dispose()
+
+    async def __aenter__(self):
+        await self.prepare()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.dispose()
+
+    def _create_engine(self, connection_string: str, **engine_args: typing.Any) -> AsyncEngine:
+        """ Method for creating the async engine object for a connection string """
+        return create_async_engine(connection_string, **engine_args)
+
+    def _create_session_factory(self, engine: AsyncEngine) -> async_sessionmaker:
+        """ Method for creating the async session factory bound to the engine.
+
+        Objects are not expired on commit so their attributes can be read without an implicit IO call.
+        """
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+@dataclass(kw_only=True)
+class AsyncLiteDatabaseConnection(AsyncDatabaseConnection, LiteDatabaseConnection, abc.ABC):
+    """ Lite async connection abstract class, e.g. for the aiosqlite driver. """
+
+    def _create_engine(self, connection_string: str, pragmas: typing.Optional[typing.Dict[str, typing.Any]] = None,
+                       **engine_args: typing.Any) -> AsyncEngine:
+        """ Method for creating the async engine object, applying the PRAGMAs on every new DBAPI connection """
+        engine = super()._create_engine(connection_string, **engine_args)
+        if pragmas:
+            install_pragmas(engine, pragmas)
+        return engine
+
+@dataclass(kw_only=True)
+class AsyncAuthDatabaseConnection(AsyncDatabaseConnection, AuthDatabaseConnection, abc.ABC):
+    """ Complete async connection abstract class, e.g. for the aiomysql or asyncmy drivers. """
+
+    def _create_session_factory(self, engine: AsyncEngine) -> async_sessionmaker:
+        """ Method for creating the async session factory. Read replica routing is only available for sync sessions. """
+        if self.replica_hosts:
+            raise NotImplementedError("Read replica routing is not supported by async sessions")
+        return super()._create_session_factory(engine)
+
+@dataclass(kw_only=True)
+class AsyncDeclarativeDatabaseBase(DeclarativeDatabaseBase, abc.ABC):
+    """ Declarative base abstract class for async databases.
+
+    If create_tables is True, the tables are created by ``prepare``.
+    """
+
+    def __post_init__(self):
+        # Skip the sync table creation of DeclarativeDatabaseBase
+        super(DeclarativeDatabaseBase, self).__post_init__()
+
+    async def prepare(self) -> None:
+        """Method for creating the tables if create_tables is True."""
+        if self.create_tables:
+            logger.warning(f"Creating tables for {self.name}. This may create conflicts with alembic.")
+            await self._create_tables()
+
+    async def _create_tables(self):
+        """ Method for creating the all the tables from the base in the database """
+        async with self.engine.begin() as connection:
+            await connection.run_sync(self.base.metadata.create_all)
+
+@dataclass(kw_only=True)
+class AsyncAutoMappedDatabaseBase(AutoMappedDatabaseBase, abc.ABC):
+    """ Automapped base abstract class for async databases.
+
+    The Base is empty until ``prepare`` reflects the database schema.
+    """
+
+    def __post_init__(self):
+        self.Base = automap_base()
+        # Skip the sync reflection of AutoMappedDatabaseBase
+        super(AutoMappedDatabaseBase, self).__post_init__()
+
+    async def prepare(self) -> None:
+        """Method for reflecting the database schema into the automapped base."""
+        await self._base_preparation()
+
+    async def _base_preparation(self):
+        """ Method for preparing the automapped base reflecting the database schema """
+        async with self.engine.connect() as connection:
+            if self.reflection_cache is None:
+                self.Base = automap_base()
+                await connection.run_sync(self.Base.metadata.reflect)
+            else:
+                self.Base = automap_base(metadata=await connection.run_sync(self.reflection_cache.reflect_connection))
+        self.Base.prepare()
+
+class AsyncInspectionMixin:
+    """Mixin for inspecting the database schema through an async engine"""
+
+    def get_table_names(self) -> typing.List[str]:
+        """ Method for getting the table names from the database
+
+        Returns:
+            List[str]: A list of table names
+        """
+        return self.base.metadata.tables.keys()
+
+    async def get_database_names(self, starts_with=None, ends_with=None) -> typing.List[str]:
+        """ Method for getting the database names from the the SQL server
+
+        Args:
+            starts_with (Optional[str], optional): If given, only the databases starting with the given string are returned. Defaults to None.
+            ends_with (Optional[str], optional): If given, only the databases ending with the given string are returned. Defaults to None.
+
+        Returns:
+            List[str]: A list of database names
+        """
+        async with self.engine.connect() as connection:
+            schema_list = await connection.run_sync(
+                lambda sync_connection: sqlalchemy.inspect(sync_connection).get_schema_names()
+            )
+
+        if starts_with:
+            schema_list = [name for name in schema_list if name.startswith(starts_with)]
+
+        if ends_with:
+            schema_list = [name for name in schema_list if name.endswith(ends_with)]
+
+        return schema_list
+
+# Module API
+@dataclass(kw_only=True)
+class AsyncDeclarativeDatabase(AsyncAuthDatabaseConnection, AsyncDeclarativeDatabaseBase, AsyncInspectionMixin):
+    """ Async declarative database class for SQL databases"""
+    pass
+
+@dataclass(kw_only=True)
+class AsyncDeclarativeLiteDatabase(AsyncLiteDatabaseConnection, AsyncDeclarativeDatabaseBase, AsyncInspectionMixin):
+    """ Async declarative database class for SQLite database"""
+    pass
+
+@dataclass(kw_only=True)
+class AsyncAutoMappedDatabase(AsyncAuthDatabaseConnection, AsyncAutoMappedDatabaseBase, AsyncInspectionMixin):
+    """ Async automapped database class for SQL databases """
+    pass
+
+@dataclass(kw_only=True)
+class AsyncAutoMappedLiteDatabase(AsyncLiteDatabaseConnection, AsyncAutoMappedDatabaseBase, AsyncInspectionMixin):
+    """ Async automapped database class for SQLite database """
+    pass
@@ -0,0 +1,307 @@
+""" Module with the chunked backfill helper of the migrations
+
+Large data migrations are split in keyset-paginated chunks, each committed on its own, so
+locks are held for one chunk only. Progress is stored in a side table after each chunk and
+an interrupted backfill resumes after the last committed key when it runs again.
+
+Inside a revision, run it in an autocommit block so the chunks are not part of the
+migration transaction::
+
+    def upgrade() -> None:
+        op.add_column('users', sa.Column('status', sa.String(20), nullable=True))
+        with op.get_context().autocommit_block():
+            backfill(op.get_bind(), 'users', values={'status': 'active'},
+                     where=lambda users: users.c.status.is_(None), batch_size=5000, sleep=0.05)
+        op.alter_column('users', 'status', nullable=False)
+
+A completed backfill is skipped when it runs again. Downgrades undoing it must drop its progress
+so the next upgrade runs it again::
+
+    def downgrade() -> None:
+        drop_progress(op.get_bind(), 'users')
+        op.drop_column('users', 'status')
+
+The progress table is not part of the models: pass include_name to the comparisons, e.g.
+``context.configure(..., include_name=include_name)`` in env.py, so autogenerate and the
+drift check ignore it.
+
+Outside a revision, pass the result cache of the database so each committed chunk evicts the
+cached results of the table, e.g. ``backfill(db.engine, 'users', ..., cache=db.result_cache)``.
+"""
+import time
+import typing
+import logging
+import datetime
+from dataclasses import dataclass
+
+import sqlalchemy
+from sqlalchemy import Column, String, Text, Integer, Boolean, DateTime
+
+from sqltoolbox.caching import ResultCache
+from sqltoolbox.pagination import dump_key, load_key
+
+__all__ = [
+    'PROGRESS_TABLE',
+    'BackfillResult',
+    'backfill',
+    'drop_progress',
+    'include_name',
+]
+
+logger = logging.getLogger('database')
+
+PROGRESS_TABLE = 'sqltoolbox_backfill'
+
+Row = typing.Mapping[str, typing.Any]
+Where = typing.Union[sqlalchemy.ColumnElement, typing.Callable[[sqlalchemy.Table], sqlalchemy.ColumnElement], None]
+
+def include_name(name: typing.Optional[str], type_: str, parent_names: typing.Mapping[str, typing.Any]) -> bool:
+    """Function for the include_name hook of alembic's comparisons, skipping the progress table.
+
+    Args:
+        name (Optional[str]): The name of the reflected object.
+        type_ (str): The type of the object, e.g. 'table' or 'index'.
+        parent_names (Mapping[str, Any]): The names of the schema and table of the object.
+
+    Returns:
+        bool: False for the progress table, True otherwise.
+    """
+    return not (type_ == 'table' and name == PROGRESS_TABLE)
+
+def progress_table(metadata: typing.Optional[sqlalchemy.MetaData] = None) -> sqlalchemy.Table:
+    """Function returning the definition of the progress side table."""
+    return sqlalchemy.Table(
+        PROGRESS_TABLE, metadata if metadata is not None else sqlalchemy.MetaData(),
+        Column('name', String(255), primary_key=True),
+        Column('last_key', Text, nullable=True),
+        Column('rows', Integer, nullable=False, default=0),
+        Column('chunks', Integer, nullable=False, default=0),
+        Column('completed', Boolean, nullable=False, default=False),
+        Column('updated_at', DateTime, nullable=False),
+    )
+
+@dataclass
+class BackfillResult:
+    """Counts and throughput of a backfill.
+
+    Attributes:
+        name (str): The name of the backfill in the progress table.
+        rows (int): Number of rows written by this run.
+        chunks (int): Number of chunks committed by this run.
+        seconds (float): Wall time of this run.
+        resumed_from (Optional[Tuple[Any, ...]]): The key the run resumed after, None if it started from the beginning.
+        completed (bool): True once every chunk is committed.
+    """
+    name:           str
+    rows:           int = 0
+    chunks:         int = 0
+    seconds:        float = 0.0
+    resumed_from:   typing.Optional[typing.Tuple[typing.Any, ...]] = None
+    completed:      bool = False
+
+    @property
+    def rows_per_second(self) -> float:
+        """Throughput of the backfill."""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def _after(columns: typing.Sequence[sqlalchemy.ColumnElement], key: typing.Sequence[typing.Any]) -> sqlalchemy.ColumnElement:
+    """ Keyset condition selecting the rows after the key """
+    if len(columns) == 1:
+        return columns[0] > key[0]
+    return sqlalchemy.tuple_(*columns) > sqlalchemy.tuple_(*key)
+
+def _up_to(columns: typing.Sequence[sqlalchemy.ColumnElement], key: typing.Sequence[typing.Any]) -> sqlalchemy.ColumnElement:
+    """ Keyset condition selecting the rows up to the key included """
+    if len(columns) == 1:
+        return columns[0] <= key[0]
+    return sqlalchemy.tuple_(*columns) <= sqlalchemy.tuple_(*key)
+
+def backfill(bind: typing.Union[sqlalchemy.engine.Engine, sqlalchemy.engine.Connection], table: typing.Union[str, sqlalchemy.Table],
+             values: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+             transform: typing.Optional[typing.Callable[[typing.Sequence[sqlalchemy.Row]], typing.Iterable[Row]]] = None,
+             where: Where = None, key: typing.Optional[typing.Sequence[str]] = None, name: typing.Optional[str] = None,
+             batch_size: int = 1000, sleep: float = 0.0, log_every: int = 1,
+             cache: typing.Optional[ResultCache] = None) -> BackfillResult:
+    """Function updating the rows of a table in keyset-paginated chunks, each committed separately.
+
+    The rows are either updated in SQL with values, e.g. {'status': 'active'} or
+    {'fullname': users.c.name}, or in Python with transform, which receives the rows of a chunk and
+    returns the new values of each row, including its key columns.
+
+    A Connection must not be inside a transaction, unless it is in AUTOCOMMIT mode as in
+    alembic's autocommit_block. In AUTOCOMMIT mode the update of a chunk and its progress are
+    committed separately, so a chunk may be applied twice after a crash: keep the updates idempotent.
+    An Engine is used through a new connection.
+
+    Args:
+        bind (Union[Engine, Connection]): The engine or connection, e.g. op.get_bind().
+        table (Union[str, Table]): The table or its name, reflected if needed.
+        values (Optional[Mapping[str, Any]], optional): The values of the UPDATE, literals or SQL expressions. Defaults to None.
+        transform (Optional[Callable[[Sequence[Row]], Iterable[Mapping[str, Any]]]], optional): The Python transformation of a chunk. Defaults to None.
+        where (Union[ColumnElement, Callable[[Table], ColumnElement], None], optional): Restricts the rows to update. Defaults to None.
+        key (Optional[Sequence[str]], optional): The unique, indexed key columns of the pagination. Defaults to None, the primary key.
+        name (Optional[str], optional): The name of the backfill in the progress table. Defaults to None, the table name.
+        batch_size (int, optional): Number of rows per chunk. Defaults to 1000.
+        sleep (float, optional): Seconds to wait between chunks, leaving room to other transactions and replicas. Defaults to 0.
+        log_every (int, optional): Log the progress every log_every chunks. Defaults to 1.
+        cache (Optional[ResultCache], optional): The result cache evicting the table after each chunk, e.g. db.result_cache. Defaults to None.
+
+    Returns:
+        BackfillResult: Counts and throughput of this run.
+
+    Raises:
+        ValueError: Raised if not exactly one of values and transform is given, or the table has no key.
+        RuntimeError: Raised if the connection is inside a transaction that is not in AUTOCOMMIT mode.
+    """
+    if (values is None) == (transform is None):
+        raise ValueError("Exactly one of values and transform must be given")
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive integer, got {batch_size}")
+
+    if isinstance(bind, sqlalchemy.engine.Engine):
+        with bind.connect() as connection:
+            return backfill(connection, table, values, transform, where, key, name, batch_size, sleep, log_every, cache)
+
+    connection = bind
+    autocommit = connection.get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+    if connection.in_transaction() and not autocommit:
+        raise RuntimeError("backfill commits each chunk. Run it outside a transaction, "
+                           "e.g. inside op.get_context().autocommit_block() in a revision")
+
+    if isinstance(table, str):
+        table = sqlalchemy.Table(table, sqlalchemy.MetaData(), autoload_with=connection)
+    columns = [table.c[column] for column in key] if key else list(table.primary_key.columns)
+    if not columns:
+        raise ValueError(f"Table {table.name} has no primary key. Give the key columns")
+    condition = where(table) if callable(where) else where
+
+    name = name or table.name
+    progress = progress_table()
+    progress.create(connection, checkfirst=True)
+    _commit(connection, autocommit)
+
+    state = connection.execute(sqlalchemy.select(progress).where(progress.c.name == name)).mappings().first()
+    result = BackfillResult(name)
+    if state is not None and state['completed']:
+        logger.info(f"Backfill {name} already completed, skipping.")
+        result.completed = True
+        return result
+
+    last = load_key(state['last_key']) if state is not None and state['last_key'] else None
+    result.resumed_from = last
+    if last is not None:
+        logger.info(f"Resuming backfill {name} after key {last}.")
+
+    start = time.perf_counter()
+    while True:
+        query = sqlalchemy.select(*(columns if values is not None else [table])).order_by(*columns).limit(batch_size)
+        if condition is not None:
+            query = query.where(condition)
+        if last is not None:
+            query = query.where(_after(columns, last))
+        rows = connection.execute(query).all()
+        if not rows:
+            break
+
+        upper = tuple(getattr(rows[-1], column.name) for column in columns)
+        if values is not None:
+            statement = sqlalchemy.update(table).where(_up_to(columns, upper)).values(values)
+            if condition is not None:
+                statement = statement.where(condition)
+            if last is not None:
+                statement = statement.where(_after(columns, last))
+            written = connection.execute(statement).rowcount
+        else:
+            written = _apply(connection, table, columns, list(transform(rows)))
+
+        result.rows += max(written, 0)
+        result.chunks += 1
+        last = upper
+        _save(connection, progress, name, state, last, result, completed=False)
+        state = state if state is not None else {'rows': 0, 'chunks': 0}
+        _commit(connection, autocommit)
+        if cache is not None:
+            cache.invalidate(table)
+
+        if result.chunks % log_every == 0:
+            elapsed = time.perf_counter() - start
+            logger.info(f"Backfill {name}: {result.chunks} chunks, {result.rows} rows, last key {last}, "
+                        f"{result.rows / elapsed if elapsed else 0.0:.0f} rows/s.")
+        if len(rows) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    _save(connection, progress, name, state, last, result, completed=True)
+    _commit(connection, autocommit)
+    result.completed = True
+    result.seconds = time.perf_counter() - start
+    logger.info(f"Backfill {name} completed: {result.rows} rows in {result.chunks} chunks "
+                f"({result.rows_per_second:.0f} rows/s).")
+    return result
+
+def drop_progress(bind: typing.Union[sqlalchemy.engine.Engine, sqlalchemy.engine.Connection], name: str) -> bool:
+    """Function deleting the progress of a backfill, so it runs again from the beginning, e.g. in downgrade().
+
+    A Connection inside a transaction, e.g. op.get_bind() in a revision, deletes it in that transaction.
+
+    Args:
+        bind (Union[Engine, Connection]): The engine or connection, e.g. op.get_bind().
+        name (str): The name of the backfill, by default the name of its table.
+
+    Returns:
+        bool: True if the backfill had a progress row.
+    """
+    if isinstance(bind, sqlalchemy.engine.Engine):
+        with bind.begin() as connection:
+            return drop_progress(connection, name)
+    if not bind.in_transaction():
+        with bind.begin():
+            return drop_progress(bind, name)
+
+    if not sqlalchemy.inspect(bind).has_table(PROGRESS_TABLE):
+        return False
+    progress = progress_table()
+    deleted = bind.execute(sqlalchemy.delete(progress).where(progress.c.name == name)).rowcount
+    if deleted:
+        logger.info(f"Dropped the progress of backfill {name}.")
+    return deleted > 0
+
+def _commit(connection: sqlalchemy.engine.Connection, autocommit: bool) -> None:
+    """ Commit the current chunk. In AUTOCOMMIT mode the statements are already committed and the
+    transaction of the connection belongs to the caller, e.g. alembic """
+    if not autocommit:
+        connection.commit()
+
+def _apply(connection: sqlalchemy.engine.Connection, table: sqlalchemy.Table,
+           columns: typing.Sequence[sqlalchemy.Column], rows: typing.List[Row]) -> int:
+    """ Update each row with its transformed values, executemany style """
+    if not rows:
+        return 0
+    keys = {column.name for column in columns}
+    updated = [name for name in rows[0] if name not in keys]
+    statement = (
+        sqlalchemy.update(table)
+        .where(*(column == sqlalchemy.bindparam(f"key_{column.name}") for column in columns))
+        .values({name: sqlalchemy.bindparam(f"new_{name}") for name in updated})
+    )
+    connection.execute(statement, [
+        {**{f"key_{name}": row[name] for name in keys}, **{f"new_{name}": row[name] for name in updated}}
+        for row in rows
+    ])
+    return len(rows)
+
+def _save(connection: sqlalchemy.engine.Connection, progress: sqlalchemy.Table, name: str, state: typing.Any,
+          last: typing.Optional[typing.Tuple[typing.Any, ...]], result: BackfillResult, completed: bool) -> None:
+    """ Insert or update the progress row of the backfill. state holds the totals of the previous runs """
+    row = dict(
+        last_key=dump_key(last) if last is not None else None,
+        rows=(state['rows'] if state is not None else 0) + result.rows,
+        chunks=(state['chunks'] if state is not None else 0) + result.chunks,
+        completed=completed,
+        updated_at=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+    )
+    if state is None:
+        connection.execute(sqlalchemy.insert(progress).values(name=name, **row))
+    else:
+        connection.execute(sqlalchemy.update(progress).where(progress.c.name == name).values(**row))
@@ -0,0 +1,183 @@
+""" Module with the bulk write helpers of the database classes
+
+Rows are streamed in chunks through Core ``insert()`` constructs executed with a list of
+parameters, so the dialect can use executemany or batched INSERT..VALUES (insertmanyvalues)
+instead of the ORM unit of work.
+"""
+import time
+import typing
+import logging
+import itertools
+from dataclasses import dataclass
+
+import sqlalchemy
+
+__all__ = [
+    'BulkMixin',
+    'BulkResult',
+]
+
+logger = logging.getLogger('database')
+
+Row = typing.Mapping[str, typing.Any]
+
+@dataclass
+class BulkResult:
+    """Counts and throughput of a bulk operation.
+
+    Attributes:
+        rows (int): Number of rows sent to the database.
+        chunks (int): Number of executemany calls.
+        seconds (float): Wall time of the operation.
+    """
+    rows:       int = 0
+    chunks:     int = 0
+    seconds:    float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Throughput of the operation."""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def get_table(model_or_table: typing.Any) -> sqlalchemy.Table:
+    """Function returning the table of a mapped class, or the table itself.
+
+    Args:
+        model_or_table (Any): A mapped class or a Table object.
+
+    Returns:
+        Table: A SQLAlchemy table object
+    """
+    if isinstance(model_or_table, sqlalchemy.Table):
+        return model_or_table
+    return sqlalchemy.inspect(model_or_table).local_table
+
+def chunked(rows: typing.Iterable[Row], chunk_size: int) -> typing.Iterator[typing.List[Row]]:
+    """Function splitting an iterable of rows into lists of at most chunk_size rows.
+
+    Args:
+        rows (Iterable[Mapping[str, Any]]): The rows to split.
+        chunk_size (int): The maximum size of each chunk.
+
+    Yields:
+        List[Mapping[str, Any]]: A chunk of rows.
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be a positive integer, got {chunk_size}")
+
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, chunk_size)):
+        yield chunk
+
+class BulkMixin:
+    """Mixin for writing large amounts of rows through Core inserts"""
+
+    def bulk_insert(self, model_or_table: typing.Any, rows: typing.Iterable[Row], chunk_size: int = 1000) -> BulkResult:
+        """Method for inserting rows in chunks within a single transaction.
+
+        Args:
+            model_or_table (Any): A mapped class or a Table object.
+            rows (Iterable[Mapping[str, Any]]): The rows to insert, as dictionaries keyed by column name.
+            chunk_size (int, optional): Number of rows sent per executemany call. Defaults to 1000.
+
+        Returns:
+            BulkResult: Counts and throughput of the insert.
+        """
+        table = get_table(model_or_table)
+        return self._bulk_execute(table, sqlalchemy.insert(table), rows, chunk_size)
+
+    def bulk_upsert(self, model_or_table: typing.Any, rows: typing.Iterable[Row], conflict_cols: typing.List[str],
+                    update_cols: typing.Optional[typing.List[str]] = None, chunk_size: int = 1000) -> BulkResult:
+        """Method for inserting rows in chunks, updating the existing rows that conflict.
+
+        Uses INSERT .. ON CONFLICT on SQLite and PostgreSQL and INSERT .. ON DUPLICATE KEY UPDATE on MySQL.
+        MySQL resolves conflicts against every unique key of the table, not only conflict_cols.
+
+        Args:
+            model_or_table (Any): A mapped class or a Table object.
+            rows (Iterable[Mapping[str, Any]]): The rows to upsert, as dictionaries keyed by column name.
+            conflict_cols (List[str]): The columns of the unique constraint detecting the conflicts.
+            update_cols (Optional[List[str]], optional): The columns updated on conflict. Defaults to None, every column of the first row except conflict_cols.
+            chunk_size (int, optional): Number of rows sent per executemany call. Defaults to 1000.
+
+        Returns:
+            BulkResult: Counts and throughput of the upsert.
+
+        Raises:
+            NotImplementedError: Raised if the dialect has no upsert syntax.
+        """
+        table = get_table(model_or_table)
+        iterator = iter(rows)
+        first = next(iterator, None)
+        if first is None:
+            return BulkResult()
+
+        if update_cols is None:
+            update_cols = [name for name in first if name not in conflict_cols]
+
+        statement = self._upsert_statement(table, conflict_cols, update_cols)
+        return self._bulk_execute(table, statement, itertools.chain([first], iterator), chunk_size)
+
+    def _upsert_statement(self, table: sqlalchemy.Table, conflict_cols: typing.List[str],
+                          update_cols: typing.List[str]) -> sqlalchemy.Insert:
+        """ Method for building the dialect specific upsert statement """
+        dialect = self.engine.dialect.name
+
+        if dialect in ('sqlite', 'postgresql'):
+            # The dialect modules are imported here to keep them out of the import time of the package
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(table)
+            if not update_cols:
+                return statement.on_conflict_do_nothing(index_elements=conflict_cols)
+            return statement.on_conflict_do_update(
+                index_elements=conflict_cols,
+                set_={name: statement.excluded[name] for name in update_cols},
+            )
+
+        if dialect in ('mysql', 'mariadb'):
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(table)
+            # A no-op assignment keeps the existing row when there is nothing to update
+            columns = update_cols or conflict_cols[:1]
+            return statement.on_duplicate_key_update({name: statement.inserted[name] for name in columns})
+
+        raise NotImplementedError(f"Upsert is not supported for dialect {dialect}")
+
+    def _bulk_execute(self, table: sqlalchemy.Table, statement: sqlalchemy.Insert,
+                      rows: typing.Iterable[Row], chunk_size: int) -> BulkResult:
+        """ Method for executing a statement with chunks of rows in a single transaction """
+        try:
+            with self.engine.begin() as connection:
+                return execute_chunks(connection, table, statement, rows, chunk_size)
+        finally:
+            self._invalidate_result_cache(table)
+
+def execute_chunks(connection: sqlalchemy.engine.Connection, table: sqlalchemy.Table, statement: sqlalchemy.Insert,
+                   rows: typing.Iterable[Row], chunk_size: int) -> BulkResult:
+    """Function executing a statement with chunks of rows on a connection.
+
+    Args:
+        connection (Connection): A SQLAlchemy connection object
+        table (Table): The table written by the statement.
+        statement (Insert): The insert statement.
+        rows (Iterable[Mapping[str, Any]]): The rows, as dictionaries keyed by column name.
+        chunk_size (int): Number of rows sent per executemany call.
+
+    Returns:
+        BulkResult: Counts and throughput of the operation.
+    """
+    result = BulkResult()
+    start = time.perf_counter()
+
+    for chunk in chunked(rows, chunk_size):
+        connection.execute(statement, chunk)
+        result.rows += len(chunk)
+        result.chunks += 1
+
+    result.seconds = time.perf_counter() - start
+    logger.debug(f"Bulk wrote {result.rows} rows into {table.name} in {result.chunks} chunks "
+                 f"({result.rows_per_second:.0f} rows/s).")
+    return result
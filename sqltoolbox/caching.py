@@ -0,0 +1,392 @@
+""" Module with the query result cache of the database classes
+
+ORM SELECTs executed by the sessions of a database are intercepted with the ``do_orm_execute``
+event. Their result is frozen and stored in a backend keyed by the compiled SQL and the bound
+parameters, then merged back into the calling session on later executions, following the
+dogpile.cache example of the SQLAlchemy documentation.
+
+Entries are indexed by the tables they read, including the tables of the relationships loaded
+eagerly by loader options or by the mappers. The tables written by a session are collected
+with ``after_flush`` and their entries are evicted in ``after_commit``. The Core writes of the
+database class, e.g. bulk_insert, evict the entries of their table once committed. Writes made
+outside the database object, e.g. by other processes, are only caught up by the TTL.
+"""
+import abc
+import time
+import hashlib
+import typing
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy import event, util
+from sqlalchemy.orm import Mapper, RelationshipProperty, Session, ORMExecuteState, loading
+from sqlalchemy.sql.util import find_tables
+
+__all__ = [
+    'CacheBackend',
+    'CacheStats',
+    'MemoryBackend',
+    'ResultCache',
+    'ResultCacheMixin',
+    'read_tables',
+]
+
+logger = logging.getLogger('database')
+
+# Execution option enabling or disabling the cache for a statement, e.g. select(User).execution_options(result_cache=False)
+CACHE_OPTION = 'result_cache'
+# Session.info keys of the tables written by the current transaction
+WRITTEN_KEY = 'sqltoolbox_written_tables'
+# Loader strategies of the relationships loaded along with their parent statement
+EAGER_STRATEGIES = ('joined', 'selectin', 'subquery', 'immediate')
+
+class CacheBackend(abc.ABC):
+    """Interface of the result cache storage. Implementations must be thread safe."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> typing.Any:
+        """Method returning the value stored under the key, None if missing or expired."""
+
+    @abc.abstractmethod
+    def set(self, key: str, value: typing.Any, tables: typing.Iterable[str]) -> None:
+        """Method storing a value read from the given tables."""
+
+    @abc.abstractmethod
+    def invalidate(self, tables: typing.Iterable[str]) -> int:
+        """Method removing the values read from any of the tables, returning how many were removed."""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Method removing every value."""
+
+@dataclass
+class MemoryBackend(CacheBackend):
+    """In-process backend with least recently used eviction and a time to live.
+
+    Attributes:
+        max_entries (int, optional): Maximum number of entries. Defaults to 1024.
+        ttl (Optional[float], optional): Seconds an entry is served after being stored. Defaults to 300. None means no expiry.
+    """
+    max_entries:    int = 1024
+    ttl:            typing.Optional[float] = 300.0
+    evictions:      int = field(default=0, init=False)
+    _entries:       'OrderedDict[str, typing.Tuple[float, typing.Any, typing.FrozenSet[str]]]' = field(default_factory=OrderedDict, init=False, repr=False)
+    _by_table:      typing.Dict[str, typing.Set[str]] = field(default_factory=dict, init=False, repr=False)
+    _lock:          threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.max_entries < 1:
+            raise ValueError(f"max_entries must be a positive integer, got {self.max_entries}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, _ = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: typing.Any, tables: typing.Iterable[str]) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+        tables = frozenset(tables)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, tables)
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables: typing.Iterable[str]) -> int:
+        with self._lock:
+            keys = set().union(*(self._by_table.get(table, ()) for table in tables))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+    def _remove(self, key: str) -> None:
+        """ Remove an entry and its table index references. The lock must be held """
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+@dataclass
+class CacheStats:
+    """Counters for a result cache.
+
+    Attributes:
+        hits (int): Number of executions served from the cache.
+        misses (int): Number of cacheable executions sent to the database.
+        bypassed (int): Number of selects not cached, e.g. in a transaction with pending writes.
+        invalidations (int): Number of entries evicted by writes.
+    """
+    hits:           int = 0
+    misses:         int = 0
+    bypassed:       int = 0
+    invalidations:  int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of cacheable executions served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+@dataclass
+class ResultCache:
+    """Result cache installed on a session factory.
+
+    Attributes:
+        metadata (MetaData): The metadata of the database, used to find the tables affected by a write.
+        backend (CacheBackend, optional): The storage of the results. Defaults to a MemoryBackend.
+        cache_all (bool, optional): If True, every ORM select is cached unless it sets the result_cache=False execution option.
+            If False, only the selects setting result_cache=True are. Defaults to True.
+    """
+    metadata:   sqlalchemy.MetaData
+    backend:    CacheBackend = field(default_factory=MemoryBackend)
+    cache_all:  bool = True
+    _stats:     CacheStats = field(default_factory=CacheStats, init=False, repr=False)
+    _statement_cache: typing.MutableMapping[typing.Any, str] = field(default_factory=lambda: util.LRUCache(1000), init=False, repr=False)
+    _lock:      threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def stats(self) -> CacheStats:
+        """Snapshot of the cache counters."""
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def install(self, target: typing.Any) -> None:
+        """Method for listening to the sessions of a session factory or a session class.
+
+        Args:
+            target (Union[sessionmaker, Session]): The session factory.
+        """
+        event.listen(target, 'do_orm_execute', self._do_orm_execute)
+        event.listen(target, 'after_flush', self._after_flush)
+        event.listen(target, 'after_commit', self._after_commit)
+        event.listen(target, 'after_transaction_end', self._after_transaction_end)
+
+    def uninstall(self, target: typing.Any) -> None:
+        """Method for removing the listeners installed on a session factory."""
+        event.remove(target, 'do_orm_execute', self._do_orm_execute)
+        event.remove(target, 'after_flush', self._after_flush)
+        event.remove(target, 'after_commit', self._after_commit)
+        event.remove(target, 'after_transaction_end', self._after_transaction_end)
+
+    def invalidate(self, *tables: typing.Union[str, sqlalchemy.Table]) -> int:
+        """Method for evicting the entries reading the tables, e.g. after a Core write outside a session.
+
+        Tables whose rows are deleted or updated by foreign keys with ON DELETE / ON UPDATE actions are evicted too.
+
+        Args:
+            *tables (Union[str, Table]): The written tables or their names.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        names = self._affected_tables(getattr(table, 'name', table) for table in tables)
+        count = self.backend.invalidate(names)
+        with self._lock:
+            self._stats.invalidations += count
+        if count:
+            logger.debug(f"Invalidated {count} cached results of tables {sorted(names)}.")
+        return count
+
+    def clear(self) -> None:
+        """Method for removing every entry and resetting the counters."""
+        self.backend.clear()
+        with self._lock:
+            self._stats = CacheStats()
+
+    def _affected_tables(self, names: typing.Iterable[str]) -> typing.Set[str]:
+        """ Add to the written tables the tables whose foreign keys cascade from them """
+        affected = set(names)
+        pending = list(affected)
+        while pending:
+            name = pending.pop()
+            for table in self.metadata.tables.values():
+                if table.name in affected:
+                    continue
+                for key in table.foreign_keys:
+                    if key.column.table.name == name and (key.ondelete or key.onupdate):
+                        affected.add(table.name)
+                        pending.append(table.name)
+                        break
+        return affected
+
+    def _cacheable(self, state: ORMExecuteState) -> bool:
+        """ Whether the result of an execution can be served from and stored in the cache """
+        if not state.is_select or state.is_relationship_load or state.is_column_load:
+            return False
+        if not state.execution_options.get(CACHE_OPTION, self.cache_all):
+            return False
+        if state.statement._for_update_arg is not None or isinstance(state.parameters, list):
+            return False
+        # Streamed results are consumed in batches, and populate_existing must refresh the instances from the database
+        options = state.execution_options
+        if options.get('yield_per') or options.get('stream_results') or options.get('populate_existing'):
+            return False
+        return True
+
+    def _key(self, state: ORMExecuteState) -> typing.Optional[str]:
+        """ Key of an execution: the compiled SQL and the bound parameters """
+        cache_key = state.statement._generate_cache_key()
+        if cache_key is None:
+            return None
+        offline = cache_key.to_offline_string(self._statement_cache, state.statement, state.parameters or {})
+        return hashlib.sha256(offline.encode()).hexdigest()
+
+    def _do_orm_execute(self, state: ORMExecuteState) -> typing.Optional[sqlalchemy.engine.Result]:
+        if state.is_insert or state.is_update or state.is_delete:
+            # ORM enabled DML, e.g. session.execute(update(User)), does not go through the flush
+            state.session.info.setdefault(WRITTEN_KEY, set()).add(state.statement.table.name)
+            return None
+
+        if not self._cacheable(state):
+            return None
+
+        key = self._key(state)
+        if key is None or state.session.info.get(WRITTEN_KEY):
+            # Uncommitted writes of this transaction must be read from the database, and not cached
+            with self._lock:
+                self._stats.bypassed += 1
+            return None
+
+        frozen = self.backend.get(key)
+        with self._lock:
+            if frozen is None:
+                self._stats.misses += 1
+            else:
+                self._stats.hits += 1
+
+        if frozen is None:
+            frozen = state.invoke_statement().freeze()
+            self.backend.set(key, frozen, read_tables(state.statement))
+
+        return loading.merge_frozen_result(state.session, state.statement, frozen, load=False)()
+
+    @staticmethod
+    def _after_flush(session: Session, flush_context: typing.Any) -> None:
+        written = session.info.setdefault(WRITTEN_KEY, set())
+        for instance in (*session.new, *session.dirty, *session.deleted):
+            mapper = sqlalchemy.inspect(instance).mapper
+            written.update(table.name for table in mapper.tables)
+
+    def _after_commit(self, session: Session) -> None:
+        written = session.info.pop(WRITTEN_KEY, None)
+        if written:
+            self.invalidate(*written)
+
+    @staticmethod
+    def _after_transaction_end(session: Session, transaction: typing.Any) -> None:
+        if transaction.parent is None:
+            # Rolled back writes never reached the database
+            session.info.pop(WRITTEN_KEY, None)
+
+def read_tables(statement: typing.Any) -> typing.Set[str]:
+    """Function returning the names of the tables read by a select, eager loaded relationships included.
+
+    Tables joined by loader options, e.g. joinedload(User.addresses), or loaded by a second select,
+    e.g. selectinload(User.addresses), are not in the statement itself: they are taken from the
+    paths of the loader options and from the relationships configured with an eager lazy strategy.
+
+    Args:
+        statement (Any): The select.
+
+    Returns:
+        Set[str]: The table names.
+    """
+    tables = {table.name for table in find_tables(statement, include_joins=True)}
+    mappers: typing.List[Mapper] = []
+    for description in getattr(statement, 'column_descriptions', ()):
+        entity = description.get('entity')
+        if entity is not None:
+            mappers.append(sqlalchemy.inspect(entity).mapper)
+
+    for option in getattr(statement, '_with_options', ()):
+        for element in getattr(option, 'context', ()):
+            for item in element.path.natural_path:
+                if isinstance(item, RelationshipProperty):
+                    if item.secondary is not None:
+                        tables.update(table.name for table in find_tables(item.secondary))
+                elif hasattr(item, 'mapper'):
+                    mappers.append(item.mapper)
+
+    seen: typing.Set[Mapper] = set()
+    while mappers:
+        mapper = mappers.pop()
+        if mapper in seen:
+            continue
+        seen.add(mapper)
+        tables.update(table.name for table in mapper.tables)
+        for relationship in mapper.relationships:
+            if relationship.lazy in EAGER_STRATEGIES:
+                mappers.append(relationship.mapper)
+                if relationship.secondary is not None:
+                    tables.update(table.name for table in find_tables(relationship.secondary))
+    return tables
+
+class ResultCacheMixin:
+    """Mixin for caching the results of the ORM selects of the sessions"""
+
+    @property
+    def result_cache(self) -> typing.Optional[ResultCache]:
+        """The result cache of the sessions, None while disabled."""
+        return getattr(self, '_result_cache', None)
+
+    def enable_result_cache(self, ttl: typing.Optional[float] = 300.0, max_entries: int = 1024,
+                            backend: typing.Optional[CacheBackend] = None, cache_all: bool = True) -> ResultCache:
+        """Method for caching the results of the ORM selects run by the sessions of the database.
+
+        Statements can opt out, or in with cache_all=False, with the result_cache execution option.
+
+        Args:
+            ttl (Optional[float], optional): Seconds a result is served for the default backend. Defaults to 300. None means no expiry.
+            max_entries (int, optional): Maximum number of results of the default backend. Defaults to 1024.
+            backend (Optional[CacheBackend], optional): A custom storage, ttl and max_entries are then ignored. Defaults to None, a MemoryBackend.
+            cache_all (bool, optional): If False, only the selects with the result_cache=True execution option are cached. Defaults to True.
+
+        Returns:
+            ResultCache: The result cache.
+        """
+        self.disable_result_cache()
+        cache = ResultCache(
+            metadata=self.base.metadata,
+            backend=backend if backend is not None else MemoryBackend(max_entries=max_entries, ttl=ttl),
+            cache_all=cache_all,
+        )
+        cache.install(self._session_factory)
+        self._result_cache = cache
+        return cache
+
+    def disable_result_cache(self) -> None:
+        """Method for removing the result cache. The cached results are discarded."""
+        if self.result_cache is not None:
+            self.result_cache.uninstall(self._session_factory)
+            self.result_cache.clear()
+            self._result_cache = None
+
+    def _invalidate_result_cache(self, *tables: typing.Union[str, sqlalchemy.Table]) -> None:
+        """ Method for evicting the cached results of tables written outside the sessions, e.g. by bulk_insert """
+        if self.result_cache is not None:
+            self.result_cache.invalidate(*tables)
@@ -1,15 +1,33 @@
 """ Proxy module for database config.
 
-Core classes for building declarative and automapped databases
+Core classes for building declarative and automapped databases.
+
+Nothing is read or configured at import time. The settings are parsed from the environment
+and the .env file on the first call to get_settings, or the first access to
+``sqltoolbox.config.settings``, which also applies the logging configuration once.
 """
+import typing
 import logging.config
+import threading
 from pathlib import Path
+from functools import lru_cache
+
 from pydantic import BaseSettings
 
+__all__ = [
+    'BASE_DIR',
+    'LOGGING_CONFIG',
+    'DatabaseSettings',
+    'LiteDatabaseSettings',
+    'configure_logging',
+    'get_settings',
+]
+
 BASE_DIR = Path(__file__).parents[1].resolve()
+LOGGING_CONFIG = BASE_DIR / 'config' / 'logging.ini'
 
-# Load Logging config
-logging.config.fileConfig(BASE_DIR / 'config'/'logging.ini')
+_logging_lock = threading.Lock()
+_logging_configured = False
 
 class LiteDatabaseSettings(BaseSettings):
     """Database settings for database connection"""
@@ -25,7 +43,39 @@ class DatabaseSettings(LiteDatabaseSettings):
     """Database settings for database connection"""
     USER:       str
     PASSWORD:   str
+    ASYNC_DRIVER:   str = 'aiomysql'
+
+def configure_logging(path: typing.Union[str, Path] = LOGGING_CONFIG, force: bool = False) -> None:
+    """Function applying the logging configuration file. Only the first call has an effect unless force is True.
+
+    Loggers created before the call, e.g. by modules imported earlier, are kept enabled.
+
+    Args:
+        path (Union[str, Path], optional): The logging configuration file. Defaults to config/logging.ini.
+        force (bool, optional): If True, the file is applied again. Defaults to False.
+    """
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured and not force:
+            return
+        logging.config.fileConfig(path, disable_existing_loggers=False)
+        _logging_configured = True
+
+@lru_cache(maxsize=None)
+def get_settings() -> DatabaseSettings:
+    """Function returning the database settings, parsed once on first use.
 
-settings = DatabaseSettings()
+    Returns:
+        DatabaseSettings: The settings read from the environment and the .env file.
 
+    Raises:
+        ValidationError: Raised if a required setting is missing.
+    """
+    configure_logging()
+    return DatabaseSettings()
 
+def __getattr__(name: str) -> typing.Any:
+    # Lazy module attribute kept for `from sqltoolbox.config import settings`
+    if name == 'settings':
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
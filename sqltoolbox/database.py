@@ -11,6 +11,18 @@ from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.automap import automap_base
 
 from sqltoolbox.models.base import create_declarative_base
+from sqltoolbox.registry import EngineRegistry
+from sqltoolbox.reflection import ReflectionCache, LazyClasses
+from sqltoolbox.bulk import BulkMixin
+from sqltoolbox.streaming import StreamingMixin
+from sqltoolbox.pagination import PaginationMixin
+from sqltoolbox.export import ExportMixin
+from sqltoolbox.instrumentation import InstrumentationMixin
+from sqltoolbox.caching import ResultCacheMixin
+from sqltoolbox.loading import LoadingMixin
+from sqltoolbox.inspection import CachedInspector
+from sqltoolbox.replicas import ReplicaRouter, RoutingSession
+from sqltoolbox.lite import LiteBulkLoadMixin, LiteTemplateMixin, PROFILES, install_pragmas, is_memory_database
 
 __all__ = [
     'DeclarativeDatabase',
@@ -18,6 +30,8 @@ __all__ = [
     'AutoMappedDatabase',
     'AutoMappedLiteDatabase',
     'create_declarative_base',
+    'EngineRegistry',
+    'ReflectionCache',
 ]
 
 logger = logging.getLogger('database')
@@ -35,6 +49,7 @@ class DatabaseConnection(abc.ABC):
         echo (bool, optional): Controls the verbosity of the engine. Defaults to False.
         future (bool, optional): Use the SQLAlchemy 2.0 API. Defaults to True.
         engine_args (Dict[str, Any], optional): Additional arguments to be passed to the engine creation. Defaults to an empty dictionary.
+        registry (Optional[EngineRegistry], optional): Registry used to share engines between calls and objects. Defaults to None, a new engine is created on each call.
         session (Session): A session object. It generates a new session for each call. Use it with a context manager.
         autocommit_session (Session): A session object that begins a transaction. Use it with a context manager.
         engine (Engine): An engine object.
@@ -49,10 +64,11 @@ class DatabaseConnection(abc.ABC):
     echo:           bool = False
     future:         bool = True
     engine_args:    typing.Dict[str, typing.Any] = field(default_factory=dict)
+    registry:       typing.Optional[EngineRegistry] = None
 
     def __post_init__(self) -> None:
         self._engine: sqlalchemy.engine.Engine = self.generate_engine()
-        self._session_factory = sessionmaker(self._engine)
+        self._session_factory = self._create_session_factory(self._engine)
         super().__post_init__()
 
     @property
@@ -114,6 +130,8 @@ class DatabaseConnection(abc.ABC):
     # Engine factory methods
     def generate_engine(self, name: typing.Optional[str] = None) -> sqlalchemy.engine.Engine:
         """Method for creating a new engine object for the given database name.
+
+        If a registry is set, the engine is shared with every call using the same connection string and engine arguments.
         
         Args:
             name (Optional[str], optional): The name of the database. Defaults to None. If None, the name of the object is used.
@@ -122,7 +140,18 @@ class DatabaseConnection(abc.ABC):
             Engine: A SQLAlchemy engine object  
         """
         connection_string: str = self._create_connection_string(name=name if name else self.name)
-        return sqlalchemy.create_engine(connection_string, echo=self.echo, future=self.future, **self.engine_args)
+        return self._engine_for(connection_string, self._engine_args(name if name else self.name))
+
+    def _engine_for(self, connection_string: str, engine_args: typing.Dict[str, typing.Any]) -> sqlalchemy.engine.Engine:
+        """ Method for creating the engine of a connection string, or getting it from the registry """
+        if self.registry is None:
+            return self._create_engine(connection_string, **engine_args)
+
+        return self.registry.get(
+            connection_string,
+            engine_args,
+            lambda: self._create_engine(connection_string, **engine_args),
+        )
 
     def get_engines_from_list(self, database_list: typing.List[str]) -> typing.Dict[str, sqlalchemy.engine.Engine]:
         """Method for creating a dictionary with multiple engines for the given database names.
@@ -135,6 +164,18 @@ class DatabaseConnection(abc.ABC):
         """
         return {name: self.generate_engine(name=name) for name in database_list}
 
+    def _engine_args(self, name: str) -> typing.Dict[str, typing.Any]:
+        """ Method for building the arguments of the engine creation for a database name """
+        return dict(echo=self.echo, future=self.future, **self.engine_args)
+
+    def _create_engine(self, connection_string: str, **engine_args: typing.Any) -> sqlalchemy.engine.Engine:
+        """ Method for creating the engine object for a connection string """
+        return sqlalchemy.create_engine(connection_string, **engine_args)
+
+    def _create_session_factory(self, engine: sqlalchemy.engine.Engine) -> sessionmaker:
+        """ Method for creating the session factory bound to the engine """
+        return sessionmaker(engine)
+
     @abc.abstractmethod
     def _create_connection_string(self, name:typing.Optional[str] = None) -> str:
         """ Method for creating connection string for database 
@@ -149,7 +190,19 @@ class DatabaseConnection(abc.ABC):
 
 @dataclass(kw_only=True)
 class LiteDatabaseConnection(DatabaseConnection, abc.ABC):
-    """ Lite connection abstract class representing minimal database connection data for SQLALchemy. """
+    """ Lite connection abstract class representing minimal database connection data for SQLALchemy.
+
+    Attributes:
+        profile (Optional[str], optional): Name of a PRAGMA profile from PROFILES, e.g. 'read_heavy', 'write_heavy' or 'safe'. Defaults to None.
+        pragmas (Dict[str, Any], optional): PRAGMAs applied to every pooled connection. They override the profile ones. Defaults to an empty dictionary.
+    """
+    profile:    typing.Optional[str] = None
+    pragmas:    typing.Dict[str, typing.Any] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if self.profile is not None and self.profile not in PROFILES:
+            raise ValueError(f"Unknown SQLite profile {self.profile!r}. Expected one of {list(PROFILES)}")
+        super().__post_init__()
 
     def _create_connection_string(self, name:typing.Optional[str] = None) -> str:
         """ Method for creating connection string for sqlite database"""
@@ -157,6 +210,30 @@ class LiteDatabaseConnection(DatabaseConnection, abc.ABC):
             return f"{self.dialect}+{self.driver}:///{name}"
         return f"{self.dialect}+{self.driver}:///{self.name}"
 
+    def _engine_args(self, name: str) -> typing.Dict[str, typing.Any]:
+        """ Method for building the engine arguments, adding the PRAGMAs and a StaticPool for in-memory databases.
+
+        File databases keep the default pool of the dialect, a QueuePool, so readers and a writer can use separate connections.
+        """
+        engine_args = super()._engine_args(name)
+        pragmas = {**PROFILES.get(self.profile, {}), **self.pragmas}
+        if pragmas:
+            engine_args['pragmas'] = pragmas
+
+        if 'poolclass' not in engine_args and is_memory_database(name):
+            # A single connection shared by every thread, so they all see the same database
+            engine_args['poolclass'] = sqlalchemy.pool.StaticPool
+            engine_args.setdefault('connect_args', {}).setdefault('check_same_thread', False)
+        return engine_args
+
+    def _create_engine(self, connection_string: str, pragmas: typing.Optional[typing.Dict[str, typing.Any]] = None,
+                       **engine_args: typing.Any) -> sqlalchemy.engine.Engine:
+        """ Method for creating the engine object, applying the PRAGMAs on every new DBAPI connection """
+        engine = super()._create_engine(connection_string, **engine_args)
+        if pragmas:
+            install_pragmas(engine, pragmas)
+        return engine
+
 
 @dataclass(kw_only=True)
 class AuthDatabaseConnection(DatabaseConnection, abc.ABC):
@@ -167,17 +244,54 @@ class AuthDatabaseConnection(DatabaseConnection, abc.ABC):
         password (str): The password to authenticate with.
         port (Optional[int], optional): The port to connect to. Defaults to None. SQLAlchemy will use the default port for the given dialect.
         host (Optional[str], optional): The host to connect to. Defaults to 'localhost'.
+        replica_hosts (List[str], optional): Hosts of the read replicas, optionally as 'host:port'. If given, sessions route their reads to the replicas. Defaults to an empty list.
+        router_args (Dict[str, Any], optional): Additional arguments for the ReplicaRouter, e.g. strategy or sticky_seconds. Defaults to an empty dictionary.
+        router (Optional[ReplicaRouter]): The router of the sessions, None without replicas.
     """
     user:       str
     password:   str
     port:       typing.Optional[int] = None
     host:       typing.Optional[str] = 'localhost'
+    replica_hosts:  typing.List[str] = field(default_factory=list)
+    router_args:    typing.Dict[str, typing.Any] = field(default_factory=dict)
 
-    def _create_connection_string(self, name:typing.Optional[str] = None) -> str:
-        """ Method for creating connection string for database with authentication."""
-        connection_string = f"{self.dialect}+{self.driver}://{self.user}:{self.password}@{self.host}"
+    @property
+    def router(self) -> typing.Optional[ReplicaRouter]:
+        """Property for the replica router of the sessions. Only read access is allowed."""
+        return getattr(self, '_router', None)
+
+    def generate_replica_engines(self, name: typing.Optional[str] = None) -> typing.List[sqlalchemy.engine.Engine]:
+        """Method for creating the engines of the replicas for the given database name.
+
+        Args:
+            name (Optional[str], optional): The name of the database. Defaults to None. If None, the name of the object is used.
+
+        Returns:
+            List[Engine]: A SQLAlchemy engine object per replica host
+        """
+        name = name if name else self.name
+        return [
+            self._engine_for(self._create_connection_string(name=name, host=host), self._engine_args(name))
+            for host in self.replica_hosts
+        ]
 
-        if self.port:
+    def _create_session_factory(self, engine: sqlalchemy.engine.Engine) -> sessionmaker:
+        """ Method for creating the session factory, routing the reads if there are replicas """
+        if not self.replica_hosts:
+            return super()._create_session_factory(engine)
+
+        self._router = ReplicaRouter(engine, self.generate_replica_engines(), **self.router_args)
+        return sessionmaker(class_=RoutingSession, router=self._router)
+
+    def _create_connection_string(self, name:typing.Optional[str] = None, host: typing.Optional[str] = None) -> str:
+        """ Method for creating connection string for database with authentication.
+
+        A host given as 'host:port' overrides the port of the object.
+        """
+        host = host if host else self.host
+        connection_string = f"{self.dialect}+{self.driver}://{self.user}:{self.password}@{host}"
+
+        if self.port and ':' not in host:
             connection_string += f":{self.port}"
 
         if name:
@@ -236,7 +350,16 @@ class DeclarativeDatabaseBase(DatabaseBase, abc.ABC):
 
 @dataclass(kw_only=True)
 class AutoMappedDatabaseBase(DatabaseBase, abc.ABC):
-    """ Automapped base abstract class for automapped Base"""
+    """ Automapped base abstract class for automapped Base
+    
+    Attributes:
+        reflection_cache (Optional[ReflectionCache], optional): Cache of the reflected schema shared between processes. Defaults to None, the schema is reflected on every instantiation.
+        lazy (bool, optional): If True, each table is reflected and mapped on first access to Base.classes. Defaults to False. Cannot be combined with reflection_cache.
+        only (Optional[List[str]], optional): If given, only these tables are reflected. Defaults to None.
+    """
+    reflection_cache:   typing.Optional[ReflectionCache] = None
+    lazy:               bool = False
+    only:               typing.Optional[typing.List[str]] = None
 
     def __post_init__(self):
         self._base_preparation()
@@ -244,8 +367,20 @@ class AutoMappedDatabaseBase(DatabaseBase, abc.ABC):
 
     def _base_preparation(self):
         """ Method for preparing the automapped base reflecting the database schema """
-        self.Base = automap_base()
-        self.Base.metadata.reflect(bind=self.engine)
+        reflect_args = {} if self.only is None else dict(only=self.only)
+
+        if self.lazy:
+            if self.reflection_cache is not None:
+                raise ValueError("lazy reflection cannot use a reflection_cache: the cache stores the whole schema")
+            self.Base = automap_base()
+            self.Base.classes = LazyClasses(self.Base, self.engine, only=self.only)
+            return
+
+        if self.reflection_cache is None:
+            self.Base = automap_base()
+            self.Base.metadata.reflect(bind=self.engine, **reflect_args)
+        else:
+            self.Base = automap_base(metadata=self.reflection_cache.reflect(self.engine, **reflect_args))
         self.Base.prepare()
 
 class SQLAlchemyDatabase(Protocol):
@@ -270,23 +405,42 @@ class SQLAlchemyDatabase(Protocol):
 
 class InspectionMixin(SQLAlchemyDatabase):
     """Mixin for inspecting database schema
-    
+
+    The inspector is created on first use. The catalog queries of get_database_names go through
+    a CachedInspector, reused for INSPECTOR_TTL seconds or until refresh_inspector is called.
+
     Attributes:
         inspector (Inspector): A SQLAlchemy inspector object
+        cached_inspector (CachedInspector): The inspector memoizing the catalog queries
     """
-
-    def __post_init__(self):
-        try:
-            self._inspector = sqlalchemy.inspect(self.engine)
-        except sqlalchemy.exc.OperationalError as e:
-            logger.error(f"Could not create inspector for database {self.name}. {e}")
-            raise e
+    INSPECTOR_TTL: typing.ClassVar[typing.Optional[float]] = 300.0
 
     @property
-    def inspector(self):
+    def inspector(self) -> sqlalchemy.engine.reflection.Inspector:
         """A SQLAlchemy inspector object"""
+        if getattr(self, '_inspector', None) is None:
+            try:
+                self._inspector = sqlalchemy.inspect(self.engine)
+            except sqlalchemy.exc.OperationalError as e:
+                logger.error(f"Could not create inspector for database {self.name}. {e}")
+                raise e
         return self._inspector
 
+    @property
+    def cached_inspector(self) -> CachedInspector:
+        """The inspector memoizing the schema names, table names, columns and foreign keys"""
+        if getattr(self, '_cached_inspector', None) is None:
+            self._cached_inspector = CachedInspector(self.inspector, ttl=self.INSPECTOR_TTL)
+        return self._cached_inspector
+
+    def refresh_inspector(self, schema: typing.Optional[str] = None) -> None:
+        """ Method for discarding the cached catalog queries, e.g. after creating a database
+
+        Args:
+            schema (Optional[str], optional): If given, only the results of this schema and the schema names are discarded. Defaults to None.
+        """
+        self.cached_inspector.refresh(schema)
+
     def get_table_names(self) -> typing.List[str]:
         """ Method for getting the table names from the database 
         
@@ -295,44 +449,41 @@ class InspectionMixin(SQLAlchemyDatabase):
         """
         return self.base.metadata.tables.keys()
 
-    def get_database_names(self, starts_with=None, ends_with=None) -> typing.List[str]:
+    def get_database_names(self, starts_with=None, ends_with=None, refresh: bool = False) -> typing.List[str]:
         """ Method for getting the database names from the the SQL server
 
+        The names are cached and indexed, so the filters only visit the matching names.
+
         Args:
             starts_with (Optional[str], optional): If given, only the databases starting with the given string are returned. Defaults to None.
             ends_with (Optional[str], optional): If given, only the databases ending with the given string are returned. Defaults to None.
+            refresh (bool, optional): If True, the names are queried again. Defaults to False.
 
         Returns:
-            List[str]: A list of database names
+            List[str]: A sorted list of database names
         """
-        schema_list = self.inspector.get_schema_names()
-
-        if starts_with:
-            schema_list = [name for name in schema_list if name.startswith(starts_with)]
-
-        if ends_with:
-            schema_list = [name for name in schema_list if name.endswith(ends_with)]
-
-        return schema_list
+        if refresh:
+            self.refresh_inspector()
+        return self.cached_inspector.schema_index().filter(starts_with, ends_with)
 
 # Module API
 @dataclass(kw_only=True)
-class DeclarativeDatabase(AuthDatabaseConnection, DeclarativeDatabaseBase, InspectionMixin):
+class DeclarativeDatabase(AuthDatabaseConnection, DeclarativeDatabaseBase, InspectionMixin, InstrumentationMixin, ResultCacheMixin, LoadingMixin, BulkMixin, StreamingMixin, PaginationMixin, ExportMixin):
     """ Declarative database class for SQL databases"""
     pass
 
 @dataclass(kw_only=True)
-class DeclarativeLiteDatabase(LiteDatabaseConnection, DeclarativeDatabaseBase, InspectionMixin):
+class DeclarativeLiteDatabase(LiteDatabaseConnection, DeclarativeDatabaseBase, InspectionMixin, InstrumentationMixin, ResultCacheMixin, LoadingMixin, BulkMixin, StreamingMixin, PaginationMixin, ExportMixin, LiteBulkLoadMixin, LiteTemplateMixin):
     """ Declarative database class for SQLite database"""
     pass
 
 @dataclass(kw_only=True)
-class AutoMappedDatabase(AuthDatabaseConnection, AutoMappedDatabaseBase, InspectionMixin):
+class AutoMappedDatabase(AuthDatabaseConnection, AutoMappedDatabaseBase, InspectionMixin, InstrumentationMixin, ResultCacheMixin, LoadingMixin, BulkMixin, StreamingMixin, PaginationMixin, ExportMixin):
     """ Automapped database class for SQL databases """
     pass
 
 @dataclass(kw_only=True)
-class AutoMappedLiteDatabase(LiteDatabaseConnection, AutoMappedDatabaseBase, InspectionMixin):
+class AutoMappedLiteDatabase(LiteDatabaseConnection, AutoMappedDatabaseBase, InspectionMixin, InstrumentationMixin, ResultCacheMixin, LoadingMixin, BulkMixin, StreamingMixin, PaginationMixin, ExportMixin, LiteBulkLoadMixin, LiteTemplateMixin):
     """ Automapped database class for SQLite database """
     pass
 
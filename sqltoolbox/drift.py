@@ -0,0 +1,240 @@
+""" Module for checking the schema drift of many databases concurrently
+
+Each database is compared to the metadata with alembic's autogenerate ``compare_metadata``,
+the check behind ``alembic check``. Databases are processed by a bounded thread pool. The
+schema of each database, columns, indexes and constraints, is fingerprinted with a few catalog
+queries first, and databases sharing a fingerprint share a single reflection and comparison.
+The report groups the databases by identical diffs, so a release with a thousand tenants shows
+a handful of distinct outcomes.
+
+Example:
+    python -m sqltoolbox.drift --starts-with database --workers 16
+"""
+import sys
+import time
+import typing
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import sqlalchemy
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+
+from sqltoolbox.reflection import schema_fingerprint
+from sqltoolbox.backfill import include_name
+
+__all__ = [
+    'DriftReport',
+    'DriftResult',
+    'check_drift',
+    'describe_diff',
+]
+
+logger = logging.getLogger('database')
+
+# Options of the MigrationContext used for the comparison, as in env.py. The backfill progress table is not a model
+COMPARE_OPTIONS: typing.Dict[str, typing.Any] = dict(compare_type=True, include_name=include_name)
+
+@dataclass
+class DriftResult:
+    """Outcome of the comparison of a single database.
+
+    Attributes:
+        name (str): The name of the database.
+        diffs (Tuple[str, ...]): The differences between the database and the metadata, empty if it matches.
+        fingerprint (Optional[str], optional): The schema fingerprint of the database. Defaults to None.
+        reused (bool, optional): True if the diffs come from another database with the same fingerprint. Defaults to False.
+        seconds (float, optional): Wall time of the check. Defaults to 0.
+        error (Optional[str], optional): The error raised by the check, if any. Defaults to None.
+    """
+    name:           str
+    diffs:          typing.Tuple[str, ...] = ()
+    fingerprint:    typing.Optional[str] = None
+    reused:         bool = False
+    seconds:        float = 0.0
+    error:          typing.Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the database matches the metadata."""
+        return self.error is None and not self.diffs
+
+@dataclass
+class DriftReport:
+    """Consolidated drift report of several databases.
+
+    Attributes:
+        results (List[DriftResult]): One result per database.
+        seconds (float, optional): Wall time of the whole check. Defaults to 0.
+    """
+    results:    typing.List[DriftResult] = field(default_factory=list)
+    seconds:    float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if every database matches the metadata."""
+        return all(result.ok for result in self.results)
+
+    @property
+    def comparisons(self) -> int:
+        """Number of reflections and comparisons actually run."""
+        return sum(not result.reused and result.error is None for result in self.results)
+
+    @property
+    def groups(self) -> typing.Dict[typing.Tuple[str, ...], typing.List[str]]:
+        """Database names grouped by identical diffs, most common group first. Failed checks are left out."""
+        groups: typing.Dict[typing.Tuple[str, ...], typing.List[str]] = {}
+        for result in self.results:
+            if result.error is None:
+                groups.setdefault(result.diffs, []).append(result.name)
+        return dict(sorted(groups.items(), key=lambda item: -len(item[1])))
+
+    @property
+    def errors(self) -> typing.Dict[str, str]:
+        """The errors of the failed checks, by database name."""
+        return {result.name: result.error for result in self.results if result.error is not None}
+
+    def format(self) -> typing.List[str]:
+        """Method for rendering the report.
+
+        Returns:
+            List[str]: The lines of the report.
+        """
+        lines = []
+        for diffs, names in self.groups.items():
+            status = 'in sync' if not diffs else f"{len(diffs)} difference(s)"
+            lines.append(f"{len(names)} database(s) {status}: {', '.join(sorted(names))}")
+            lines.extend(f"    {diff}" for diff in diffs)
+        for name, error in self.errors.items():
+            lines.append(f"{name} failed: {error}")
+
+        drifted = sum(bool(result.diffs) for result in self.results)
+        lines.append(f"{len(self.results)} databases, {drifted} drifted, {len(self.errors)} failed, "
+                     f"{self.comparisons} comparisons in {self.seconds:.3f}s")
+        return lines
+
+def _describe_object(value: typing.Any) -> str:
+    """ Stable, database independent text of an element of an autogenerate diff """
+    if isinstance(value, sqlalchemy.Table):
+        return value.name
+    if isinstance(value, sqlalchemy.Column):
+        return f"{value.table.name}.{value.name}" if value.table is not None else value.name
+    if isinstance(value, sqlalchemy.Index):
+        return f"{value.name}({', '.join(column.name for column in value.columns)})"
+    if isinstance(value, sqlalchemy.Constraint):
+        columns = ', '.join(column.name for column in getattr(value, 'columns', []))
+        return f"{type(value).__name__} {value.name}({columns})"
+    if isinstance(value, sqlalchemy.types.TypeEngine):
+        return repr(value)
+    if isinstance(value, dict):
+        return repr({key: _describe_object(item) for key, item in sorted(value.items())})
+    if isinstance(value, str):
+        return value
+    return repr(value)
+
+def describe_diff(diff: typing.Any) -> str:
+    """Function rendering an autogenerate diff as text. Modification diffs, which are lists, are joined with '; '.
+
+    Args:
+        diff (Any): A diff from compare_metadata, e.g. ('add_column', None, 'users', Column).
+
+    Returns:
+        str: The diff as text, e.g. "add_column users users.phone".
+    """
+    if isinstance(diff, list):
+        return '; '.join(describe_diff(item) for item in diff)
+    operation, *arguments = diff
+    return ' '.join([operation, *(_describe_object(argument) for argument in arguments if argument is not None)])
+
+def _compare(connection: sqlalchemy.engine.Connection, metadata: sqlalchemy.MetaData,
+             compare_options: typing.Dict[str, typing.Any]) -> typing.Tuple[str, ...]:
+    """ Reflect the database and return the sorted text of its diffs with the metadata """
+    context = MigrationContext.configure(connection, opts=compare_options)
+    return tuple(sorted(describe_diff(diff) for diff in compare_metadata(context, metadata)))
+
+def check_drift(database: typing.Any, names: typing.Optional[typing.Iterable[str]] = None,
+                starts_with: typing.Optional[str] = None, metadata: typing.Optional[sqlalchemy.MetaData] = None,
+                max_workers: int = 8, compare_options: typing.Optional[typing.Dict[str, typing.Any]] = None) -> DriftReport:
+    """Function comparing many databases to the metadata concurrently.
+
+    Args:
+        database (Any): A database object. Its generate_engine builds the engine of each database.
+        names (Optional[Iterable[str]], optional): The databases to check. Defaults to None, database.get_database_names(starts_with).
+        starts_with (Optional[str], optional): Prefix of the databases to check when names is not given. Defaults to None.
+        metadata (Optional[MetaData], optional): The expected schema. Defaults to None, the metadata of the database Base.
+        max_workers (int, optional): Maximum number of databases checked, and connections open, at the same time. Defaults to 8.
+        compare_options (Optional[Dict[str, Any]], optional): Options of the comparison context. Defaults to None, COMPARE_OPTIONS.
+
+    Returns:
+        DriftReport: The results grouped by identical diffs.
+    """
+    names = list(names) if names is not None else database.get_database_names(starts_with=starts_with)
+    metadata = metadata if metadata is not None else database.base.metadata
+    compare_options = compare_options if compare_options is not None else COMPARE_OPTIONS
+    start = time.perf_counter()
+
+    # One comparison per fingerprint. The first database with a fingerprint computes it, the others wait for it.
+    by_fingerprint: typing.Dict[str, Future] = {}
+    lock = threading.Lock()
+
+    def check(name: str) -> DriftResult:
+        result = DriftResult(name)
+        started = time.perf_counter()
+        engine = database.generate_engine(name)
+        try:
+            with engine.connect() as connection:
+                result.fingerprint = schema_fingerprint(connection)
+                with lock:
+                    shared = by_fingerprint.get(result.fingerprint) if result.fingerprint else None
+                    owner = result.fingerprint is not None and shared is None
+                    if owner:
+                        shared = by_fingerprint[result.fingerprint] = Future()
+
+                if not owner and shared is not None and shared.exception() is None:
+                    result.diffs, result.reused = shared.result(), True
+                else:
+                    try:
+                        result.diffs = _compare(connection, metadata, compare_options)
+                    except BaseException as e:
+                        if owner:
+                            shared.set_exception(e)
+                        raise
+                    if owner:
+                        shared.set_result(result.diffs)
+        except Exception as e:
+            logger.error(f"Drift check of database {name} failed. {e}")
+            result.error = f"{type(e).__name__}: {e}"
+        finally:
+            if database.registry is None:
+                engine.dispose()
+        result.seconds = time.perf_counter() - started
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='drift') as executor:
+        results = list(executor.map(check, names))
+
+    report = DriftReport(results, time.perf_counter() - start)
+    for line in report.format():
+        logger.info(line)
+    return report
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    """Command line entry point checking the databases of the configured server. Exits with 1 on drift or errors."""
+    parser = argparse.ArgumentParser(prog='python -m sqltoolbox.drift', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help="The databases to check. Defaults to every database matching --starts-with.")
+    parser.add_argument('--starts-with', default='database', help="Prefix of the databases to check. Defaults to 'database'.")
+    parser.add_argument('--workers', type=int, default=8, help="Databases checked at the same time. Defaults to 8.")
+    args = parser.parse_args(argv)
+
+    from sqltoolbox.factory import get_declarative_database
+    report = check_drift(get_declarative_database(), names=args.names or None,
+                         starts_with=args.starts_with, max_workers=args.workers)
+    print('\n'.join(report.format()))
+    return 0 if report.ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+""" Module with the columnar export helpers of the database classes
+
+Tables and selects are streamed in batches of bounded size and written to Parquet,
+Arrow IPC or CSV files. The Arrow schema is derived from the SQLAlchemy column types,
+so the files keep the types declared in the models. Parquet and Arrow require pyarrow.
+"""
+import csv
+import json
+import time
+import typing
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+
+import sqlalchemy
+from sqlalchemy import types
+
+__all__ = [
+    'ExportMixin',
+    'ExportResult',
+    'arrow_schema',
+]
+
+logger = logging.getLogger('database')
+
+FORMATS = ('parquet', 'arrow', 'csv')
+
+# Maximum precision of the Arrow decimal types
+DECIMAL128_PRECISION = 38
+DECIMAL256_PRECISION = 76
+
+# File suffixes mapped to export formats
+SUFFIXES = {
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+    '.csv': 'csv',
+}
+
+@dataclass
+class ExportResult:
+    """Counts and throughput of an export.
+
+    Attributes:
+        path (Path): The written file.
+        format (str): The format of the file.
+        rows (int): Number of rows written.
+        batches (int): Number of batches written.
+        seconds (float): Wall time of the export.
+    """
+    path:       Path
+    format:     str
+    rows:       int = 0
+    batches:    int = 0
+    seconds:    float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Throughput of the export."""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+def _import_pyarrow() -> typing.Any:
+    """ Import pyarrow, which is only required for the Parquet and Arrow formats """
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("The Parquet and Arrow export formats require pyarrow. Install it with `pip install pyarrow`.") from e
+    return pyarrow
+
+def arrow_type(sql_type: types.TypeEngine) -> typing.Any:
+    """Function mapping a SQLAlchemy column type to an Arrow data type.
+
+    Args:
+        sql_type (TypeEngine): The SQLAlchemy type of the column.
+
+    Returns:
+        DataType: A pyarrow data type. Unknown types are exported as strings, converted by _string_converter.
+    """
+    pa = _import_pyarrow()
+
+    if isinstance(sql_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, types.SmallInteger):
+        return pa.int16()
+    if isinstance(sql_type, types.Integer):
+        return pa.int64()
+    if isinstance(sql_type, types.Numeric) and not isinstance(sql_type, types.Float) and sql_type.asdecimal and sql_type.precision:
+        if sql_type.precision <= DECIMAL128_PRECISION:
+            return pa.decimal128(sql_type.precision, sql_type.scale or 0)
+        if sql_type.precision <= DECIMAL256_PRECISION:
+            return pa.decimal256(sql_type.precision, sql_type.scale or 0)
+        return pa.string()
+    if isinstance(sql_type, (types.Float, types.Numeric)):
+        return pa.float64()
+    if isinstance(sql_type, types.DateTime):
+        return pa.timestamp('us', tz='UTC' if sql_type.timezone else None)
+    if isinstance(sql_type, types.Date):
+        return pa.date32()
+    if isinstance(sql_type, types.Time):
+        return pa.time64('us')
+    if isinstance(sql_type, types.Interval):
+        return pa.duration('us')
+    if isinstance(sql_type, types._Binary):
+        return pa.binary()
+    return pa.string()
+
+def _string_converter(sql_type: types.TypeEngine) -> typing.Optional[typing.Callable[[typing.Any], typing.Any]]:
+    """ Conversion of the values of a column exported as strings, None if it maps to a native Arrow type """
+    pa = _import_pyarrow()
+    if arrow_type(sql_type) != pa.string():
+        return None
+    if isinstance(sql_type, types.JSON):
+        return lambda value: None if value is None else json.dumps(value, default=str)
+    if isinstance(sql_type, types.Enum) and sql_type.enum_class is not None:
+        return lambda value: None if value is None else getattr(value, 'name', value)
+    return lambda value: value if value is None or isinstance(value, str) else str(value)
+
+def arrow_schema(statement: sqlalchemy.Select) -> typing.Any:
+    """Function building the Arrow schema of the columns selected by a statement.
+
+    Args:
+        statement (Select): A SQLAlchemy select.
+
+    Returns:
+        Schema: A pyarrow schema.
+    """
+    pa = _import_pyarrow()
+    return pa.schema([
+        pa.field(column.name, arrow_type(column.type), nullable=getattr(column, 'nullable', True))
+        for column in statement.selected_columns
+    ])
+
+def _column_array(values: typing.Sequence[typing.Any], field: typing.Any) -> typing.Any:
+    """ Build the Arrow array of a column, naming the column when its values do not match its type """
+    pa = _import_pyarrow()
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowTypeError, pa.ArrowInvalid) as e:
+        raise TypeError(f"Column {field.name!r} can not be exported as {field.type}. {e}") from e
+
+def _as_select(source: typing.Any) -> sqlalchemy.Select:
+    """ Return a select for a table, a mapped class or a select """
+    if isinstance(source, sqlalchemy.Select):
+        return source
+    return sqlalchemy.select(source)
+
+class ExportMixin:
+    """Mixin for exporting tables and queries to columnar files"""
+
+    def export(self, source: typing.Any, path: typing.Union[str, Path], format: typing.Optional[str] = None,
+               batch_size: int = 10000) -> ExportResult:
+        """Method for exporting a table, a mapped class or a select to a file in streamed batches.
+
+        Args:
+            source (Any): A Table object, a mapped class or a select.
+            path (Union[str, Path]): The file to write.
+            format (Optional[str], optional): One of 'parquet', 'arrow' or 'csv'. Defaults to None, guessed from the file suffix.
+            batch_size (int, optional): Number of rows fetched and written at once. Defaults to 10000.
+
+        Returns:
+            ExportResult: Counts and throughput of the export.
+
+        Raises:
+            ValueError: Raised if the format is unknown.
+        """
+        path = Path(path)
+        format = format or SUFFIXES.get(path.suffix.lower())
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format {format!r} for {path}. Expected one of {FORMATS}")
+
+        statement = _as_select(source)
+        result = ExportResult(path=path, format=format)
+        start = time.perf_counter()
+
+        batches = self.stream(statement, batch_size=batch_size, orm=False)
+        if format == 'csv':
+            self._write_csv(statement, batches, path, result)
+        else:
+            self._write_arrow(statement, batches, path, format, result)
+
+        result.seconds = time.perf_counter() - start
+        logger.debug(f"Exported {result.rows} rows to {path} in {result.batches} batches "
+                     f"({result.rows_per_second:.0f} rows/s).")
+        return result
+
+    @staticmethod
+    def _write_arrow(statement: sqlalchemy.Select, batches: typing.Iterable[typing.Sequence[typing.Any]],
+                     path: Path, format: str, result: ExportResult) -> None:
+        """ Method for writing batches of rows to a Parquet or Arrow IPC file """
+        pa = _import_pyarrow()
+        schema = arrow_schema(statement)
+
+        if format == 'parquet':
+            import pyarrow.parquet
+            writer = pyarrow.parquet.ParquetWriter(path, schema)
+        else:
+            import pyarrow.ipc
+            writer = pyarrow.ipc.new_file(path, schema)
+
+        converters = [_string_converter(column.type) for column in statement.selected_columns]
+        with writer:
+            for rows in batches:
+                columns = [values if convert is None else [convert(value) for value in values]
+                           for values, convert in zip(zip(*rows), converters)]
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [_column_array(values, field) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                result.rows += len(rows)
+                result.batches += 1
+
+    @staticmethod
+    def _write_csv(statement: sqlalchemy.Select, batches: typing.Iterable[typing.Sequence[typing.Any]],
+                   path: Path, result: ExportResult) -> None:
+        """ Method for writing batches of rows to a CSV file with a header """
+        with path.open('w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow([column.name for column in statement.selected_columns])
+            for rows in batches:
+                writer.writerows(rows)
+                result.rows += len(rows)
+                result.batches += 1
@@ -1,45 +1,117 @@
-""" Database factory module """
+""" Database factory module
+
+The models and the settings are loaded on first use, so importing this module does not
+require a .env file. ``Base`` and the model classes are still importable from here.
+"""
+import typing
 import logging
 
 from sqltoolbox.database import DeclarativeDatabase, AutoMappedDatabase, DeclarativeLiteDatabase, AutoMappedLiteDatabase
+from sqltoolbox.config import get_settings, configure_logging
 
-# Import Base schema for declarative database
-from sqltoolbox.models.base import Base
+__all__ = [
+    'Base',
+    'get_base',
+    'get_declarative_database',
+    'get_declarative_lite_database',
+    'get_automapped_lite_database',
+    'get_async_declarative_database',
+    'get_async_declarative_lite_database',
+    'get_async_automapped_lite_database',
+]
 
-# Import models for declarative base population
-from sqltoolbox.models import *
+logger = logging.getLogger('database')
 
-# Import settings for database connection
-from sqltoolbox.config import settings
+# Lazy module attributes, resolved by __getattr__
+MODELS = ('User', 'Role', 'Address')
 
-logger = logging.getLogger('database')
+def get_base() -> typing.Any:
+    """Function returning the declarative Base with every model registered.
+
+    Returns:
+        DeclarativeBase: The declarative base of the package models.
+    """
+    # Import models for declarative base population
+    from sqltoolbox.models import register_models
+    from sqltoolbox.models.base import Base
+    register_models()
+    return Base
+
+def __getattr__(name: str) -> typing.Any:
+    if name == 'Base':
+        return get_base()
+    if name in MODELS:
+        import sqltoolbox.models
+        return getattr(sqltoolbox.models, name)
+    if name == 'settings':
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Example of declarative database
 def get_declarative_database():
     """Factory function to get declarative database."""
+    settings = get_settings()
     return DeclarativeDatabase(
         dialect=settings.DIALECT,
         driver=settings.DRIVER,
         name=settings.NAME,
-        Base=Base,
+        Base=get_base(),
         user=settings.USER,
         password=settings.PASSWORD
     )
 
 def get_declarative_lite_database():
     """Factory function to get declarative lite database."""
+    configure_logging()
     return DeclarativeLiteDatabase(
         dialect='sqlite',
         driver='pysqlite',
         name= 'data/database.db',
-        Base=Base,
+        Base=get_base(),
         create_tables=True,
     )
 
 def get_automapped_lite_database():
     """Factory function to get automapped lite database."""
+    configure_logging()
     return AutoMappedLiteDatabase(
         dialect='sqlite',
         driver='pysqlite',
         name= 'data/database.db',
+    )
+
+# Example of async declarative database
+def get_async_declarative_database():
+    """Factory function to get async declarative database. Tables are not created until prepared."""
+    from sqltoolbox.async_database import AsyncDeclarativeDatabase
+    settings = get_settings()
+    return AsyncDeclarativeDatabase(
+        dialect=settings.DIALECT,
+        driver=settings.ASYNC_DRIVER,
+        name=settings.NAME,
+        Base=get_base(),
+        user=settings.USER,
+        password=settings.PASSWORD
+    )
+
+def get_async_declarative_lite_database():
+    """Factory function to get async declarative lite database. Tables are created when prepared."""
+    from sqltoolbox.async_database import AsyncDeclarativeLiteDatabase
+    configure_logging()
+    return AsyncDeclarativeLiteDatabase(
+        dialect='sqlite',
+        driver='aiosqlite',
+        name= 'data/database.db',
+        Base=get_base(),
+        create_tables=True,
+    )
+
+def get_async_automapped_lite_database():
+    """Factory function to get async automapped lite database. The schema is reflected when prepared."""
+    from sqltoolbox.async_database import AsyncAutoMappedLiteDatabase
+    configure_logging()
+    return AsyncAutoMappedLiteDatabase(
+        dialect='sqlite',
+        driver='aiosqlite',
+        name= 'data/database.db',
     )
\ No newline at end of file
@@ -0,0 +1,181 @@
+""" Module with the caching layer of the schema inspection
+
+The catalog queries of a SQLAlchemy inspector are memoized with a time to live, so tools
+calling get_database_names or reflecting columns repeatedly scan the catalog once per TTL.
+Columns and foreign keys are fetched for a whole schema at once with the get_multi_* methods.
+"""
+import time
+import bisect
+import typing
+import logging
+import threading
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy.engine.reflection import Inspector
+
+__all__ = [
+    'CachedInspector',
+    'NameIndex',
+]
+
+logger = logging.getLogger('database')
+
+class NameIndex:
+    """Sorted index of names answering prefix and suffix queries in O(log n + matches).
+
+    Args:
+        names (Iterable[str]): The indexed names.
+    """
+
+    def __init__(self, names: typing.Iterable[str]):
+        self._names = sorted(set(names))
+        self._reversed = sorted(name[::-1] for name in self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._names)
+
+    def starting_with(self, prefix: str) -> typing.List[str]:
+        """Method returning the sorted names starting with the prefix."""
+        return list(self._range(self._names, prefix))
+
+    def ending_with(self, suffix: str) -> typing.List[str]:
+        """Method returning the sorted names ending with the suffix."""
+        return sorted(name[::-1] for name in self._range(self._reversed, suffix[::-1]))
+
+    def filter(self, starts_with: typing.Optional[str] = None, ends_with: typing.Optional[str] = None) -> typing.List[str]:
+        """Method returning the sorted names matching both the prefix and the suffix when given.
+
+        Args:
+            starts_with (Optional[str], optional): The prefix. Defaults to None.
+            ends_with (Optional[str], optional): The suffix. Defaults to None.
+
+        Returns:
+            List[str]: The matching names.
+        """
+        if starts_with and ends_with:
+            return [name for name in self.starting_with(starts_with) if name.endswith(ends_with)]
+        if starts_with:
+            return self.starting_with(starts_with)
+        if ends_with:
+            return self.ending_with(ends_with)
+        return list(self._names)
+
+    @staticmethod
+    def _range(names: typing.List[str], prefix: str) -> typing.Iterator[str]:
+        """ The names of a sorted list starting with the prefix, which are contiguous """
+        for index in range(bisect.bisect_left(names, prefix), len(names)):
+            if not names[index].startswith(prefix):
+                return
+            yield names[index]
+
+@dataclass
+class CachedInspector:
+    """Inspector wrapper memoizing the catalog queries for ttl seconds.
+
+    Attributes:
+        inspector (Inspector): The SQLAlchemy inspector of the engine.
+        ttl (Optional[float], optional): Seconds a result is reused. Defaults to 300. None means until refresh is called.
+    """
+    inspector:  Inspector
+    ttl:        typing.Optional[float] = 300.0
+    _cache:     typing.Dict[typing.Tuple[typing.Any, ...], typing.Tuple[float, typing.Any]] = field(default_factory=dict, init=False, repr=False)
+    _lock:      threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
+
+    def get_schema_names(self) -> typing.List[str]:
+        """Method returning the schema names of the server.
+
+        Returns:
+            List[str]: A list of schema names
+        """
+        return list(self.schema_index())
+
+    def schema_index(self) -> NameIndex:
+        """Method returning the schema names indexed for prefix and suffix queries.
+
+        Returns:
+            NameIndex: The index of the schema names
+        """
+        return self._memoize(('schemas',), lambda: NameIndex(self.inspector.get_schema_names()))
+
+    def get_table_names(self, schema: typing.Optional[str] = None) -> typing.List[str]:
+        """Method returning the table names of a schema.
+
+        Args:
+            schema (Optional[str], optional): The schema. Defaults to None, the default schema.
+
+        Returns:
+            List[str]: A list of table names
+        """
+        return self._memoize(('tables', schema), lambda: self.inspector.get_table_names(schema=schema))
+
+    def get_columns(self, table_name: str, schema: typing.Optional[str] = None) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Method returning the columns of a table. The columns of every table of the schema are fetched at once.
+
+        Args:
+            table_name (str): The table.
+            schema (Optional[str], optional): The schema. Defaults to None, the default schema.
+
+        Returns:
+            List[Dict[str, Any]]: The column descriptions, as returned by Inspector.get_columns.
+
+        Raises:
+            NoSuchTableError: Raised if the table does not exist.
+        """
+        return self._per_schema('columns', self.inspector.get_multi_columns, table_name, schema)
+
+    def get_foreign_keys(self, table_name: str, schema: typing.Optional[str] = None) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Method returning the foreign keys of a table. The foreign keys of every table of the schema are fetched at once.
+
+        Args:
+            table_name (str): The table.
+            schema (Optional[str], optional): The schema. Defaults to None, the default schema.
+
+        Returns:
+            List[Dict[str, Any]]: The foreign key descriptions, as returned by Inspector.get_foreign_keys.
+
+        Raises:
+            NoSuchTableError: Raised if the table does not exist.
+        """
+        return self._per_schema('foreign_keys', self.inspector.get_multi_foreign_keys, table_name, schema)
+
+    def refresh(self, schema: typing.Optional[str] = None) -> None:
+        """Method for discarding the memoized results so the next calls query the catalog again.
+
+        Args:
+            schema (Optional[str], optional): If given, only the results of this schema and the schema names are discarded. Defaults to None, everything.
+        """
+        with self._lock:
+            if schema is None:
+                self._cache.clear()
+            else:
+                for key in [key for key in self._cache if key[0] == 'schemas' or key[1] == schema]:
+                    del self._cache[key]
+            # The inspector keeps its own unbounded cache
+            self.inspector.clear_cache()
+
+    def _per_schema(self, kind: str, fetch: typing.Callable[..., typing.Dict[typing.Tuple[typing.Optional[str], str], typing.Any]],
+                    table_name: str, schema: typing.Optional[str]) -> typing.Any:
+        """ Return the entry of a table from a result fetched for the whole schema """
+        by_table = self._memoize((kind, schema), lambda: {name: value for (_, name), value in fetch(schema=schema).items()})
+        try:
+            return by_table[table_name]
+        except KeyError:
+            raise sqlalchemy.exc.NoSuchTableError(table_name if schema is None else f"{schema}.{table_name}")
+
+    def _memoize(self, key: typing.Tuple[typing.Any, ...], compute: typing.Callable[[], typing.Any]) -> typing.Any:
+        """ Return the cached value of the key, computing it if missing or expired """
+        with self._lock:
+            entry = self._cache.get(key)
+            now = time.monotonic()
+            if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                return entry[1]
+            if entry is not None:
+                self.inspector.clear_cache()
+
+            value = compute()
+            self._cache[key] = (now, value)
+            return value
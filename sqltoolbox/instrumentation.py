@@ -0,0 +1,277 @@
+""" Module with the query instrumentation of the database classes
+
+Cursor executions are timed with the ``before_cursor_execute`` and ``after_cursor_execute``
+engine events and aggregated per normalized statement, i.e. with literals and parameter
+lists collapsed, so ``WHERE id = 1`` and ``WHERE id = 2`` share one entry. Memory is
+bounded: only the most recent statements and latency samples are kept.
+"""
+import re
+import json
+import math
+import time
+import typing
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy import event
+
+__all__ = [
+    'InstrumentationMixin',
+    'QueryStats',
+    'normalize_statement',
+]
+
+logger = logging.getLogger('database')
+
+# Key of the start time stack in Connection.info
+START_KEY = 'sqltoolbox_query_start'
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+def normalize_statement(statement: str) -> str:
+    """Function normalizing a SQL statement so statements differing only by their values share one key.
+
+    String and numeric literals and bound parameters become ``?``, parameter lists such as
+    ``IN (?, ?, ?)`` become ``(?)``, multi-row VALUES clauses keep a single row and
+    whitespace is collapsed.
+
+    Args:
+        statement (str): The SQL statement as sent to the cursor.
+
+    Returns:
+        str: The normalized statement.
+    """
+    statement = _STRING.sub('?', statement)
+    # Before the numbers, which would turn $1 placeholders into $?
+    statement = _PARAMETER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _LIST.sub('(?)', statement)
+    statement = _VALUES.sub(r'\1', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+def percentile(samples: typing.Sequence[float], fraction: float) -> float:
+    """Function returning the nearest-rank percentile of sorted samples, 0 if there are none."""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, math.ceil(fraction * len(samples)) - 1))
+    return samples[index]
+
+@dataclass
+class StatementStats:
+    """Aggregated executions of a normalized statement.
+
+    Attributes:
+        count (int): Number of executions.
+        errors (int): Number of executions that raised.
+        seconds (float): Total execution time.
+        rows (int): Total rows affected by the writes.
+        latencies (Deque[float]): The most recent execution times.
+    """
+    count:      int = 0
+    errors:     int = 0
+    seconds:    float = 0.0
+    rows:       int = 0
+    latencies:  typing.Deque[float] = field(default_factory=deque)
+
+@dataclass
+class QueryStats:
+    """Bounded per-statement aggregation of the cursor executions of one or more engines.
+
+    Rows are the rows affected by INSERT, UPDATE and DELETE statements, from the cursor rowcount.
+    Statements returning rows count 0: their rows are fetched after the execution, and the rowcount
+    of a SELECT depends on the driver, e.g. -1 with sqlite3.
+
+    Attributes:
+        slow_query_seconds (Optional[float], optional): Executions lasting longer are logged as slow queries. Defaults to 1. None disables the log.
+        max_statements (int, optional): Maximum number of normalized statements kept, least recently executed first out. Defaults to 1000.
+        sample_size (int, optional): Number of recent executions per statement used for the percentiles. Defaults to 1000.
+    """
+    slow_query_seconds: typing.Optional[float] = 1.0
+    max_statements:     int = 1000
+    sample_size:        int = 1000
+    _statements:        typing.MutableMapping[str, StatementStats] = field(default_factory=OrderedDict, init=False, repr=False)
+    _engines:           typing.List[sqlalchemy.engine.Engine] = field(default_factory=list, init=False, repr=False)
+    _lock:              threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _started:           float = field(default_factory=time.time, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.max_statements < 1 or self.sample_size < 1:
+            raise ValueError("max_statements and sample_size must be positive integers")
+
+    def attach(self, engine: sqlalchemy.engine.Engine) -> None:
+        """Method for listening to the cursor executions of an engine.
+
+        Args:
+            engine (Engine): A SQLAlchemy engine object
+        """
+        if engine in self._engines:
+            return
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        self._engines.append(engine)
+
+    def detach(self) -> None:
+        """Method for removing the listeners from every attached engine."""
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.remove(engine, 'handle_error', self._handle_error)
+        self._engines.clear()
+
+    def record(self, statement: str, seconds: float, rows: int = 0, error: bool = False) -> None:
+        """Method for adding an execution to the statistics.
+
+        Args:
+            statement (str): The SQL statement, normalized or not.
+            seconds (float): The execution time.
+            rows (int, optional): The rows affected by the statement. Defaults to 0.
+            error (bool, optional): True if the execution raised. Defaults to False.
+        """
+        key = normalize_statement(statement)
+        rows = max(rows, 0)
+
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = self._statements[key] = StatementStats(
+                    latencies=deque(maxlen=self.sample_size),
+                )
+                if len(self._statements) > self.max_statements:
+                    self._statements.popitem(last=False)
+            else:
+                self._statements.move_to_end(key)
+
+            stats.count += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.rows += rows
+            stats.latencies.append(seconds)
+
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            logger.warning("Slow query " + json.dumps(dict(
+                statement=key, seconds=round(seconds, 6), rows=rows, error=error,
+            )))
+
+    def snapshot(self, reset: bool = False) -> typing.Dict[str, typing.Any]:
+        """Method returning the statistics as plain, JSON serializable data.
+
+        Args:
+            reset (bool, optional): If True, the statistics are cleared atomically with the snapshot. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: The collection window and one entry per statement, slowest total time first.
+        """
+        with self._lock:
+            items = [(key, stats.count, stats.errors, stats.seconds, stats.rows, sorted(stats.latencies))
+                     for key, stats in self._statements.items()]
+            started = self._started
+            if reset:
+                self._reset()
+
+        statements = []
+        for key, count, errors, seconds, rows, latencies in items:
+            statements.append(dict(
+                statement=key,
+                count=count,
+                errors=errors,
+                total_seconds=seconds,
+                mean_seconds=seconds / count,
+                p50_seconds=percentile(latencies, 0.50),
+                p95_seconds=percentile(latencies, 0.95),
+                p99_seconds=percentile(latencies, 0.99),
+                rows=rows,
+            ))
+        statements.sort(key=lambda entry: entry['total_seconds'], reverse=True)
+        return dict(started=started, seconds=time.time() - started, statements=statements)
+
+    def reset(self) -> None:
+        """Method for clearing the statistics."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self._statements.clear()
+        self._started = time.time()
+
+    @staticmethod
+    def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        connection.info.setdefault(START_KEY, []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany) -> None:
+        seconds = time.perf_counter() - connection.info[START_KEY].pop()
+        writes = context is not None and (context.isinsert or context.isupdate or context.isdelete)
+        rows = (getattr(cursor, 'rowcount', 0) or 0) if writes or cursor.description is None else 0
+        self.record(statement, seconds, rows)
+
+    def _handle_error(self, context: sqlalchemy.engine.ExceptionContext) -> None:
+        starts = context.connection.info.get(START_KEY) if context.connection is not None else None
+        if starts and context.statement is not None:
+            self.record(context.statement, time.perf_counter() - starts.pop(), error=True)
+
+class InstrumentationMixin:
+    """Mixin for collecting per-statement query statistics and logging slow queries"""
+
+    @property
+    def query_stats(self) -> typing.Optional[QueryStats]:
+        """The statistics collected since enable_instrumentation, None while disabled."""
+        return getattr(self, '_query_stats', None)
+
+    def enable_instrumentation(self, slow_query_seconds: typing.Optional[float] = 1.0, max_statements: int = 1000,
+                               sample_size: int = 1000) -> QueryStats:
+        """Method for starting to collect statistics on the engine, and the replica engines if any.
+
+        Calling it again replaces the previous statistics.
+
+        Args:
+            slow_query_seconds (Optional[float], optional): Executions lasting longer are logged as slow queries. Defaults to 1. None disables the log.
+            max_statements (int, optional): Maximum number of normalized statements kept. Defaults to 1000.
+            sample_size (int, optional): Number of recent executions per statement used for the percentiles. Defaults to 1000.
+
+        Returns:
+            QueryStats: The statistics object.
+        """
+        self.disable_instrumentation()
+        stats = QueryStats(slow_query_seconds=slow_query_seconds, max_statements=max_statements, sample_size=sample_size)
+
+        router = getattr(self, 'router', None)
+        for engine in [self.engine, *(router.replicas if router else [])]:
+            stats.attach(engine)
+
+        self._query_stats = stats
+        return stats
+
+    def disable_instrumentation(self) -> None:
+        """Method for removing the instrumentation listeners. The collected statistics are discarded."""
+        if self.query_stats is not None:
+            self.query_stats.detach()
+            self._query_stats = None
+
+    def get_query_stats(self, reset: bool = False) -> typing.Dict[str, typing.Any]:
+        """Method returning a snapshot of the statistics.
+
+        Args:
+            reset (bool, optional): If True, the statistics are cleared with the snapshot. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: The snapshot, see QueryStats.snapshot.
+
+        Raises:
+            RuntimeError: Raised if the instrumentation is not enabled.
+        """
+        if self.query_stats is None:
+            raise RuntimeError("Instrumentation is not enabled. Call enable_instrumentation first.")
+        return self.query_stats.snapshot(reset=reset)
+
+    def reset_query_stats(self) -> None:
+        """Method for clearing the statistics, keeping the instrumentation enabled."""
+        if self.query_stats is not None:
+            self.query_stats.reset()
@@ -0,0 +1,378 @@
+""" Module with the SQLite specific helpers of the Lite database classes """
+import os
+import csv
+import json
+import shutil
+import typing
+import types
+import sqlite3
+import hashlib
+import logging
+import contextlib
+from pathlib import Path
+
+import sqlalchemy
+
+from sqltoolbox.bulk import BulkResult, Row, execute_chunks, get_table
+
+__all__ = [
+    'LOADER_PRAGMAS',
+    'PROFILES',
+    'LiteBulkLoadMixin',
+    'LiteTemplateMixin',
+    'build_template',
+    'clone_template',
+    'install_pragmas',
+    'is_memory_database',
+]
+
+logger = logging.getLogger('database')
+
+# PRAGMAs trading durability for speed while loading data. A crash during the load may corrupt the database.
+LOADER_PRAGMAS: typing.Dict[str, typing.Any] = {
+    'journal_mode': 'MEMORY',
+    'synchronous':  'OFF',
+    'cache_size':   -256000,    # KiB, i.e. 250 MiB
+    'temp_store':   'MEMORY',
+}
+
+# PRAGMA profiles of the Lite connections. WAL lets readers run concurrently with one writer,
+# busy_timeout makes a second writer wait for the lock instead of failing at once.
+PROFILES: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+    'read_heavy': {
+        'journal_mode': 'WAL',
+        'synchronous':  'NORMAL',
+        'busy_timeout': 5000,       # ms
+        'cache_size':   -64000,     # KiB
+        'mmap_size':    268435456,  # bytes
+        'temp_store':   'MEMORY',
+    },
+    'write_heavy': {
+        'journal_mode': 'WAL',
+        'synchronous':  'NORMAL',
+        'busy_timeout': 10000,
+        'cache_size':   -128000,
+        'temp_store':   'MEMORY',
+        'wal_autocheckpoint': 10000,  # pages
+    },
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous':  'FULL',
+        'busy_timeout': 5000,
+        'foreign_keys': 'ON',
+    },
+}
+
+def is_memory_database(name: typing.Optional[str]) -> bool:
+    """Function checking whether a SQLite database name refers to an in-memory database."""
+    return not name or name == ':memory:' or 'mode=memory' in name
+
+def install_pragmas(engine: typing.Any, pragmas: typing.Dict[str, typing.Any]) -> None:
+    """Function installing a connect listener applying the PRAGMAs to every new DBAPI connection of the engine.
+
+    Args:
+        engine (Union[Engine, AsyncEngine]): A SQLAlchemy engine object
+        pragmas (Dict[str, Any]): The PRAGMAs to apply.
+    """
+    @sqlalchemy.event.listens_for(getattr(engine, 'sync_engine', engine), 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+def get_pragma(connection: sqlalchemy.engine.Connection, name: str) -> typing.Any:
+    """Function reading the value of a PRAGMA."""
+    return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+def set_pragma(connection: sqlalchemy.engine.Connection, name: str, value: typing.Any) -> None:
+    """Function setting the value of a PRAGMA. Failures are logged and ignored."""
+    try:
+        connection.exec_driver_sql(f"PRAGMA {name} = {value}")
+    except sqlalchemy.exc.DBAPIError as e:
+        logger.warning(f"Could not set PRAGMA {name} = {value}. {e}")
+
+class LiteBulkLoadMixin:
+    """Mixin for loading large amounts of rows into a SQLite database"""
+
+    @contextlib.contextmanager
+    def bulk_load(self, *models_or_tables: typing.Any, pragmas: typing.Optional[typing.Dict[str, typing.Any]] = None,
+                  drop_indexes: bool = True) -> typing.Iterator[sqlalchemy.engine.Connection]:
+        """Context manager yielding a connection in bulk-load mode.
+
+        The loader PRAGMAs are applied to the connection, then a single transaction drops the non-unique
+        secondary indexes of the given tables, runs the body and rebuilds the indexes. A failed load
+        rolls back the drops with the rows, so the indexes are never lost. Unique indexes are kept so a
+        duplicate row fails the load. On exit the previous PRAGMA values are restored and the cached
+        results of the tables are evicted.
+
+        Args:
+            *models_or_tables (Any): Mapped classes or Table objects whose secondary indexes are rebuilt after the load.
+            pragmas (Optional[Dict[str, Any]], optional): PRAGMAs applied during the load. Defaults to None, LOADER_PRAGMAS.
+            drop_indexes (bool, optional): If False, the indexes are kept during the load. Defaults to True.
+
+        Yields:
+            Connection: A SQLAlchemy connection within the load transaction.
+        """
+        pragmas = LOADER_PRAGMAS if pragmas is None else pragmas
+        tables = [get_table(model_or_table) for model_or_table in models_or_tables]
+
+        with self.engine.connect() as connection:
+            previous = {name: get_pragma(connection, name) for name in pragmas}
+            for name, value in pragmas.items():
+                set_pragma(connection, name, value)
+            connection.commit()
+
+            try:
+                with connection.begin():
+                    # pysqlite opens its transactions before DML only: open it before the DROP INDEX to roll them back too
+                    connection.exec_driver_sql("BEGIN")
+                    indexes = self._drop_indexes(connection, tables) if drop_indexes else []
+                    yield connection
+                    for name, sql in indexes:
+                        logger.debug(f"Rebuilding index {name}.")
+                        connection.exec_driver_sql(sql)
+            finally:
+                for name, value in previous.items():
+                    set_pragma(connection, name, value)
+                connection.commit()
+                self._invalidate_result_cache(*tables)
+
+    def load_rows(self, model_or_table: typing.Any, rows: typing.Iterable[Row], chunk_size: int = 10000,
+                  **bulk_load_args: typing.Any) -> BulkResult:
+        """Method for inserting rows in bulk-load mode.
+
+        Args:
+            model_or_table (Any): A mapped class or a Table object.
+            rows (Iterable[Mapping[str, Any]]): The rows to insert, as dictionaries keyed by column name.
+            chunk_size (int, optional): Number of rows sent per executemany call. Defaults to 10000.
+            **bulk_load_args (Any): Additional arguments for bulk_load.
+
+        Returns:
+            BulkResult: Counts and throughput of the load.
+        """
+        table = get_table(model_or_table)
+        with self.bulk_load(table, **bulk_load_args) as connection:
+            return execute_chunks(connection, table, sqlalchemy.insert(table), rows, chunk_size)
+
+    def load_csv(self, model_or_table: typing.Any, path: typing.Union[str, Path], chunk_size: int = 10000,
+                 **bulk_load_args: typing.Any) -> BulkResult:
+        """Method for loading a CSV file with a header row. Empty fields are loaded as NULL.
+
+        Args:
+            model_or_table (Any): A mapped class or a Table object.
+            path (Union[str, Path]): The CSV file. Its header must match the column names.
+            chunk_size (int, optional): Number of rows sent per executemany call. Defaults to 10000.
+            **bulk_load_args (Any): Additional arguments for bulk_load.
+
+        Returns:
+            BulkResult: Counts and throughput of the load.
+        """
+        with Path(path).open(newline='') as file:
+            rows = ({key: value if value != '' else None for key, value in row.items()} for row in csv.DictReader(file))
+            return self.load_rows(model_or_table, rows, chunk_size, **bulk_load_args)
+
+    def load_jsonl(self, model_or_table: typing.Any, path: typing.Union[str, Path], chunk_size: int = 10000,
+                   **bulk_load_args: typing.Any) -> BulkResult:
+        """Method for loading a JSON lines file, one object per line.
+
+        Args:
+            model_or_table (Any): A mapped class or a Table object.
+            path (Union[str, Path]): The JSON lines file. Its keys must match the column names.
+            chunk_size (int, optional): Number of rows sent per executemany call. Defaults to 10000.
+            **bulk_load_args (Any): Additional arguments for bulk_load.
+
+        Returns:
+            BulkResult: Counts and throughput of the load.
+        """
+        with Path(path).open() as file:
+            rows = (json.loads(line) for line in file if line.strip())
+            return self.load_rows(model_or_table, rows, chunk_size, **bulk_load_args)
+
+    @staticmethod
+    def _drop_indexes(connection: sqlalchemy.engine.Connection,
+                      tables: typing.List[sqlalchemy.Table]) -> typing.List[typing.Tuple[str, str]]:
+        """ Method for dropping the non-unique secondary indexes of the tables in the current transaction, returning their definitions.
+
+        Indexes backing PRIMARY KEY and UNIQUE constraints have no SQL definition and are kept, and so
+        are the CREATE UNIQUE INDEX ones, so duplicates fail on insert rather than on the rebuild.
+        """
+        indexes: typing.List[typing.Tuple[str, str]] = []
+        for table in tables:
+            indexes.extend(connection.exec_driver_sql(
+                "SELECT m.name, m.sql FROM sqlite_master AS m JOIN pragma_index_list(m.tbl_name) AS l ON l.name = m.name "
+                "WHERE m.type = 'index' AND m.tbl_name = ? AND m.sql IS NOT NULL AND l.\"unique\" = 0",
+                (table.name,),
+            ).all())
+        for name, _ in indexes:
+            logger.debug(f"Dropping index {name} for bulk load.")
+            connection.exec_driver_sql(f'DROP INDEX "{name}"')
+        return indexes
+
+# Template databases
+def template_fingerprint(metadata: typing.Optional[sqlalchemy.MetaData] = None, script_location: typing.Optional[str] = None,
+                         setup: typing.Optional[typing.Callable[[sqlalchemy.engine.Connection], None]] = None) -> str:
+    """Function hashing what a template is built from: the DDL of the metadata or the revision files, and the setup function.
+
+    Args:
+        metadata (Optional[MetaData], optional): The metadata the tables are created from. Defaults to None.
+        script_location (Optional[str], optional): The alembic script directory the tables are migrated with. Defaults to None.
+        setup (Optional[Callable[[Connection], None]], optional): The function seeding the template. Its name and code are hashed,
+            not the values of the globals or closure variables it reads. Defaults to None.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    if metadata is not None:
+        from sqlalchemy.dialects import sqlite
+        dialect = sqlite.dialect()
+        for table in metadata.sorted_tables:
+            digest.update(str(sqlalchemy.schema.CreateTable(table).compile(dialect=dialect)).encode())
+            for index in sorted(table.indexes, key=lambda index: index.name or ''):
+                digest.update(str(sqlalchemy.schema.CreateIndex(index).compile(dialect=dialect)).encode())
+    if script_location is not None:
+        from alembic.script import ScriptDirectory
+        for script in ScriptDirectory(str(script_location)).walk_revisions():
+            digest.update(Path(script.path).read_bytes())
+    if setup is not None:
+        digest.update(f"{setup.__module__}.{setup.__qualname__}".encode())
+        code = getattr(setup, '__code__', None) or getattr(getattr(setup, '__call__', None), '__code__', None)
+        if code is not None:
+            _hash_code(digest, code)
+    return digest.hexdigest()
+
+def _hash_code(digest: typing.Any, code: types.CodeType) -> None:
+    """ Hash the bytecode, names and constants of a function, nested functions included. Stable across processes """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            _hash_code(digest, constant)
+        else:
+            digest.update(repr(constant).encode())
+
+def build_template(directory: typing.Union[str, Path], metadata: typing.Optional[sqlalchemy.MetaData] = None,
+                   script_location: typing.Optional[str] = None,
+                   setup: typing.Optional[typing.Callable[[sqlalchemy.engine.Connection], None]] = None,
+                   rebuild: bool = False) -> Path:
+    """Function building a template SQLite database once, to be cloned by LiteTemplateMixin.from_template.
+
+    The file is named after the fingerprint of its sources, so it is reused across runs until the
+    models or the revisions change. It is built under a temporary name and moved in place, so
+    concurrent builders, e.g. test workers, never see a partial template.
+
+    Args:
+        directory (Union[str, Path]): The directory of the template file.
+        metadata (Optional[MetaData], optional): If given, the tables are created from the metadata. Defaults to None.
+        script_location (Optional[str], optional): If given, the tables are migrated to head with this alembic script directory. Defaults to None.
+        setup (Optional[Callable[[Connection], None]], optional): Seeds the template, e.g. with reference rows. Defaults to None.
+        rebuild (bool, optional): If True, the template is built even if it exists. Defaults to False.
+
+    Returns:
+        Path: The template file.
+
+    Raises:
+        ValueError: Raised if neither or both of metadata and script_location are given.
+    """
+    if (metadata is None) == (script_location is None):
+        raise ValueError("Exactly one of metadata and script_location must be given")
+
+    directory = Path(directory)
+    path = directory / f"template-{template_fingerprint(metadata, script_location, setup)[:16]}.db"
+    if path.exists() and not rebuild:
+        return path
+
+    directory.mkdir(parents=True, exist_ok=True)
+    building = directory / f".{path.name}.{os.getpid()}.tmp"
+    building.unlink(missing_ok=True)
+    engine = sqlalchemy.create_engine(f"sqlite+pysqlite:///{building}")
+    try:
+        with engine.begin() as connection:
+            # A rollback journal keeps the whole database in the single file which is copied
+            connection.exec_driver_sql("PRAGMA journal_mode = DELETE")
+            if metadata is not None:
+                metadata.create_all(connection)
+            else:
+                from sqltoolbox.migrations import upgrade_to_head
+                upgrade_to_head(connection, script_location)
+            if setup is not None:
+                setup(connection)
+    finally:
+        engine.dispose()
+    os.replace(building, path)
+    logger.info(f"Built template database {path}.")
+    return path
+
+def clone_template(template: typing.Union[str, Path], target: typing.Union[str, Path], overwrite: bool = False) -> Path:
+    """Function copying a template database file.
+
+    Args:
+        template (Union[str, Path]): The template file, e.g. from build_template.
+        target (Union[str, Path]): The new database file.
+        overwrite (bool, optional): If True, an existing target is replaced. Defaults to False.
+
+    Returns:
+        Path: The new database file.
+
+    Raises:
+        FileExistsError: Raised if the target exists and overwrite is False.
+    """
+    target = Path(target)
+    if target.exists() and not overwrite:
+        raise FileExistsError(f"Database {target} already exists")
+    shutil.copyfile(template, target)
+    return target
+
+def memory_clone_creator(template: typing.Union[str, Path]) -> typing.Callable[[], sqlite3.Connection]:
+    """Function returning a DBAPI connection creator which copies the template into a new in-memory database.
+
+    The copy uses the SQLite online backup API. The engine must keep the connection, e.g. with a StaticPool.
+
+    Args:
+        template (Union[str, Path]): The template file.
+
+    Returns:
+        Callable[[], Connection]: The creator.
+    """
+    uri = f"{Path(template).resolve().as_uri()}?mode=ro"
+
+    def creator() -> sqlite3.Connection:
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        source = sqlite3.connect(uri, uri=True)
+        try:
+            source.backup(connection)
+        finally:
+            source.close()
+        return connection
+    return creator
+
+class LiteTemplateMixin:
+    """Mixin for creating Lite databases as clones of a template database"""
+
+    @classmethod
+    def from_template(cls, template: typing.Union[str, Path], name: str = ':memory:', overwrite: bool = False,
+                      **kwargs: typing.Any) -> typing.Any:
+        """Method for creating a database object on a clone of a template database.
+
+        A file name gets a copy of the template file. ':memory:' gets an in-memory copy made with the
+        backup API, private to the returned object and shared by its threads through a StaticPool.
+
+        Args:
+            template (Union[str, Path]): The template file, e.g. from build_template.
+            name (str, optional): The file of the clone. Defaults to ':memory:'.
+            overwrite (bool, optional): If True, an existing file is replaced. Defaults to False.
+            **kwargs (Any): The other attributes of the database object, e.g. Base. dialect and driver default to sqlite and pysqlite.
+
+        Returns:
+            Any: The database object.
+        """
+        kwargs.setdefault('dialect', 'sqlite')
+        kwargs.setdefault('driver', 'pysqlite')
+        if is_memory_database(name):
+            kwargs['engine_args'] = {**kwargs.get('engine_args', {}), 'creator': memory_clone_creator(template)}
+        else:
+            clone_template(template, name, overwrite=overwrite)
+        return cls(name=name, **kwargs)
@@ -0,0 +1,190 @@
+""" Module with the relationship loading helpers of the database classes
+
+The N+1 detector counts the lazy loads fired by the sessions of a database, per relationship
+and per parent statement, i.e. the last select executed by the session before the lazy load.
+Past a threshold it logs a warning, or raises, naming the relationship and the statement.
+
+Loading profiles are named sets of eager loading options, so a hot path is fixed with
+``select(User).options(*loading_profile('user_with_role_and_addresses'))``.
+"""
+import typing
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, joinedload, selectinload
+
+__all__ = [
+    'LOADING_PROFILES',
+    'LazyLoadDetector',
+    'LoadingMixin',
+    'NPlusOneError',
+    'loading_profile',
+    'register_loading_profile',
+]
+
+logger = logging.getLogger('database')
+
+# Session.info key of the lazy load counts of the current parent statement
+PARENT_KEY = 'sqltoolbox_lazy_loads'
+
+LoaderOptions = typing.Tuple[typing.Any, ...]
+
+class NPlusOneError(RuntimeError):
+    """Exception raised when a relationship is lazy loaded more times than the threshold."""
+
+@dataclass
+class _Parent:
+    """ The last select of a session and the lazy loads which followed it """
+    statement:  typing.Any
+    counts:     typing.Counter = field(default_factory=Counter)
+    reported:   typing.Set[str] = field(default_factory=set)
+
+    @property
+    def text(self) -> str:
+        if self.statement is None:
+            return 'unknown statement'
+        text = ' '.join(str(self.statement).split())
+        return text if len(text) <= 200 else f"{text[:197]}..."
+
+@dataclass
+class LazyLoadDetector:
+    """N+1 detector installed on a session factory.
+
+    Attributes:
+        threshold (int, optional): Number of lazy loads of a relationship after a statement tolerated before reporting. Defaults to 10.
+        raise_error (bool, optional): If True, raise NPlusOneError past the threshold instead of logging a warning. Defaults to False.
+    """
+    threshold:      int = 10
+    raise_error:    bool = False
+    _offenders:     typing.Dict[typing.Tuple[str, str], int] = field(default_factory=dict, init=False, repr=False)
+    _lock:          threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def offenders(self) -> typing.Dict[typing.Tuple[str, str], int]:
+        """The highest lazy load count past the threshold, by relationship and parent statement."""
+        with self._lock:
+            return dict(self._offenders)
+
+    def install(self, target: typing.Any) -> None:
+        """Method for listening to the sessions of a session factory.
+
+        Args:
+            target (Union[sessionmaker, Session]): The session factory.
+        """
+        event.listen(target, 'do_orm_execute', self._do_orm_execute)
+
+    def uninstall(self, target: typing.Any) -> None:
+        """Method for removing the listener installed on a session factory."""
+        event.remove(target, 'do_orm_execute', self._do_orm_execute)
+
+    def reset(self) -> None:
+        """Method for clearing the recorded offenders."""
+        with self._lock:
+            self._offenders.clear()
+
+    def _do_orm_execute(self, state: ORMExecuteState) -> None:
+        if state.lazy_loaded_from is None:
+            if state.is_select and not state.is_relationship_load and not state.is_column_load:
+                state.session.info[PARENT_KEY] = _Parent(state.statement)
+            return
+
+        parent = state.session.info.setdefault(PARENT_KEY, _Parent(None))
+        path = state.loader_strategy_path
+        relationship = str(path.prop) if path is not None and path.prop is not None else 'unknown relationship'
+        parent.counts[relationship] += 1
+        count = parent.counts[relationship]
+        if count <= self.threshold:
+            return
+
+        key = (relationship, parent.text)
+        with self._lock:
+            self._offenders[key] = max(count, self._offenders.get(key, 0))
+
+        message = (f"N+1 queries: {relationship} lazy loaded {count} times after {parent.text}. "
+                   f"Load it eagerly, e.g. with a loading profile.")
+        if self.raise_error:
+            raise NPlusOneError(message)
+        if relationship not in parent.reported:
+            parent.reported.add(relationship)
+            logger.warning(message)
+
+# Loading profiles
+LOADING_PROFILES: typing.Dict[str, typing.Callable[[], LoaderOptions]] = {}
+
+def register_loading_profile(name: str, factory: typing.Callable[[], LoaderOptions]) -> None:
+    """Function registering a loading profile.
+
+    Args:
+        name (str): The name of the profile, e.g. 'user_with_role_and_addresses'.
+        factory (Callable[[], Tuple[Any, ...]]): Returns the loader options. Called on each use, so the models can be imported lazily.
+    """
+    LOADING_PROFILES[name] = factory
+
+def loading_profile(name: str) -> LoaderOptions:
+    """Function returning the loader options of a profile, e.g. select(User).options(*loading_profile('user_with_role')).
+
+    Args:
+        name (str): The name of the profile.
+
+    Returns:
+        Tuple[Any, ...]: The loader options.
+
+    Raises:
+        KeyError: Raised if the profile is not registered.
+    """
+    try:
+        factory = LOADING_PROFILES[name]
+    except KeyError:
+        raise KeyError(f"Unknown loading profile {name!r}. Expected one of {sorted(LOADING_PROFILES)}") from None
+    return tuple(factory())
+
+def _models() -> typing.Any:
+    """ The bundled models, imported on first use of a profile """
+    from sqltoolbox import models
+    return models
+
+# Many-to-one relationships are joined, collections are loaded with a second SELECT ... IN
+register_loading_profile('user_with_role', lambda: (joinedload(_models().User.role),))
+register_loading_profile('user_with_addresses', lambda: (selectinload(_models().User.addresses),))
+register_loading_profile('user_with_role_and_addresses', lambda: (
+    joinedload(_models().User.role),
+    selectinload(_models().User.addresses),
+))
+register_loading_profile('role_with_users', lambda: (selectinload(_models().Role.users),))
+register_loading_profile('role_with_users_and_addresses', lambda: (
+    selectinload(_models().Role.users).selectinload(_models().User.addresses),
+))
+
+class LoadingMixin:
+    """Mixin for detecting the N+1 lazy loads of the sessions"""
+
+    @property
+    def lazy_load_detector(self) -> typing.Optional[LazyLoadDetector]:
+        """The N+1 detector of the sessions, None while disabled."""
+        return getattr(self, '_lazy_load_detector', None)
+
+    def enable_lazy_load_detection(self, threshold: int = 10, raise_error: bool = False) -> LazyLoadDetector:
+        """Method for counting the lazy loads of the sessions and reporting the N+1 patterns.
+
+        Args:
+            threshold (int, optional): Number of lazy loads of a relationship after a statement tolerated. Defaults to 10.
+            raise_error (bool, optional): If True, raise NPlusOneError past the threshold, e.g. in tests. Defaults to False, log a warning.
+
+        Returns:
+            LazyLoadDetector: The detector.
+        """
+        self.disable_lazy_load_detection()
+        detector = LazyLoadDetector(threshold=threshold, raise_error=raise_error)
+        detector.install(self._session_factory)
+        self._lazy_load_detector = detector
+        return detector
+
+    def disable_lazy_load_detection(self) -> None:
+        """Method for removing the N+1 detector."""
+        if self.lazy_load_detector is not None:
+            self.lazy_load_detector.uninstall(self._session_factory)
+            self._lazy_load_detector = None
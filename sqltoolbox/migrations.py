@@ -0,0 +1,379 @@
+""" Module for running alembic migrations of several databases concurrently
+
+Alembic installs the ``context`` and ``op`` proxies at module level, so two migrations
+can not run in the same process at the same time. Each database is migrated by a worker
+process that runs the alembic command restricted to that database through the
+``-x database=<name>`` argument. The ``env.py`` of the worker uses ``current_worker`` to
+bound the number of in-flight connections and to take part in a coordinated two-phase commit.
+
+Offline (``--sql``) scripts are rendered the same way, once per group of databases sharing a
+dialect and a starting revision, and identical scripts are written once with a manifest.
+"""
+import json
+import time
+import typing
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, Future
+
+import sqlalchemy
+from alembic import command
+from alembic.config import Config
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+__all__ = [
+    'DATABASE_X_ARGUMENT',
+    'MigrationError',
+    'MigrationResult',
+    'MigrationWorker',
+    'TwoPhaseRollback',
+    'current_worker',
+    'format_report',
+    'offline_group_key',
+    'render_offline_scripts',
+    'run_concurrent_migrations',
+    'upgrade_to_head',
+]
+
+logger = logging.getLogger('database')
+
+# -x argument used to restrict a worker to a single database
+DATABASE_X_ARGUMENT = 'database'
+# Option of a database section overriding the starting revision of its offline script
+STARTING_REV_OPTION = 'starting_rev'
+MANIFEST_NAME = 'manifest.json'
+
+# Migration status values
+COMMITTED   = 'committed'
+ROLLED_BACK = 'rolled back'
+FAILED      = 'failed'
+
+class MigrationError(Exception):
+    """Raised when the migration of at least one database failed."""
+
+@dataclass
+class MigrationResult:
+    """Outcome of the migration of a single database.
+
+    Attributes:
+        name (str): The name of the database.
+        status (str): One of 'committed', 'rolled back' or 'failed'.
+        seconds (float): Wall time spent by the worker.
+        error (Optional[str], optional): The error raised by the worker, if any. Defaults to None.
+    """
+    name:       str
+    status:     str
+    seconds:    float
+    error:      typing.Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the migration was committed."""
+        return self.status == COMMITTED
+
+class TwoPhaseRollback(Exception):
+    """Raised by a worker ``env.py`` when the coordinator decided to roll back the two-phase transactions."""
+
+@dataclass
+class MigrationWorker:
+    """State shared between a worker process and the coordinator.
+
+    Attributes:
+        name (str): The name of the database migrated by the worker.
+        connection_slots (Optional[Semaphore]): Semaphore bounding the in-flight connections.
+        votes (Optional[Queue]): Queue where two-phase workers report that their transaction is prepared.
+        decision (Optional[Dict]): Shared dictionary holding the commit decision of the coordinator.
+        decided (Optional[Event]): Event set once the decision is available.
+        decision_timeout (Optional[float]): Seconds a prepared worker waits for the decision. None waits forever.
+        sql_output (Optional[str]): File where an offline worker writes its SQL script.
+    """
+    name:               str
+    connection_slots:   typing.Any = None
+    votes:              typing.Any = None
+    decision:           typing.Any = None
+    decided:            typing.Any = None
+    decision_timeout:   typing.Optional[float] = None
+    sql_output:         typing.Optional[str] = None
+
+    @property
+    def twophase(self) -> bool:
+        """True if the worker takes part in a coordinated two-phase commit."""
+        return self.votes is not None
+
+    @contextlib.contextmanager
+    def connection_slot(self) -> typing.Iterator[None]:
+        """Context manager holding one of the in-flight connection slots."""
+        if self.connection_slots is None:
+            yield
+            return
+
+        with self.connection_slots:
+            yield
+
+    def vote(self) -> bool:
+        """Method for reporting a prepared transaction and waiting for the coordinator decision.
+
+        Returns:
+            bool: True if every database is prepared and the transaction must be committed.
+        """
+        if not self.twophase:
+            return True
+
+        self.votes.put(self.name)
+        if not self.decided.wait(self.decision_timeout):
+            logger.error(f"No commit decision received for database {self.name}. Rolling back.")
+            return False
+
+        return bool(self.decision.get('commit', False))
+
+_worker: typing.Optional[MigrationWorker] = None
+
+def current_worker() -> typing.Optional[MigrationWorker]:
+    """Function returning the worker state when called inside a migration worker process.
+
+    Returns:
+        Optional[MigrationWorker]: The worker state, None in the coordinating process.
+    """
+    return _worker
+
+def _run_worker(config_file: str, ini_section: str, command_name: str, revision: str,
+                x_arguments: typing.List[str], worker: MigrationWorker, sql: bool = False) -> MigrationResult:
+    """ Run the alembic command for a single database in a worker process """
+    global _worker
+    _worker = worker
+
+    config = Config(config_file, ini_section=ini_section)
+    config.cmd_opts = argparse.Namespace(x=[*x_arguments, f"{DATABASE_X_ARGUMENT}={worker.name}"])
+
+    start = time.perf_counter()
+    try:
+        getattr(command, command_name)(config, revision, sql=sql)
+    except TwoPhaseRollback:
+        return MigrationResult(worker.name, ROLLED_BACK, time.perf_counter() - start)
+    except Exception as e:
+        return MigrationResult(worker.name, FAILED, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+    finally:
+        _worker = None
+
+    return MigrationResult(worker.name, COMMITTED, time.perf_counter() - start)
+
+def run_concurrent_migrations(config: Config, names: typing.List[str], command_name: str = 'upgrade',
+                              revision: str = 'head', max_workers: int = 8,
+                              max_connections: typing.Optional[int] = None, twophase: bool = False,
+                              decision_timeout: typing.Optional[float] = None) -> typing.List[MigrationResult]:
+    """Function for migrating several databases concurrently in worker processes.
+
+    Without two-phase commit, each database commits its own transaction and a failure does not affect
+    the others. With two-phase commit, every worker prepares its transaction and waits until the
+    coordinator decides to commit all of them or to roll back all of them. Every transaction has to be
+    in flight at the same time, so max_workers and max_connections must cover all the databases.
+
+    Args:
+        config (Config): The alembic config of the running command.
+        names (List[str]): The names of the databases to migrate.
+        command_name (str, optional): The alembic command run by the workers. Defaults to 'upgrade'.
+        revision (str, optional): The target revision. Defaults to 'head'.
+        max_workers (int, optional): Maximum number of worker processes. Defaults to 8.
+        max_connections (Optional[int], optional): Maximum number of in-flight connections. Defaults to None, one per worker.
+        twophase (bool, optional): Coordinate an all-or-nothing commit. Defaults to False.
+        decision_timeout (Optional[float], optional): Seconds a prepared worker waits for the decision. Defaults to None.
+
+    Returns:
+        List[MigrationResult]: The result for each database, in the order of names.
+
+    Raises:
+        ValueError: Raised if two-phase commit is requested with less workers or connections than databases.
+    """
+    if config.config_file_name is None:
+        raise ValueError("Concurrent migrations require an alembic config file")
+
+    if twophase and (max_workers < len(names) or (max_connections is not None and max_connections < len(names))):
+        raise ValueError(
+            f"Two-phase commit keeps every transaction open until all are prepared: "
+            f"{len(names)} databases need as many workers and connections"
+        )
+
+    x_arguments = _x_arguments(config)
+    context = multiprocessing.get_context('spawn')
+
+    with context.Manager() as manager, ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        connection_slots = manager.BoundedSemaphore(max_connections) if max_connections else None
+        votes = manager.Queue() if twophase else None
+        decision = manager.dict() if twophase else None
+        decided = manager.Event() if twophase else None
+
+        futures: typing.Dict[str, Future] = {}
+        for name in names:
+            worker = MigrationWorker(name, connection_slots, votes, decision, decided, decision_timeout)
+            futures[name] = executor.submit(
+                _run_worker, config.config_file_name, config.config_ini_section, command_name, revision, x_arguments, worker
+            )
+
+        if twophase:
+            _coordinate(futures, votes, decision, decided)
+
+        results = []
+        for name, future in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(MigrationResult(name, FAILED, 0.0, error=f"{type(e).__name__}: {e}"))
+
+    return results
+
+def _x_arguments(config: Config) -> typing.List[str]:
+    """ The -x arguments of the running command, without the database restriction """
+    return [arg for arg in (getattr(config.cmd_opts, 'x', None) or []) if not arg.startswith(f"{DATABASE_X_ARGUMENT}=")]
+
+def offline_group_key(config: Config, name: str) -> typing.Tuple[str, typing.Optional[str]]:
+    """Function returning the (dialect, starting revision) group of a database for offline rendering.
+
+    Args:
+        config (Config): The alembic config. The database section holds sqlalchemy.url and optionally starting_rev.
+        name (str): The name of the database section.
+
+    Returns:
+        Tuple[str, Optional[str]]: The dialect name and the starting revision, None to start from the base.
+    """
+    url = config.get_section_option(name, 'sqlalchemy.url')
+    dialect = sqlalchemy.engine.make_url(url).get_dialect().name if url else 'default'
+    return dialect, config.get_section_option(name, STARTING_REV_OPTION)
+
+def render_offline_scripts(config: Config, names: typing.List[str], output_dir: typing.Union[str, Path] = 'sql',
+                           command_name: str = 'upgrade', revision: str = 'head',
+                           max_workers: int = 8) -> typing.Dict[str, typing.Any]:
+    """Function rendering the offline SQL scripts of several databases, deduplicated by content.
+
+    Every database is rendered concurrently in worker processes running the alembic command with --sql, since
+    databases sharing a dialect and a starting revision may still run different migrations. Identical scripts
+    are written once, named after their hash, and the manifest maps every database to its script and every
+    script to its (dialect, starting revision) groups.
+
+    Args:
+        config (Config): The alembic config of the running command.
+        names (List[str]): The names of the databases.
+        output_dir (Union[str, Path], optional): The directory of the scripts and of manifest.json. Defaults to 'sql'.
+        command_name (str, optional): The alembic command run by the workers. Defaults to 'upgrade'.
+        revision (str, optional): The target revision. Defaults to 'head'.
+        max_workers (int, optional): Maximum number of worker processes. Defaults to 8.
+
+    Returns:
+        Dict[str, Any]: The manifest, also written to manifest.json.
+
+    Raises:
+        MigrationError: Raised if a database could not be rendered.
+    """
+    if config.config_file_name is None:
+        raise ValueError("Offline rendering requires an alembic config file")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    x_arguments = _x_arguments(config)
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as staging, \
+         ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(names))), mp_context=context) as executor:
+        futures: typing.Dict[str, Future] = {}
+        outputs: typing.Dict[str, Path] = {}
+        for index, name in enumerate(names):
+            outputs[name] = Path(staging) / f"{index}.sql"
+            worker = MigrationWorker(name, sql_output=str(outputs[name]))
+            futures[name] = executor.submit(
+                _run_worker, config.config_file_name, config.config_ini_section, command_name, revision,
+                x_arguments, worker, True,
+            )
+
+        failed = []
+        scripts: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        databases: typing.Dict[str, str] = {}
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                result = MigrationResult(name, FAILED, 0.0, error=f"{type(e).__name__}: {e}")
+            if not result.ok:
+                failed.append(f"{name}: {result.error}")
+                continue
+
+            digest = hashlib.sha256(outputs[name].read_bytes()).hexdigest()
+            file_name = f"{digest[:16]}.sql"
+            if file_name not in scripts:
+                shutil.move(str(outputs[name]), output_dir / file_name)
+                scripts[file_name] = dict(sha256=digest, groups=[], databases=[])
+            dialect, starting_rev = offline_group_key(config, name)
+            group = dict(dialect=dialect, starting_rev=starting_rev)
+            if group not in scripts[file_name]['groups']:
+                scripts[file_name]['groups'].append(group)
+            scripts[file_name]['databases'].append(name)
+            databases[name] = file_name
+
+    if failed:
+        raise MigrationError("Offline rendering failed for " + "; ".join(failed))
+
+    manifest = dict(command=command_name, revision=revision, scripts=scripts, databases=databases)
+    (output_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    logger.info(f"Rendered {len(names)} databases into {len(scripts)} scripts "
+                f"in {time.perf_counter() - start:.3f}s. Manifest written to {output_dir / MANIFEST_NAME}.")
+    return manifest
+
+def _coordinate(futures: typing.Dict[str, Future], votes: typing.Any, decision: typing.Any, decided: typing.Any) -> None:
+    """ Wait until every worker prepared its transaction or failed, then publish the commit decision """
+    prepared: typing.Set[str] = set()
+    failed: typing.Set[str] = set()
+    try:
+        while True:
+            failed = {name for name, future in futures.items() if future.done() and name not in prepared}
+            if failed or len(prepared) == len(futures):
+                break
+            with contextlib.suppress(Exception):
+                prepared.add(votes.get(timeout=0.1))
+    finally:
+        decision['commit'] = not failed and len(prepared) == len(futures)
+        decided.set()
+
+    logger.info(f"Two-phase decision: {'commit' if decision['commit'] else 'rollback'} "
+                f"({len(prepared)}/{len(futures)} databases prepared)")
+
+def format_report(results: typing.List[MigrationResult]) -> typing.List[str]:
+    """Function for rendering the per-database timing and status report.
+
+    Args:
+        results (List[MigrationResult]): The results of a concurrent migration.
+
+    Returns:
+        List[str]: The lines of the report.
+    """
+    width = max([len('database'), *(len(result.name) for result in results)])
+    lines = [f"{'database':<{width}}  {'status':<11}  {'seconds':>8}  error"]
+    for result in sorted(results, key=lambda result: result.seconds, reverse=True):
+        lines.append(f"{result.name:<{width}}  {result.status:<11}  {result.seconds:>8.3f}  {result.error or ''}".rstrip())
+
+    failed = sum(not result.ok for result in results)
+    lines.append(f"{len(results)} databases, {len(results) - failed} committed, {failed} not committed, "
+                 f"{sum(result.seconds for result in results):.3f}s total worker time")
+    return lines
+
+def upgrade_to_head(connection: sqlalchemy.engine.Connection, script: typing.Union[str, ScriptDirectory]) -> None:
+    """Function upgrading a connection to the head of an alembic script directory, without going through env.py.
+
+    Args:
+        connection (Connection): The connection, committed by the caller.
+        script (Union[str, ScriptDirectory]): The alembic script directory or its location, e.g. 'single-alembic'.
+            Pass a ScriptDirectory to parse the revision files once for many databases.
+    """
+    script = script if isinstance(script, ScriptDirectory) else ScriptDirectory(str(script))
+    context = MigrationContext.configure(connection, opts=dict(
+        script=script, fn=lambda revision, _: script._upgrade_revs('head', revision),
+    ))
+    with Operations.context(context):
+        context.run_migrations()
@@ -1,5 +1,26 @@
-""" ORM Models for the database. """
+""" ORM Models for the database.
 
-from sqltoolbox.models.user import User
-from sqltoolbox.models.role import Role
-from sqltoolbox.models.address import Address
\ No newline at end of file
+The model modules are imported on first access to a model, e.g. ``from sqltoolbox.models import User``,
+so importing ``sqltoolbox.models.base`` does not register them on the declarative Base.
+"""
+import importlib
+
+__all__ = ['User', 'Role', 'Address']
+
+# Model name -> module defining it
+MODEL_MODULES = {
+    'User': 'sqltoolbox.models.user',
+    'Role': 'sqltoolbox.models.role',
+    'Address': 'sqltoolbox.models.address',
+}
+
+def register_models() -> None:
+    """Function importing every model module, registering the models on the declarative Base."""
+    for module in MODEL_MODULES.values():
+        importlib.import_module(module)
+
+def __getattr__(name: str):
+    if name in MODEL_MODULES:
+        register_models()
+        return getattr(importlib.import_module(MODEL_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
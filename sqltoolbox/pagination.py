@@ -0,0 +1,252 @@
+""" Module with the keyset pagination helpers of the database classes
+
+Pages are selected with a WHERE condition on an ordered unique key, e.g. ``id > :last_id
+ORDER BY id LIMIT :limit``, instead of an OFFSET. With an index on the key every page costs a
+single index seek, however deep it is in the result. The position of a page is returned as an
+opaque cursor token encoding the key of its first or last row.
+
+The key columns must be unique together and NOT NULL. Each column can be descending,
+e.g. key=[User.name.desc(), User.id].
+"""
+import json
+import uuid
+import base64
+import typing
+import decimal
+import logging
+import datetime
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import coercions, operators, roles
+
+__all__ = [
+    'Page',
+    'PaginationMixin',
+    'decode_cursor',
+    'dump_key',
+    'encode_cursor',
+    'load_key',
+    'paginate',
+]
+
+logger = logging.getLogger('database')
+
+NEXT = 'next'
+PREVIOUS = 'prev'
+
+KeyColumn = typing.Union[sqlalchemy.ColumnElement, typing.Any]
+
+@dataclass
+class Page:
+    """A page of a keyset paginated result.
+
+    Attributes:
+        items (List[Any]): The rows of the page, or the entities when the select has a single column, e.g. select(User).
+        next_cursor (Optional[str]): The cursor of the following page, None on the last page.
+        previous_cursor (Optional[str]): The cursor of the preceding page, None on the first page.
+    """
+    items:              typing.List[typing.Any] = field(default_factory=list)
+    next_cursor:        typing.Optional[str] = None
+    previous_cursor:    typing.Optional[str] = None
+
+    @property
+    def has_next(self) -> bool:
+        """True if a page follows this one."""
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self) -> bool:
+        """True if a page precedes this one."""
+        return self.previous_cursor is not None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        return iter(self.items)
+
+def _to_json(value: typing.Any) -> typing.Any:
+    """ Tag the key values json does not support so they are decoded with their type """
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'$decimal': str(value)}
+    if isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    return value
+
+def _from_json(value: typing.Any) -> typing.Any:
+    """ Inverse of _to_json """
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, text), = value.items()
+        decoders = {'$datetime': datetime.datetime.fromisoformat, '$date': datetime.date.fromisoformat,
+                    '$decimal': decimal.Decimal, '$uuid': uuid.UUID}
+        if tag in decoders:
+            return decoders[tag](text)
+    return value
+
+def dump_key(values: typing.Sequence[typing.Any]) -> str:
+    """Function serializing key values as JSON, keeping the type of datetimes, dates, decimals and UUIDs.
+
+    Args:
+        values (Sequence[Any]): The values of the key columns.
+
+    Returns:
+        str: The JSON text, e.g. '[{"$datetime": "2024-01-01T00:00:00"}, 7]'.
+    """
+    return json.dumps([_to_json(value) for value in values])
+
+def load_key(text: str) -> typing.Tuple[typing.Any, ...]:
+    """Function deserializing key values serialized by dump_key.
+
+    Args:
+        text (str): The JSON text from dump_key.
+
+    Returns:
+        Tuple[Any, ...]: The key values, with their types.
+    """
+    return tuple(_from_json(value) for value in json.loads(text))
+
+def encode_cursor(values: typing.Sequence[typing.Any], direction: str = NEXT) -> str:
+    """Function encoding a key position as an opaque, URL safe cursor token.
+
+    Args:
+        values (Sequence[Any]): The values of the key columns of the boundary row.
+        direction (str, optional): 'next' for the rows after the position, 'prev' for the rows before. Defaults to 'next'.
+
+    Returns:
+        str: The cursor token.
+    """
+    payload = json.dumps({'d': direction, 'k': [_to_json(value) for value in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> typing.Tuple[str, typing.Tuple[typing.Any, ...]]:
+    """Function decoding a cursor token.
+
+    Args:
+        cursor (str): The cursor token from encode_cursor.
+
+    Returns:
+        Tuple[str, Tuple[Any, ...]]: The direction and the key values.
+
+    Raises:
+        ValueError: Raised if the token is not a valid cursor.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, values = payload['d'], payload['k']
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid pagination cursor {cursor!r}") from e
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        raise ValueError(f"Invalid pagination cursor {cursor!r}")
+    return direction, tuple(_from_json(value) for value in values)
+
+def _key_columns(statement: sqlalchemy.Select, key: typing.Optional[typing.Sequence[KeyColumn]]) -> typing.List[typing.Tuple[sqlalchemy.ColumnElement, bool]]:
+    """ The key columns and whether each one is descending. Defaults to the primary key of the selected entity """
+    if key is None:
+        entity = statement.column_descriptions[0].get('entity')
+        if entity is None:
+            raise ValueError("The select has no entity, give the key columns")
+        key = list(sqlalchemy.inspect(entity).primary_key)
+
+    columns = []
+    for column in key:
+        descending = False
+        element = coercions.expect(roles.ByOfRole, column)
+        if isinstance(element, sqlalchemy.UnaryExpression) and element.modifier in (operators.desc_op, operators.asc_op):
+            descending = element.modifier is operators.desc_op
+            element = element.element
+        columns.append((element, descending))
+    return columns
+
+def _seek(columns: typing.Sequence[typing.Tuple[sqlalchemy.ColumnElement, bool]], values: typing.Sequence[typing.Any],
+          forward: bool) -> sqlalchemy.ColumnElement:
+    """ Condition selecting the rows after, or before, the key values in the key order
+
+    Expanded as (a > x) OR (a = x AND b > y) so it works with mixed directions and
+    without row value support. The redundant bound a >= x is added for composite keys:
+    the OR alone cannot start an index range scan, the bound seeks the index on (a, b).
+    """
+    clauses = []
+    for index, ((column, descending), value) in enumerate(zip(columns, values)):
+        after = column < value if descending == forward else column > value
+        equal = [previous == previous_value for (previous, _), previous_value in zip(columns[:index], values)]
+        clauses.append(sqlalchemy.and_(*equal, after))
+    if len(columns) == 1:
+        return clauses[0]
+
+    (leading, descending), value = columns[0], values[0]
+    bound = leading <= value if descending == forward else leading >= value
+    return sqlalchemy.and_(bound, sqlalchemy.or_(*clauses))
+
+def paginate(session: Session, statement: sqlalchemy.Select, limit: int = 50, cursor: typing.Optional[str] = None,
+             key: typing.Optional[typing.Sequence[KeyColumn]] = None) -> Page:
+    """Function returning a page of a select with keyset pagination.
+
+    The ORDER BY of the statement is replaced by the key. The first page is returned
+    without cursor, the others with the next_cursor or previous_cursor of a page.
+
+    Args:
+        session (Session): The session executing the statement.
+        statement (Select): The select to paginate, e.g. select(User).where(User.role_id == 1).
+        limit (int, optional): Maximum number of rows of the page. Defaults to 50.
+        cursor (Optional[str], optional): The cursor of the page. Defaults to None, the first page.
+        key (Optional[Sequence[Union[ColumnElement, InstrumentedAttribute]]], optional): The ordered unique key,
+            e.g. [User.name.desc(), User.id]. Defaults to None, the primary key of the selected entity.
+
+    Returns:
+        Page: The page and the cursors of its neighbours.
+
+    Raises:
+        ValueError: Raised if the limit is not positive or the cursor is invalid or does not match the key.
+    """
+    if limit < 1:
+        raise ValueError(f"limit must be a positive integer, got {limit}")
+
+    columns = _key_columns(statement, key)
+    direction, values = decode_cursor(cursor) if cursor is not None else (NEXT, None)
+    if values is not None and len(values) != len(columns):
+        raise ValueError(f"The cursor has {len(values)} key values, the key has {len(columns)} columns")
+    forward = direction == NEXT
+
+    width = len(statement.column_descriptions)
+    query = statement.order_by(None).add_columns(*(column.label(f"_key_{index}") for index, (column, _) in enumerate(columns)))
+    if values is not None:
+        query = query.where(_seek(columns, values, forward))
+    query = query.order_by(*(column.desc() if descending == forward else column.asc() for column, descending in columns)).limit(limit + 1)
+
+    rows = session.execute(query).all()
+    more = len(rows) > limit
+    rows = rows[:limit] if forward else rows[:limit][::-1]
+
+    page = Page([row[0] if width == 1 else row[:width] for row in rows])
+    if rows:
+        first, last = tuple(rows[0][-len(columns):]), tuple(rows[-1][-len(columns):])
+        if more or not forward:
+            page.next_cursor = encode_cursor(last, NEXT)
+        if (more and not forward) or (forward and values is not None):
+            page.previous_cursor = encode_cursor(first, PREVIOUS)
+    return page
+
+class PaginationMixin:
+    """Mixin for the keyset pagination of selects"""
+
+    def paginate(self, statement: sqlalchemy.Select, limit: int = 50, cursor: typing.Optional[str] = None,
+                 key: typing.Optional[typing.Sequence[KeyColumn]] = None) -> Page:
+        """Method returning a page of a select with keyset pagination in a new session.
+
+        Args:
+            statement (Select): The select to paginate, e.g. select(User).
+            limit (int, optional): Maximum number of rows of the page. Defaults to 50.
+            cursor (Optional[str], optional): The next_cursor or previous_cursor of a page. Defaults to None, the first page.
+            key (Optional[Sequence[Union[ColumnElement, InstrumentedAttribute]]], optional): The ordered unique key. Defaults to None, the primary key.
+
+        Returns:
+            Page: The page and the cursors of its neighbours.
+        """
+        with self.session as session:
+            return paginate(session, statement, limit=limit, cursor=cursor, key=key)
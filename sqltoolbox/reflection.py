@@ -0,0 +1,228 @@
+""" Module for caching reflected schemas between processes
+
+A reflected MetaData is pickled to a local file together with a fingerprint of the
+schema. The fingerprint is computed with one cheap catalog query, so a process can
+check whether the cached MetaData is still valid without reflecting every table.
+"""
+import os
+import typing
+import pickle
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+
+import sqlalchemy
+from sqlalchemy import util
+
+__all__ = [
+    'LazyClasses',
+    'ReflectionCache',
+    'schema_fingerprint',
+]
+
+logger = logging.getLogger('database')
+
+# Catalog queries returning a description of the schema, by dialect name
+FINGERPRINT_QUERIES: typing.Dict[str, typing.List[str]] = {
+    'sqlite': ["SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name"],
+    'mysql': [(
+        "SELECT c.table_name, c.column_name, c.column_type, c.is_nullable, c.column_default, c.column_key, "
+        "k.referenced_table_name, k.referenced_column_name "
+        "FROM information_schema.columns c LEFT JOIN information_schema.key_column_usage k "
+        "ON k.table_schema = c.table_schema AND k.table_name = c.table_name AND k.column_name = c.column_name "
+        "WHERE c.table_schema = DATABASE() "
+        "ORDER BY c.table_name, c.ordinal_position, k.constraint_name"
+    ), (
+        "SELECT table_name, index_name, non_unique, seq_in_index, column_name, sub_part, index_type "
+        "FROM information_schema.statistics WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, index_name, seq_in_index"
+    )],
+    'postgresql': [
+        (
+            "SELECT table_name, column_name, data_type, is_nullable, column_default "
+            "FROM information_schema.columns WHERE table_schema = current_schema() "
+            "ORDER BY table_name, ordinal_position"
+        ),
+        "SELECT tablename, indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() ORDER BY tablename, indexname",
+        (
+            "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE connamespace = current_schema()::regnamespace AND contype IN ('p', 'f', 'u', 'c') ORDER BY 1, 2"
+        ),
+    ],
+}
+FINGERPRINT_QUERIES['mariadb'] = FINGERPRINT_QUERIES['mysql']
+
+def schema_fingerprint(connection: sqlalchemy.engine.Connection) -> typing.Optional[str]:
+    """Function computing a fingerprint of the schema of a database with a few catalog queries: columns, indexes and constraints.
+
+    Dialects without a catalog query fall back to the revisions stored in the alembic_version table.
+
+    Args:
+        connection (Connection): A SQLAlchemy connection object
+
+    Returns:
+        Optional[str]: A hex digest, None if the schema can not be fingerprinted.
+    """
+    queries = FINGERPRINT_QUERIES.get(connection.dialect.name)
+    if queries is None:
+        if not sqlalchemy.inspect(connection).has_table('alembic_version'):
+            return None
+        queries = ["SELECT version_num FROM alembic_version ORDER BY version_num"]
+
+    digest = hashlib.sha256()
+    for query in queries:
+        for row in connection.execute(sqlalchemy.text(query)):
+            digest.update(repr(tuple(row)).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+@dataclass
+class ReflectionCache:
+    """Local file cache of reflected MetaData objects keyed by database URL.
+
+    The cache files are pickles. Only point the directory to a location trusted by the process.
+
+    Attributes:
+        directory (Union[str, Path], optional): The directory holding the cache files. Defaults to 'data/.reflection'.
+    """
+    directory:  typing.Union[str, Path] = Path('data') / '.reflection'
+
+    def path_for(self, url: sqlalchemy.engine.URL) -> Path:
+        """Method returning the cache file of a database URL.
+
+        Args:
+            url (URL): The URL of the database.
+
+        Returns:
+            Path: The path of the cache file.
+        """
+        key = hashlib.sha256(url.render_as_string(hide_password=True).encode()).hexdigest()[:32]
+        return Path(self.directory) / f"{key}.pickle"
+
+    def reflect(self, engine: sqlalchemy.engine.Engine, **reflect_args: typing.Any) -> sqlalchemy.MetaData:
+        """Method returning the reflected MetaData of the engine database, from the cache when the schema is unchanged.
+
+        Args:
+            engine (Engine): A SQLAlchemy engine object
+            **reflect_args (Any): Additional arguments for MetaData.reflect. They are part of the cache entry.
+
+        Returns:
+            MetaData: The reflected MetaData.
+        """
+        with engine.connect() as connection:
+            return self.reflect_connection(connection, **reflect_args)
+
+    def reflect_connection(self, connection: sqlalchemy.engine.Connection, **reflect_args: typing.Any) -> sqlalchemy.MetaData:
+        """Method returning the reflected MetaData of the connection database. Usable with AsyncConnection.run_sync.
+
+        Args:
+            connection (Connection): A SQLAlchemy connection object
+            **reflect_args (Any): Additional arguments for MetaData.reflect. They are part of the cache entry.
+
+        Returns:
+            MetaData: The reflected MetaData.
+        """
+        path = self.path_for(connection.engine.url)
+        options = repr(sorted(reflect_args.items()))
+
+        fingerprint = schema_fingerprint(connection)
+        cached = self._load(path) if fingerprint is not None else None
+
+        if cached is not None and cached['fingerprint'] == fingerprint and cached['options'] == options:
+            logger.debug(f"Loaded reflected schema of {connection.engine.url.database} from {path}.")
+            return cached['metadata']
+
+        metadata = sqlalchemy.MetaData()
+        metadata.reflect(bind=connection, **reflect_args)
+
+        if fingerprint is not None:
+            self._dump(path, dict(fingerprint=fingerprint, options=options, metadata=metadata))
+        return metadata
+
+    def clear(self) -> None:
+        """Method for removing every cache file of the directory."""
+        for path in Path(self.directory).glob('*.pickle'):
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _load(path: Path) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """ Method for reading a cache entry, ignoring missing or unreadable files """
+        try:
+            with path.open('rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable reflection cache {path}. {e}")
+            return None
+
+    @staticmethod
+    def _dump(path: Path, entry: typing.Dict[str, typing.Any]) -> None:
+        """ Method for writing a cache entry atomically """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f'.{os.getpid()}.tmp')
+        with temporary.open('wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        temporary.replace(path)
+
+class LazyClasses(util.Properties):
+    """Collection of automapped classes that reflects and maps each table on first access.
+
+    Accessing ``Base.classes.<name>`` reflects the table, the tables it references and the tables
+    referencing it through foreign keys, then maps them with an incremental ``prepare``, so the
+    relationships are created on both sides. The foreign keys of the schema are read once, on the
+    first access.
+    """
+
+    def __init__(self, base: typing.Any, engine: sqlalchemy.engine.Engine, only: typing.Optional[typing.Iterable[str]] = None):
+        super().__init__({})
+        object.__setattr__(self, '_base', base)
+        object.__setattr__(self, '_engine', engine)
+        object.__setattr__(self, '_only', None if only is None else frozenset(only))
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, '_referencing', None)
+
+    def __getattr__(self, key: str) -> typing.Any:
+        if key.startswith('_'):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key not in self._data:
+            self._load(key)
+        return self._data[key]
+
+    def _load(self, name: str) -> None:
+        """ Reflect and map a table and its foreign key neighbours """
+        if self._only is not None and name not in self._only:
+            raise KeyError(name)
+
+        with self._lock:
+            if name in self._data:
+                return
+            tables = [name] + [table for table in self._referencing_tables(name) if self._only is None or table in self._only]
+            try:
+                self._base.prepare(autoload_with=self._engine, reflection_options=dict(only=tables))
+            except sqlalchemy.exc.InvalidRequestError:
+                raise KeyError(name)
+            logger.debug(f"Reflected table {name} on first access.")
+
+        if name not in self._data:
+            raise KeyError(name)
+
+    def _referencing_tables(self, name: str) -> typing.List[str]:
+        """ The tables with a foreign key to a table, from the foreign keys of the schema read on first use """
+        if self._referencing is None:
+            referencing: typing.Dict[str, typing.Set[str]] = {}
+            foreign_keys = sqlalchemy.inspect(self._engine).get_multi_foreign_keys()
+            for (_, table), keys in foreign_keys.items():
+                for key in keys:
+                    if key['referred_table'] != table:
+                        referencing.setdefault(key['referred_table'], set()).add(table)
+            object.__setattr__(self, '_referencing', referencing)
+        return sorted(self._referencing.get(name, ()))
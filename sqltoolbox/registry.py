@@ -0,0 +1,165 @@
+""" Engine registry module
+
+Shares SQLAlchemy engines (and their connection pools) between database objects
+"""
+import typing
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import sqlalchemy
+
+__all__ = [
+    'EngineRegistry',
+    'RegistryStats',
+]
+
+logger = logging.getLogger('database')
+
+EngineKey = typing.Tuple[str, str]
+
+@dataclass
+class RegistryStats:
+    """Counters for an engine registry.
+
+    Attributes:
+        hits (int): Number of lookups served by a cached engine.
+        misses (int): Number of lookups that created a new engine.
+        evictions (int): Number of engines disposed to honor the size limit.
+        size (int): Number of live engines in the registry.
+    """
+    hits:       int = 0
+    misses:     int = 0
+    evictions:  int = 0
+    size:       int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of lookups served from the registry."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+@dataclass
+class EngineRegistry:
+    """Registry of engines keyed by rendered connection string and engine arguments.
+
+    Engines are kept in least recently used order. When the number of live engines
+    exceeds ``max_engines`` the least recently used one without checked out connections
+    is removed and disposed. If every engine has connections in use the registry stays
+    above its limit until the next lookup.
+
+    Database objects keep the engine they got from the registry. An evicted engine still
+    works for them: disposing it closes the idle pooled connections only, and it opens new
+    ones on the next checkout. It is no longer shared though, the next lookup of its
+    connection string creates a new engine with its own pool.
+
+    Attributes:
+        max_engines (Optional[int], optional): Maximum number of live engines. Defaults to 128. None means no limit.
+    """
+    max_engines:    typing.Optional[int] = 128
+    _engines:       'OrderedDict[EngineKey, sqlalchemy.engine.Engine]' = field(default_factory=OrderedDict, init=False, repr=False)
+    _stats:         RegistryStats = field(default_factory=RegistryStats, init=False, repr=False)
+    _lock:          threading.RLock = field(default_factory=threading.RLock, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.max_engines is not None and self.max_engines < 1:
+            raise ValueError(f"max_engines must be a positive integer or None, got {self.max_engines}")
+
+    @property
+    def stats(self) -> RegistryStats:
+        """Snapshot of the registry counters."""
+        with self._lock:
+            return RegistryStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                size=len(self._engines),
+            )
+
+    @staticmethod
+    def make_key(connection_string: str, engine_args: typing.Mapping[str, typing.Any]) -> EngineKey:
+        """Build the registry key for a connection string and its engine arguments.
+
+        Args:
+            connection_string (str): The rendered connection string.
+            engine_args (Mapping[str, Any]): Arguments passed to the engine creation.
+
+        Returns:
+            Tuple[str, str]: A hashable key.
+        """
+        return connection_string, repr(sorted(engine_args.items(), key=lambda item: item[0]))
+
+    def get(self, connection_string: str, engine_args: typing.Mapping[str, typing.Any],
+            factory: typing.Callable[[], sqlalchemy.engine.Engine]) -> sqlalchemy.engine.Engine:
+        """Method for getting the engine for the given connection string, creating it if needed.
+
+        Args:
+            connection_string (str): The rendered connection string.
+            engine_args (Mapping[str, Any]): Arguments passed to the engine creation.
+            factory (Callable[[], Engine]): Callable creating the engine on a miss.
+
+        Returns:
+            Engine: A SQLAlchemy engine object
+        """
+        key = self.make_key(connection_string, engine_args)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+                self._stats.hits += 1
+                return engine
+
+            self._stats.misses += 1
+            engine = factory()
+            self._engines[key] = engine
+            self._evict()
+            return engine
+
+    def dispose(self, connection_string: typing.Optional[str] = None) -> None:
+        """Method for removing and disposing engines.
+
+        Args:
+            connection_string (Optional[str], optional): If given, only the engines for this connection string are disposed. Defaults to None.
+        """
+        with self._lock:
+            keys = [key for key in self._engines if connection_string is None or key[0] == connection_string]
+            for key in keys:
+                _dispose_engine(self._engines.pop(key))
+
+    def reset_stats(self) -> None:
+        """Method for resetting the hit, miss and eviction counters."""
+        with self._lock:
+            self._stats = RegistryStats()
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def __contains__(self, connection_string: object) -> bool:
+        return any(key[0] == connection_string for key in self._engines)
+
+    def _evict(self) -> None:
+        """ Method for disposing the least recently used engines above the size limit """
+        if self.max_engines is None:
+            return
+
+        while len(self._engines) > self.max_engines:
+            # The most recent engine is the one just created
+            candidates = list(self._engines.items())[:-1]
+            key = next((key for key, engine in candidates if not _checked_out(engine)), None)
+            if key is None:
+                logger.debug(f"Every engine of the registry has connections in use. Keeping {len(self._engines)} engines.")
+                return
+            engine = self._engines.pop(key)
+            self._stats.evictions += 1
+            logger.debug(f"Evicting engine {engine.url.render_as_string(hide_password=True)} from registry.")
+            _dispose_engine(engine)
+
+def _checked_out(engine: typing.Any) -> int:
+    """ Number of connections in use of the pool of an engine. Async engines are read through their sync engine. """
+    checkedout = getattr(getattr(engine, 'sync_engine', engine).pool, 'checkedout', None)
+    return checkedout() if checkedout else 0
+
+def _dispose_engine(engine: typing.Any) -> None:
+    """ Dispose the pool of an engine. Async engines are disposed through their sync engine. """
+    getattr(engine, 'sync_engine', engine).dispose()
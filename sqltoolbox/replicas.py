@@ -0,0 +1,241 @@
+""" Module for routing the reads of the sessions to read replicas
+
+Pure SELECT statements executed outside a write transaction go to a healthy replica.
+Flushes, writes and anything that is not a plain SELECT go to the primary.
+
+The read-your-writes window is scoped to the session that wrote: its commit time is kept in
+``session.info``, so the reads of the other sessions keep going to the replicas. The health
+and lag probes run in a background thread, the reads only look at the last result.
+"""
+import math
+import time
+import typing
+import logging
+import itertools
+import threading
+from dataclasses import dataclass, field
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+__all__ = [
+    'ReplicaRouter',
+    'RoutingSession',
+    'replica_lag',
+]
+
+logger = logging.getLogger('database')
+
+STRATEGIES = ('round_robin', 'least_connections')
+
+# Queries returning the replication lag in seconds, by dialect name
+LAG_QUERIES: typing.Dict[str, typing.List[str]] = {
+    'mysql': ["SHOW REPLICA STATUS", "SHOW SLAVE STATUS"],
+    'postgresql': ["SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) AS lag"],
+}
+LAG_QUERIES['mariadb'] = LAG_QUERIES['mysql']
+
+LAG_COLUMNS = ('Seconds_Behind_Source', 'Seconds_Behind_Master', 'lag')
+# Session.info key of the time of the last committed write of the session
+WRITE_KEY = 'sqltoolbox_last_write'
+
+def replica_lag(connection: sqlalchemy.engine.Connection) -> typing.Optional[float]:
+    """Function returning the replication lag of a replica in seconds.
+
+    Args:
+        connection (Connection): A SQLAlchemy connection to the replica.
+
+    Returns:
+        Optional[float]: The lag in seconds, 0 for dialects without replication status, infinity if replication is stopped.
+            None if the lag is unknown, e.g. managed read endpoints without a SHOW REPLICA STATUS row.
+    """
+    queries = LAG_QUERIES.get(connection.dialect.name)
+    if queries is None:
+        return 0.0
+
+    for query in queries:
+        try:
+            row = connection.exec_driver_sql(query).mappings().first()
+        except sqlalchemy.exc.ProgrammingError:
+            # SHOW REPLICA STATUS needs MySQL 8.0.22, fall back to the older syntax
+            connection.rollback()
+            continue
+
+        if row is None:
+            return None
+        for column in LAG_COLUMNS:
+            if column in row:
+                if row[column] is not None:
+                    return float(row[column])
+                # A NULL Seconds_Behind_Source means the replication threads are stopped. PostgreSQL
+                # has no replay timestamp before the first replayed transaction
+                return None if column == 'lag' else math.inf
+    return None
+
+@dataclass
+class ReplicaRouter:
+    """Router choosing the engine of each statement between a primary and its replicas.
+
+    Attributes:
+        primary (Engine): The engine of the primary.
+        replicas (List[Engine]): The engines of the replicas.
+        strategy (str, optional): 'round_robin' or 'least_connections'. Defaults to 'round_robin'.
+        sticky_seconds (float, optional): The reads of a session go to the primary for this long after it committed a write, so it reads its own writes. Defaults to 0.
+        max_lag_seconds (Optional[float], optional): Replicas lagging more are ejected until they catch up. Defaults to None, only failing or stopped replicas are ejected.
+        health_check_interval (Optional[float], optional): Minimum seconds between two health checks, started in the background by the reads. Defaults to 30. None disables them, check_health can still be called.
+        lag_function (Callable[[Connection], Optional[float]], optional): Function returning the lag of a replica, None if unknown. Defaults to replica_lag.
+    """
+    primary:                sqlalchemy.engine.Engine
+    replicas:               typing.List[sqlalchemy.engine.Engine]
+    strategy:               str = 'round_robin'
+    sticky_seconds:         float = 0.0
+    max_lag_seconds:        typing.Optional[float] = None
+    health_check_interval:  typing.Optional[float] = 30.0
+    lag_function:           typing.Callable[[sqlalchemy.engine.Connection], typing.Optional[float]] = replica_lag
+    _healthy:               typing.List[sqlalchemy.engine.Engine] = field(init=False, repr=False)
+    _last_check:            float = field(default=float('-inf'), init=False, repr=False)
+    _lock:                  threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _schedule_lock:         threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy {self.strategy!r}. Expected one of {STRATEGIES}")
+        self._healthy = list(self.replicas)
+        self._counter = itertools.count()
+
+    @property
+    def healthy_replicas(self) -> typing.List[sqlalchemy.engine.Engine]:
+        """The replicas currently receiving reads."""
+        return list(self._healthy)
+
+    def is_sticky(self, info: typing.Optional[typing.Mapping[str, typing.Any]]) -> bool:
+        """Method returning True while the reads of a session must go to the primary after its write.
+
+        Args:
+            info (Optional[Mapping[str, Any]]): The info dictionary of the session, e.g. session.info.
+        """
+        last_write = info.get(WRITE_KEY) if info is not None else None
+        return last_write is not None and time.monotonic() - last_write < self.sticky_seconds
+
+    def record_write(self, info: typing.MutableMapping[str, typing.Any]) -> None:
+        """Method for starting the read-your-writes window of a session after a committed write.
+
+        Args:
+            info (MutableMapping[str, Any]): The info dictionary of the session, e.g. session.info.
+        """
+        info[WRITE_KEY] = time.monotonic()
+
+    def engine_for_read(self, info: typing.Optional[typing.Mapping[str, typing.Any]] = None) -> sqlalchemy.engine.Engine:
+        """Method returning the engine for a read, the primary if no replica is available.
+
+        Args:
+            info (Optional[Mapping[str, Any]], optional): The info dictionary of the reading session. Defaults to None, no read-your-writes window.
+
+        Returns:
+            Engine: A SQLAlchemy engine object
+        """
+        if self.health_check_interval is not None and time.monotonic() - self._last_check >= self.health_check_interval:
+            self._check_in_background()
+
+        if self.is_sticky(info):
+            return self.primary
+
+        replicas = self._healthy
+        if not replicas:
+            return self.primary
+
+        if self.strategy == 'least_connections':
+            return min(replicas, key=_checked_out)
+        return replicas[next(self._counter) % len(replicas)]
+
+    def check_health(self) -> typing.Dict[str, bool]:
+        """Method for ejecting the replicas that fail or lag too much and restoring the ones that caught up.
+
+        Returns:
+            Dict[str, bool]: The health of each replica, keyed by URL without password.
+        """
+        if not self._lock.acquire(blocking=False):
+            # Another thread is already checking
+            return {_name(engine): engine in self._healthy for engine in self.replicas}
+
+        try:
+            self._last_check = time.monotonic()
+            health = {}
+            healthy = []
+            for engine in self.replicas:
+                health[_name(engine)] = ok = self._is_healthy(engine)
+                if ok:
+                    healthy.append(engine)
+                elif engine in self._healthy:
+                    logger.warning(f"Ejecting replica {_name(engine)} from the read pool.")
+            self._healthy = healthy
+            return health
+        finally:
+            self._lock.release()
+
+    def _check_in_background(self) -> None:
+        """ Method starting a health check in a daemon thread, unless one was started within the interval """
+        with self._schedule_lock:
+            if time.monotonic() - self._last_check < self.health_check_interval:
+                return
+            self._last_check = time.monotonic()
+        threading.Thread(target=self.check_health, name='replica-health-check', daemon=True).start()
+
+    def _is_healthy(self, engine: sqlalchemy.engine.Engine) -> bool:
+        """ Method checking that a replica answers and its lag is below max_lag_seconds. An unknown lag is healthy """
+        try:
+            with engine.connect() as connection:
+                lag = self.lag_function(connection)
+        except Exception as e:
+            logger.warning(f"Health check failed for replica {_name(engine)}. {e}")
+            return False
+        if lag is None:
+            return True
+        return lag != math.inf and (self.max_lag_seconds is None or lag <= self.max_lag_seconds)
+
+def _checked_out(engine: sqlalchemy.engine.Engine) -> int:
+    """ Number of connections in use of the pool of an engine """
+    checkedout = getattr(engine.pool, 'checkedout', None)
+    return checkedout() if checkedout else 0
+
+def _name(engine: sqlalchemy.engine.Engine) -> str:
+    return engine.url.render_as_string(hide_password=True)
+
+def _is_read(clause: typing.Any) -> bool:
+    """ True for plain SELECT statements, without FOR UPDATE """
+    return isinstance(clause, sqlalchemy.Select) and clause._for_update_arg is None
+
+class RoutingSession(Session):
+    """Session sending the reads to the replicas of a router and everything else to the primary.
+
+    A transaction reads from a single replica. Once it flushes or writes, it keeps using the primary until it ends.
+    """
+
+    def __init__(self, router: ReplicaRouter, **kwargs: typing.Any):
+        super().__init__(**kwargs)
+        self.router = router
+        self._writing = False
+        self._read_engine: typing.Optional[sqlalchemy.engine.Engine] = None
+        event.listen(self, 'after_commit', self._after_commit)
+        event.listen(self, 'after_transaction_end', self._after_transaction_end)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._writing or self._flushing or not _is_read(clause):
+            self._writing = True
+            return self.router.primary
+
+        if self._read_engine is None:
+            self._read_engine = self.router.engine_for_read(self.info)
+        return self._read_engine
+
+    @staticmethod
+    def _after_commit(session: 'RoutingSession') -> None:
+        if session._writing:
+            session.router.record_write(session.info)
+
+    @staticmethod
+    def _after_transaction_end(session: 'RoutingSession', transaction: typing.Any) -> None:
+        if transaction.parent is None:
+            session._writing = False
+            session._read_engine = None
@@ -0,0 +1,289 @@
+""" Module for running a statement against many databases concurrently
+
+The statement is sent to every database by a bounded thread pool and the results are yielded
+as they arrive, so the caller can process the fast databases while the slow ones are still
+running. Each database has its own timeout, counted from the moment its worker starts: a
+database over its timeout is reported as timed out and stops holding its worker.
+
+  * The timeout is enforced by the server before the statement runs, with ``statement_timeout``
+    on PostgreSQL, ``max_execution_time`` on MySQL (SELECT only) and ``max_statement_time`` on MariaDB.
+  * The driver is interrupted too when it supports it (sqlite3 ``interrupt``, psycopg ``cancel``).
+  * A database still connecting when it times out closes its connection without running the statement.
+
+Example:
+    statement = select(Role.name, func.count(User.id)).join(User.role).group_by(Role.name)
+    report = gather(database, statement, starts_with='database', timeout=5)
+    counts = sum_by(report.results)
+"""
+import time
+import heapq
+import typing
+import logging
+import threading
+import contextlib
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+
+import sqlalchemy
+
+__all__ = [
+    'ScatterReport',
+    'TenantResult',
+    'concat',
+    'gather',
+    'scatter',
+    'sum_by',
+    'top_k',
+]
+
+logger = logging.getLogger('database')
+
+@dataclass
+class TenantResult:
+    """Outcome of the statement on a single database.
+
+    Attributes:
+        name (str): The name of the database.
+        rows (List[Row]): The rows returned by the statement, empty on error.
+        seconds (float, optional): Wall time of the query. Defaults to 0.
+        error (Optional[str], optional): The error raised by the query, if any. Defaults to None.
+        timed_out (bool, optional): True if the query exceeded the timeout. Defaults to False.
+    """
+    name:       str
+    rows:       typing.List[sqlalchemy.Row] = field(default_factory=list)
+    seconds:    float = 0.0
+    error:      typing.Optional[str] = None
+    timed_out:  bool = False
+
+    @property
+    def ok(self) -> bool:
+        """True if the query succeeded in time."""
+        return self.error is None
+
+@dataclass
+class ScatterReport:
+    """Results of a statement on several databases, in completion order.
+
+    Attributes:
+        results (List[TenantResult]): One result per database.
+        seconds (float, optional): Wall time of the whole run. Defaults to 0.
+    """
+    results:    typing.List[TenantResult] = field(default_factory=list)
+    seconds:    float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if every database answered in time."""
+        return all(result.ok for result in self.results)
+
+    @property
+    def succeeded(self) -> typing.List[TenantResult]:
+        """The results of the databases which answered in time."""
+        return [result for result in self.results if result.ok]
+
+    @property
+    def errors(self) -> typing.Dict[str, str]:
+        """The errors of the failed and timed out databases, by database name."""
+        return {result.name: result.error for result in self.results if result.error is not None}
+
+def _interrupt(connection: typing.Optional[sqlalchemy.engine.Connection]) -> None:
+    """ Best effort cancellation of the query running on a connection, from another thread """
+    try:
+        driver_connection = connection.connection.driver_connection
+    except Exception:
+        return
+    for method in ('interrupt', 'cancel'):
+        if hasattr(driver_connection, method):
+            try:
+                getattr(driver_connection, method)()
+            except Exception as e:
+                logger.debug(f"Could not interrupt the query. {e}")
+            return
+
+@contextlib.contextmanager
+def _server_timeout(connection: sqlalchemy.engine.Connection, seconds: float) -> typing.Iterator[None]:
+    """ Limit the execution time of the statements of the connection on the server side, for the drivers
+    which can not be interrupted from another thread, e.g. pymysql """
+    dialect = connection.dialect.name
+    milliseconds = max(1, int(seconds * 1000))
+    if dialect == 'postgresql':
+        # Scoped to the transaction begun by the statement, the pooled connection keeps its settings
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {milliseconds}")
+        yield
+        return
+    if dialect not in ('mysql', 'mariadb'):
+        yield
+        return
+
+    if getattr(connection.dialect, 'is_mariadb', False):
+        variable, value = 'max_statement_time', f"{milliseconds / 1000:.3f}"
+    else:
+        variable, value = 'max_execution_time', str(milliseconds)
+    connection.exec_driver_sql(f"SET SESSION {variable} = {value}")
+    try:
+        yield
+    finally:
+        try:
+            connection.exec_driver_sql(f"SET SESSION {variable} = DEFAULT")
+        except Exception as e:
+            logger.debug(f"Could not reset {variable}, discarding the connection. {e}")
+            connection.invalidate()
+
+def scatter(database: typing.Any, statement: sqlalchemy.Executable, names: typing.Optional[typing.Iterable[str]] = None,
+            starts_with: typing.Optional[str] = None, parameters: typing.Optional[typing.Dict[str, typing.Any]] = None,
+            max_workers: int = 8, timeout: typing.Optional[float] = None) -> typing.Iterator[TenantResult]:
+    """Function running a statement against many databases concurrently, yielding the results as they arrive.
+
+    The queries run on Core connections and return rows, e.g. aggregates. Closing the generator
+    early cancels the queries not started yet.
+
+    Args:
+        database (Any): A database object. Its generate_engine builds the engine of each database.
+        statement (Executable): The statement, e.g. select(Role.name, func.count(User.id)).join(User.role).group_by(Role.name).
+        names (Optional[Iterable[str]], optional): The databases to query. Defaults to None, database.get_database_names(starts_with).
+        starts_with (Optional[str], optional): Prefix of the databases to query when names is not given. Defaults to None.
+        parameters (Optional[Dict[str, Any]], optional): The bound parameters of the statement. Defaults to None.
+        max_workers (int, optional): Maximum number of queries, and connections open, at the same time. Defaults to 8.
+        timeout (Optional[float], optional): Seconds each database has to connect and answer once its worker starts. Defaults to None, no timeout.
+
+    Yields:
+        TenantResult: The result of each database, in completion order.
+    """
+    names = list(names) if names is not None else database.get_database_names(starts_with=starts_with)
+    started: typing.Dict[str, float] = {}
+    connections: typing.Dict[str, sqlalchemy.engine.Connection] = {}
+    timed_out: typing.Set[str] = set()
+    lock = threading.Lock()
+
+    def run(name: str) -> TenantResult:
+        result = TenantResult(name)
+        with lock:
+            started[name] = time.monotonic()
+        engine = None
+        try:
+            engine = database.generate_engine(name)
+            with engine.connect() as connection:
+                with lock:
+                    if name in timed_out:
+                        # Timed out while connecting, the result was already reported
+                        return result
+                    connections[name] = connection
+                if timeout is None:
+                    result.rows = connection.execute(statement, parameters).all()
+                else:
+                    with _server_timeout(connection, timeout - (time.monotonic() - started[name])):
+                        result.rows = connection.execute(statement, parameters).all()
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        finally:
+            with lock:
+                connections.pop(name, None)
+            if engine is not None and database.registry is None:
+                engine.dispose()
+        result.seconds = time.monotonic() - started[name]
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scatter')
+    futures: typing.Dict[Future, str] = {executor.submit(run, name): name for name in names}
+    pending = set(futures)
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                with lock:
+                    deadlines = [started[futures[future]] + timeout for future in pending if futures[future] in started]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                result = future.result()
+                if result.error is not None:
+                    logger.error(f"Query of database {result.name} failed. {result.error}")
+                yield result
+
+            if timeout is None:
+                continue
+            now = time.monotonic()
+            for future in list(pending):
+                name = futures[future]
+                with lock:
+                    start, connection = started.get(name), connections.get(name)
+                    expired = start is not None and now - start >= timeout
+                    if expired:
+                        timed_out.add(name)
+                if expired:
+                    pending.discard(future)
+                    _interrupt(connection)
+                    logger.warning(f"Query of database {name} timed out after {timeout}s.")
+                    yield TenantResult(name, seconds=now - start, error=f"Timed out after {timeout}s", timed_out=True)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def gather(database: typing.Any, statement: sqlalchemy.Executable, names: typing.Optional[typing.Iterable[str]] = None,
+           starts_with: typing.Optional[str] = None, parameters: typing.Optional[typing.Dict[str, typing.Any]] = None,
+           max_workers: int = 8, timeout: typing.Optional[float] = None) -> ScatterReport:
+    """Function collecting the results of scatter. The arguments are those of scatter.
+
+    Returns:
+        ScatterReport: The results of every database, in completion order.
+    """
+    start = time.perf_counter()
+    results = list(scatter(database, statement, names=names, starts_with=starts_with, parameters=parameters,
+                           max_workers=max_workers, timeout=timeout))
+    report = ScatterReport(results, time.perf_counter() - start)
+    logger.info(f"Queried {len(results)} databases in {report.seconds:.3f}s, {len(report.errors)} failed or timed out.")
+    return report
+
+# Merge helpers. They take the results of scatter or gather and skip the failed databases
+def concat(results: typing.Iterable[TenantResult], with_name: bool = True) -> typing.List[typing.Tuple[typing.Any, ...]]:
+    """Function concatenating the rows of the databases.
+
+    Args:
+        results (Iterable[TenantResult]): The results.
+        with_name (bool, optional): If True, each row is prefixed by the name of its database. Defaults to True.
+
+    Returns:
+        List[Tuple[Any, ...]]: The rows.
+    """
+    return [(result.name, *row) if with_name else tuple(row) for result in results if result.ok for row in result.rows]
+
+def sum_by(results: typing.Iterable[TenantResult], keys: int = 1) -> typing.Dict[typing.Any, typing.Any]:
+    """Function summing the rows of the databases grouped by their leading columns, e.g. counts per role.
+
+    Args:
+        results (Iterable[TenantResult]): The results, with rows made of keys grouping columns followed by numbers.
+        keys (int, optional): Number of leading grouping columns. 0 sums every row under the key (). Defaults to 1.
+
+    Returns:
+        Dict[Any, Any]: The sums by key, the key being a value with one grouping column or a tuple with several.
+            The sum is a number with one numeric column, or a tuple with several.
+    """
+    totals: typing.Dict[typing.Any, typing.List[typing.Any]] = {}
+    for result in results:
+        if not result.ok:
+            continue
+        for row in result.rows:
+            group = row[0] if keys == 1 else tuple(row[:keys])
+            values = row[keys:]
+            current = totals.get(group)
+            totals[group] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+    return {group: values[0] if len(values) == 1 else tuple(values) for group, values in totals.items()}
+
+def top_k(results: typing.Iterable[TenantResult], k: int, key: typing.Callable[[typing.Tuple[typing.Any, ...]], typing.Any],
+          largest: bool = True, with_name: bool = True) -> typing.List[typing.Tuple[typing.Any, ...]]:
+    """Function selecting the k best rows across the databases.
+
+    Each database should already return its own top k, e.g. with ORDER BY and LIMIT.
+
+    Args:
+        results (Iterable[TenantResult]): The results.
+        k (int): Number of rows to keep.
+        key (Callable[[Tuple[Any, ...]], Any]): The sort key of a row, as returned by concat.
+        largest (bool, optional): If False, keep the k smallest rows. Defaults to True.
+        with_name (bool, optional): If True, each row is prefixed by the name of its database. Defaults to True.
+
+    Returns:
+        List[Tuple[Any, ...]]: The k rows, best first.
+    """
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return select(k, concat(results, with_name=with_name), key=key)
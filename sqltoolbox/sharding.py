@@ -0,0 +1,306 @@
+""" Module with the horizontally sharded database class
+
+Built on SQLAlchemy's horizontal sharding extension. Each sharded model declares the attribute
+holding its shard key, e.g. ``{User: 'id', Address: 'user_id'}``, and the key value is mapped
+to a shard with a stable hash. Rows sharing a key value, e.g. a user and its addresses, are
+co-located on the same shard.
+
+  * Inserts go to the shard of the key value, or to the shard of the parent instance through
+    a many-to-one relationship when the key column is not set yet.
+  * Primary key lookups, e.g. ``session.get(User, 5)``, and selects filtering the key with ``==``
+    or ``IN`` in their top level AND conditions query only the matching shards.
+  * Other selects fan out to every shard in parallel, one thread and session per shard, and the
+    results are merged in the calling session with their shard as identity token.
+  * Models without a shard key, e.g. Role, live on the default shard. Joins and foreign keys
+    from sharded models to them need a copy of their table on every shard.
+
+The key must be known before the flush: sharded tables cannot rely on per shard autoincrement.
+"""
+import zlib
+import typing
+import logging
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import DeclarativeBase, Mapper, ORMExecuteState, Session, sessionmaker, loading
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy.sql import operators
+from sqlalchemy.ext.horizontal_shard import ShardedSession, set_shard_id
+
+__all__ = [
+    'ParallelShardedSession',
+    'ShardedDatabase',
+    'hash_shard',
+    'stable_hash',
+]
+
+logger = logging.getLogger('database')
+
+def stable_hash(value: typing.Any) -> int:
+    """Function hashing a shard key value, stable across processes unlike hash()."""
+    return zlib.crc32(repr(value).encode())
+
+def hash_shard(shard_ids: typing.Sequence[str]) -> typing.Callable[[typing.Any], str]:
+    """Function returning the default shard function, mapping a key value to a shard by its stable hash.
+
+    Args:
+        shard_ids (Sequence[str]): The shard identifiers. Their order must not change once rows are written.
+
+    Returns:
+        Callable[[Any], str]: The shard function.
+    """
+    shard_ids = list(shard_ids)
+    return lambda value: shard_ids[stable_hash(value) % len(shard_ids)]
+
+class ParallelShardedSession(ShardedSession):
+    """Sharded session querying the shards of a select concurrently.
+
+    Args:
+        executor (Optional[ThreadPoolExecutor]): The pool running the queries. Defaults to None, the shards are queried sequentially.
+        shard_factories (Dict[str, sessionmaker]): A session factory per shard, used by the pool threads.
+        **kwargs (Any): The arguments of ShardedSession.
+    """
+
+    def __init__(self, executor: typing.Optional[ThreadPoolExecutor] = None,
+                 shard_factories: typing.Optional[typing.Dict[str, sessionmaker]] = None, **kwargs: typing.Any):
+        super().__init__(**kwargs)
+        self.executor = executor
+        self.shard_factories = shard_factories or {}
+        if executor is not None:
+            # Inserted before the listener of ShardedSession, which queries the shards one after the other
+            event.listen(self, 'do_orm_execute', self._execute_in_parallel, insert=True)
+            event.listen(self, 'after_flush', self._after_flush)
+            event.listen(self, 'after_transaction_end', self._after_transaction_end)
+
+    def _parallel_shards(self, state: ORMExecuteState) -> typing.Optional[typing.List[str]]:
+        """ The shards of a select to query concurrently, None if it must go through ShardedSession """
+        if not state.is_select or state.is_relationship_load or state.is_column_load:
+            return None
+        if self.info.get('sqltoolbox_flushed'):
+            # The pool sessions would not see the uncommitted writes of this session
+            return None
+        options = state.execution_options
+        if 'yield_per' in options or '_sa_shard_id' in options or 'shard_id' in state.bind_arguments:
+            return None
+        if state.load_options._identity_token is not None:
+            return None
+        if any(isinstance(option, set_shard_id) for option in state._non_compile_orm_options):
+            return None
+        shard_ids = list(self.execute_chooser(state))
+        return shard_ids if len(shard_ids) > 1 else None
+
+    def _execute_in_parallel(self, state: ORMExecuteState) -> typing.Optional[sqlalchemy.engine.Result]:
+        shard_ids = self._parallel_shards(state)
+        if shard_ids is None:
+            return None
+
+        statement, parameters = state.statement, state.parameters
+        options = dict(state.local_execution_options)
+
+        def query(shard_id: str) -> typing.Any:
+            with self.shard_factories[shard_id]() as session:
+                return session.execute(statement, parameters, execution_options={**options, 'identity_token': shard_id}).freeze()
+
+        frozen_results = list(self.executor.map(query, shard_ids))
+        results = [loading.merge_frozen_result(self, statement, frozen, load=False)() for frozen in frozen_results]
+        return results[0].merge(*results[1:])
+
+    @staticmethod
+    def _after_flush(session: Session, flush_context: typing.Any) -> None:
+        session.info['sqltoolbox_flushed'] = True
+
+    @staticmethod
+    def _after_transaction_end(session: Session, transaction: typing.Any) -> None:
+        if transaction.parent is None:
+            session.info.pop('sqltoolbox_flushed', None)
+
+@dataclass(kw_only=True)
+class ShardedDatabase:
+    """Database class spreading the rows of the sharded models across several databases.
+
+    Attributes:
+        shards (Dict[str, Engine]): The engine of each shard, e.g. from get_engines_from_list.
+        Base (DeclarativeBase): The declarative base of the models.
+        shard_keys (Dict[Any, str]): The attribute holding the shard key of each sharded model, e.g. {User: 'id', Address: 'user_id'}.
+        shard_for (Optional[Callable[[Any], str]], optional): Maps a key value to a shard identifier. Defaults to None, hash_shard of the shards.
+        default_shard (Optional[str], optional): The shard of the models without shard key. Defaults to None, the first shard.
+        parallel (bool, optional): If True, selects spanning several shards query them concurrently. Defaults to True.
+        max_workers (Optional[int], optional): Maximum number of shards queried at the same time. Defaults to None, every shard.
+        create_tables (bool, optional): If True, the tables are created on every shard when the object is instantiated. Defaults to False.
+    """
+    shards:         typing.Dict[str, sqlalchemy.engine.Engine]
+    Base:           DeclarativeBase
+    shard_keys:     typing.Dict[typing.Any, str] = field(default_factory=dict)
+    shard_for:      typing.Optional[typing.Callable[[typing.Any], str]] = None
+    default_shard:  typing.Optional[str] = None
+    parallel:       bool = True
+    max_workers:    typing.Optional[int] = None
+    create_tables:  bool = False
+
+    def __post_init__(self) -> None:
+        if not self.shards:
+            raise ValueError("A sharded database needs at least one shard")
+        self.default_shard = self.default_shard if self.default_shard is not None else next(iter(self.shards))
+        if self.default_shard not in self.shards:
+            raise ValueError(f"Unknown default shard {self.default_shard!r}. Expected one of {list(self.shards)}")
+        self.shard_for = self.shard_for if self.shard_for is not None else hash_shard(list(self.shards))
+
+        self._executor = None
+        if self.parallel and len(self.shards) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers or len(self.shards), thread_name_prefix='shard')
+        self._session_factory = sessionmaker(
+            class_=ParallelShardedSession,
+            shards=self.shards,
+            shard_chooser=self._shard_chooser,
+            identity_chooser=self._identity_chooser,
+            execute_chooser=self._execute_chooser,
+            executor=self._executor,
+            shard_factories={shard_id: sessionmaker(bind=engine) for shard_id, engine in self.shards.items()},
+        )
+
+        if self.create_tables:
+            logger.warning(f"Creating tables for shards {list(self.shards)}. This may create conflicts with alembic.")
+            for engine in self.shards.values():
+                self.base.metadata.create_all(engine)
+
+    @classmethod
+    def from_database(cls, database: typing.Any, names: typing.List[str], **kwargs: typing.Any) -> 'ShardedDatabase':
+        """Method for creating a sharded database whose shards are databases of the server of a database object.
+
+        Args:
+            database (Any): A database object. Its get_engines_from_list builds the engines and its base is used by default.
+            names (List[str]): The names of the shard databases, which are also the shard identifiers.
+            **kwargs (Any): The other attributes of the sharded database, e.g. shard_keys.
+
+        Returns:
+            ShardedDatabase: The sharded database.
+        """
+        kwargs.setdefault('Base', database.base)
+        return cls(shards=database.get_engines_from_list(names), **kwargs)
+
+    @property
+    def base(self) -> DeclarativeBase:
+        """Property for the base associated to the object. Only read access is allowed."""
+        return self.Base
+
+    @property
+    def session(self) -> ParallelShardedSession:
+        """Property for a sharded session object that generates a new session for each call.
+
+        Only read access is allowed and it must be used with a context manager.
+        """
+        return self._session_factory()
+
+    @property
+    def autocommit_session(self) -> ParallelShardedSession:
+        """Property for a sharded session that automatically commits the transaction when the context manager exits."""
+        return self._session_factory.begin()
+
+    def shard_of(self, model: typing.Any, value: typing.Any) -> str:
+        """Method returning the shard of a key value for a model, the default shard if the model is not sharded.
+
+        Args:
+            model (Any): The mapped class, e.g. User.
+            value (Any): The shard key value, e.g. the user id.
+
+        Returns:
+            str: The shard identifier.
+        """
+        return self.shard_for(value) if self._key_attribute(sqlalchemy.inspect(model)) else self.default_shard
+
+    def close(self) -> None:
+        """Method for stopping the threads querying the shards. The engines are left open."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _key_attribute(self, mapper: Mapper) -> typing.Optional[str]:
+        """ The shard key attribute of a mapper or of its nearest sharded superclass """
+        for parent in mapper.iterate_to_root():
+            if parent.class_ in self.shard_keys:
+                return self.shard_keys[parent.class_]
+        return None
+
+    def _key_column(self, mapper: Mapper) -> typing.Optional[sqlalchemy.Column]:
+        attribute = self._key_attribute(mapper)
+        return mapper.attrs[attribute].columns[0] if attribute else None
+
+    def _shard_chooser(self, mapper: typing.Optional[Mapper], instance: typing.Any = None, clause: typing.Any = None) -> str:
+        """ The shard an instance is written to """
+        if mapper is None or instance is None:
+            return self.default_shard
+        attribute = self._key_attribute(mapper)
+        if attribute is None:
+            return self.default_shard
+
+        state = sqlalchemy.inspect(instance)
+        if state.identity_token is not None:
+            return state.identity_token
+        value = getattr(instance, attribute)
+        if value is not None:
+            return self.shard_for(value)
+
+        # The key is copied from the parent on flush, e.g. Address.user_id from the User: use the shard of the parent
+        column = self._key_column(mapper)
+        for relationship in mapper.relationships:
+            if relationship.direction is MANYTOONE and column in relationship.local_columns:
+                parent = getattr(instance, relationship.key)
+                parent = parent[0] if isinstance(parent, list) and parent else parent
+                if parent:
+                    return self._shard_chooser(sqlalchemy.inspect(parent).mapper, parent)
+        raise ValueError(f"The shard key {mapper.class_.__name__}.{attribute} must be set before the flush")
+
+    def _identity_chooser(self, mapper: Mapper, primary_key: typing.Sequence[typing.Any], *,
+                          lazy_loaded_from: typing.Any = None, **kwargs: typing.Any) -> typing.List[str]:
+        """ The shards to search for a primary key """
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token is not None:
+            return [lazy_loaded_from.identity_token]
+        column = self._key_column(mapper)
+        if column is None:
+            return [self.default_shard]
+        for index, primary_column in enumerate(mapper.primary_key):
+            if primary_column is column:
+                return [self.shard_for(primary_key[index])]
+        return list(self.shards)
+
+    def _execute_chooser(self, state: ORMExecuteState) -> typing.List[str]:
+        """ The shards to query for a statement: the ones of the key values it filters, all of them otherwise """
+        if state.lazy_loaded_from is not None and state.lazy_loaded_from.identity_token is not None:
+            return [state.lazy_loaded_from.identity_token]
+
+        columns = [column for column in map(self._key_column, state.all_mappers) if column is not None]
+        if not columns:
+            return [self.default_shard]
+
+        parameters = state.parameters if isinstance(state.parameters, dict) else {}
+        values = self._key_values(getattr(state.statement, 'whereclause', None), columns, parameters)
+        if values is None:
+            return list(self.shards)
+        return sorted({self.shard_for(value) for value in values}, key=list(self.shards).index)
+
+    @staticmethod
+    def _key_values(clause: typing.Any, columns: typing.List[sqlalchemy.Column],
+                    parameters: typing.Mapping[str, typing.Any]) -> typing.Optional[typing.List[typing.Any]]:
+        """ The key values compared with == or IN in the top level AND conditions, None if there are none """
+        if clause is None:
+            return None
+        conditions = list(clause.clauses) if getattr(clause, 'operator', None) is operators.and_ else [clause]
+        for condition in conditions:
+            if not isinstance(condition, sqlalchemy.BinaryExpression) or not isinstance(condition.right, sqlalchemy.BindParameter):
+                continue
+            if not any(column.shares_lineage(condition.left) for column in columns if isinstance(condition.left, sqlalchemy.ColumnElement)):
+                continue
+            bind = condition.right
+            if bind.value is None and bind.callable is None:
+                # Bound at execute time, e.g. bindparam('user_id'): the value is in the execute parameters
+                if bind.key not in parameters:
+                    return None
+                value = parameters[bind.key]
+            else:
+                value = bind.effective_value
+            if condition.operator is operators.eq:
+                return [value]
+            if condition.operator is operators.in_op:
+                return list(value)
+        return None
@@ -0,0 +1,54 @@
+""" Module with the streaming read helpers of the database classes
+
+Results are fetched in batches through server-side cursors where the driver has them
+(``stream_results``/``yield_per``), so memory stays constant whatever the size of the result.
+"""
+import typing
+import logging
+
+import sqlalchemy
+
+__all__ = [
+    'StreamingMixin',
+]
+
+logger = logging.getLogger('database')
+
+class StreamingMixin:
+    """Mixin for reading large results in batches of constant size"""
+
+    def stream(self, statement: sqlalchemy.Executable, batch_size: int = 1000, orm: bool = True,
+               scalars: bool = False) -> typing.Iterator[typing.Sequence[typing.Any]]:
+        """Method for iterating over the result of a statement in batches.
+
+        With orm=True the statement runs in a session with yield_per. The identity map only holds
+        weak references, so each batch is released once the caller drops it. With orm=False the
+        statement runs on a Core connection and rows are returned without building ORM entities.
+        The connection is held until the generator is exhausted or closed.
+
+        Args:
+            statement (Executable): The statement to execute, e.g. a select.
+            batch_size (int, optional): Number of rows fetched and yielded at once. Defaults to 1000.
+            orm (bool, optional): If False, skip ORM entity construction. Defaults to True.
+            scalars (bool, optional): If True, yield the first column of each row, e.g. the entity of select(User). Defaults to False.
+
+        Yields:
+            Sequence[Any]: A batch of at most batch_size rows.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be a positive integer, got {batch_size}")
+
+        if orm:
+            yield from self._stream_orm(statement, batch_size, scalars)
+            return
+
+        with self.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(statement)
+            yield from (result.scalars() if scalars else result).partitions()
+
+    def _stream_orm(self, statement: sqlalchemy.Executable, batch_size: int,
+                    scalars: bool) -> typing.Iterator[typing.Sequence[typing.Any]]:
+        """ Method for streaming an ORM result within a session """
+        with self.session as session:
+            result = session.execute(statement, execution_options=dict(yield_per=batch_size))
+            yield from (result.scalars() if scalars else result).partitions()
@@ -0,0 +1,70 @@
+import shutil
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.migrations import upgrade_to_head
+from sqltoolbox.models.base import Base
+from sqltoolbox.models import User, Role, Address
+from sqltoolbox.advisor import WorkloadRecorder, index_name, suggest_indexes, write_revision
+
+SCRIPT_DIRECTORY = Path(__file__).parents[1] / 'single-alembic'
+
+@pytest.fixture
+def declarative_lite_db_connection( tmp_path: Path ):
+    """Generate a lite database connection without tables."""
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "advisor.db"),
+        Base    = Base,
+    )
+
+# Tests
+def test_suggest_and_write_revision(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that scanned filtered and joined columns are suggested and the revision creates the indexes."""
+    database = declarative_lite_db_connection
+    script_location = tmp_path / "alembic"
+    shutil.copytree(SCRIPT_DIRECTORY, script_location)
+    # The tables of the database come from the initial revision
+    with database.engine.begin() as connection:
+        upgrade_to_head(connection, str(script_location))
+    with database.autocommit_session as session:
+        session.add(Role(id=1, name="admin"))
+        session.add_all(User(id=index, name=f"user{index}", fullname=f"User {index}", password="secret", role_id=1,
+                             addresses=[Address(address=f"street {index}")]) for index in range(1, 6))
+
+    recorder = WorkloadRecorder()
+    with recorder.recording(database.engine), database.session as session:
+        for user in session.scalars(sqlalchemy.select(User)):
+            user.addresses
+        session.scalars(sqlalchemy.select(User).where(User.name == "user3")).all()
+        session.scalars(sqlalchemy.select(User).join(User.role).where(Role.name == "admin")).all()
+        session.get(User, 2)
+
+    suggestions = suggest_indexes(database.engine, recorder.shapes)
+    assert [(suggestion.name, suggestion.executions) for suggestion in suggestions] == [
+        ("ix_addresses_user_id", 5), ("ix_users_name", 1), ("ix_users_role_id", 1),
+    ]
+
+    path = write_revision(suggestions, str(script_location))
+    assert "op.create_index(op.f('ix_addresses_user_id'), 'addresses', ['user_id'], unique=False)" in Path(path).read_text()
+
+    with database.engine.begin() as connection:
+        upgrade_to_head(connection, str(script_location))
+    # The plans use the new indexes, the join now scans roles instead of users
+    remaining = suggest_indexes(database.engine, recorder.shapes)
+    assert [suggestion.name for suggestion in remaining] == ["ix_roles_name"]
+
+def test_suggest_indexes_unsupported_dialect():
+    """Test that a dialect without plan support is refused before explaining any shape."""
+    engine = sqlalchemy.create_mock_engine("mssql://", executor=None)
+    with pytest.raises(ValueError, match="mssql"):
+        suggest_indexes(engine, [])
+
+def test_index_name():
+    """Test that index names follow the naming convention of the models."""
+    assert index_name("users", ["role_id"]) == "ix_users_role_id"
+    assert index_name("users", ["name"], sqlalchemy.MetaData()) == "ix_users_name"
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from sqltoolbox.async_database import AsyncDeclarativeLiteDatabase, AsyncAutoMappedLiteDatabase
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+@pytest.fixture
+def base():
+    return Base
+
+@pytest.fixture
+def async_declarative_lite_db_connection( base: typing.Any, tmp_path: Path ):
+    """Generate an async lite database connection with declarative Base."""
+    return AsyncDeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "aiosqlite",
+        name    = str(tmp_path / "async.db"),
+        Base    = base,
+        create_tables=True,
+    )
+
+# Tests
+def test_async_engine_type(async_declarative_lite_db_connection: AsyncDeclarativeLiteDatabase):
+    """Test that the engine is a SQLAlchemy async engine."""
+    assert isinstance(async_declarative_lite_db_connection.engine, AsyncEngine)
+    assert async_declarative_lite_db_connection.engine.url.render_as_string() == async_declarative_lite_db_connection.connection_string
+
+def test_async_session_roundtrip(async_declarative_lite_db_connection: AsyncDeclarativeLiteDatabase):
+    """Test that tables are created on prepare and async sessions can write and read."""
+
+    async def roundtrip():
+        async with async_declarative_lite_db_connection as database:
+            async with database.autocommit_session as session:
+                await session.execute(sqlalchemy.delete(Item))
+                session.add(Item(name="async"))
+
+            async with database.session as session:
+                return (await session.scalars(sqlalchemy.select(Item.name))).all()
+
+    assert asyncio.run(roundtrip()) == ["async"]
+
+def test_async_automapped_table_names(async_declarative_lite_db_connection: AsyncDeclarativeLiteDatabase, tmp_path: Path):
+    """Test that the async automapped base reflects the schema on prepare."""
+    automapped = AsyncAutoMappedLiteDatabase(dialect="sqlite", driver="aiosqlite", name=str(tmp_path / "async.db"))
+
+    async def reflect():
+        async with async_declarative_lite_db_connection:
+            pass
+        async with automapped as database:
+            return list(database.get_table_names())
+
+    assert "items" in asyncio.run(reflect())
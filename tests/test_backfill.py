@@ -0,0 +1,98 @@
+import pytest
+import datetime
+from pathlib import Path
+
+import sqlalchemy
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+
+from sqltoolbox.backfill import PROGRESS_TABLE, backfill, drop_progress
+
+@pytest.fixture
+def engine(tmp_path: Path):
+    """Generate a sqlite engine with 25 users without status."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(50), status VARCHAR(20))"))
+        connection.execute(sqlalchemy.text("INSERT INTO users (id, name) VALUES (:id, :name)"),
+                           [{"id": i, "name": f"user{i}"} for i in range(1, 26)])
+    yield engine
+    engine.dispose()
+
+def statuses(engine: sqlalchemy.engine.Engine):
+    with engine.connect() as connection:
+        return dict(connection.execute(sqlalchemy.text("SELECT id, status FROM users")).all())
+
+# Tests
+def test_backfill_chunks(engine: sqlalchemy.engine.Engine):
+    """Test that rows are updated in chunks and the progress is recorded."""
+    result = backfill(engine, 'users', values={'status': 'active'}, batch_size=10)
+
+    assert (result.rows, result.chunks, result.completed) == (25, 3, True)
+    assert set(statuses(engine).values()) == {'active'}
+    with engine.connect() as connection:
+        progress = connection.execute(sqlalchemy.text(f"SELECT last_key, rows, completed FROM {PROGRESS_TABLE}")).one()
+    assert tuple(progress) == ('[25]', 25, True)
+
+    # A completed backfill is skipped, until its progress is dropped, e.g. by a downgrade
+    assert backfill(engine, 'users', values={'status': 'other'}, batch_size=10).chunks == 0
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={'transactional_ddl': True})
+        with context.begin_transaction(), Operations.context(context) as op:
+            assert drop_progress(op.get_bind(), 'users')
+    assert not drop_progress(engine, 'users')
+    assert backfill(engine, 'users', values={'status': 'other'}, batch_size=10).chunks == 3
+    assert set(statuses(engine).values()) == {'other'}
+
+def test_backfill_resume(engine: sqlalchemy.engine.Engine):
+    """Test that an interrupted backfill resumes after the last committed chunk."""
+    calls = []
+
+    def transform(rows):
+        calls.append(len(calls))
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+        return [{'id': row.id, 'status': row.name.upper()} for row in rows]
+
+    with pytest.raises(RuntimeError):
+        backfill(engine, 'users', transform=transform, batch_size=10)
+    assert sum(status is not None for status in statuses(engine).values()) == 10
+
+    result = backfill(engine, 'users', transform=transform, batch_size=10)
+    assert result.resumed_from == (10,)
+    assert (result.rows, result.chunks) == (15, 2)
+    assert statuses(engine)[25] == 'USER25'
+
+def test_backfill_in_revision(engine: sqlalchemy.engine.Engine):
+    """Test the backfill inside an alembic autocommit block, and refused inside the migration transaction."""
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={'transactional_ddl': True})
+        with context.begin_transaction(), Operations.context(context) as op:
+            with pytest.raises(RuntimeError):
+                backfill(op.get_bind(), 'users', values={'status': 'active'})
+            with context.autocommit_block():
+                backfill(op.get_bind(), 'users', values={'status': 'active'},
+                         where=lambda users: users.c.id > 20, batch_size=2)
+
+    assert sorted(id for id, status in statuses(engine).items() if status) == [21, 22, 23, 24, 25]
+
+def test_backfill_resume_typed_key(engine: sqlalchemy.engine.Engine):
+    """Test that an interrupted backfill on a datetime key resumes with a datetime, not its string."""
+    events = sqlalchemy.Table("events", sqlalchemy.MetaData(),
+                              sqlalchemy.Column("created_at", sqlalchemy.DateTime, primary_key=True),
+                              sqlalchemy.Column("status", sqlalchemy.String(20)))
+    start = datetime.datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        events.create(connection)
+        connection.execute(sqlalchemy.insert(events), [{"created_at": start + datetime.timedelta(hours=i)} for i in range(5)])
+
+    def transform(rows):
+        if len(rows) < 4:
+            raise RuntimeError("interrupted")
+        return [{"created_at": row.created_at, "status": "seen"} for row in rows]
+
+    with pytest.raises(RuntimeError):
+        backfill(engine, events, transform=transform, batch_size=4)
+    result = backfill(engine, events, transform=lambda rows: [{"created_at": row.created_at, "status": "seen"} for row in rows], batch_size=4)
+    assert result.resumed_from == (start + datetime.timedelta(hours=3),)
+    assert result.rows == 1
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import sqlalchemy
+
+from benchmarks import cases
+from benchmarks.harness import BENCHMARKS, run, compare
+
+# Tests
+def test_alembic_upgrade_case(tmp_path: Path):
+    """Test that the migration benchmark upgrades every database to head."""
+    timed = cases.alembic_upgrade(tmp_path, databases=2)
+
+    assert timed() == 2
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db1.db'}")
+    assert {"users", "roles", "addresses", "alembic_version"} <= set(sqlalchemy.inspect(engine).get_table_names())
+    engine.dispose()
+
+def test_run_and_compare():
+    """Test that results are keyed by parameters and slower medians are flagged."""
+    assert "orm_insert" in BENCHMARKS and "core_insert" in BENCHMARKS
+    current = run(["generate_engine"], repeat=2, quick=True)
+    key = "generate_engine[names=10]"
+    assert set(current["results"]) == {key}
+
+    median = current["results"][key]["median"]
+    faster = {"results": {key: {"median": median / 2}}}
+    slower = {"results": {key: {"median": median * 2}}}
+    assert compare(current, faster, threshold=0.2)[0].regression
+    assert not compare(current, slower, threshold=0.2)[0].regression
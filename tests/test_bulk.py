@@ -0,0 +1,58 @@
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+@pytest.fixture
+def base():
+    return Base
+
+@pytest.fixture
+def declarative_lite_db_connection( base: typing.Any, tmp_path: Path ):
+    """Generate a lite database connection with declarative Base."""
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "bulk.db"),
+        Base    = base,
+        create_tables=True,
+    )
+
+def item_names(database: DeclarativeLiteDatabase) -> typing.Dict[int, str]:
+    with database.engine.connect() as connection:
+        return dict(connection.execute(sqlalchemy.text("SELECT id, name FROM items")).all())
+
+# Tests
+def test_bulk_insert(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that rows are inserted in chunks."""
+    result = declarative_lite_db_connection.bulk_insert(Item, ({"id": i, "name": f"item{i}"} for i in range(25)), chunk_size=10)
+
+    assert (result.rows, result.chunks) == (25, 3)
+    assert len(item_names(declarative_lite_db_connection)) == 25
+
+def test_bulk_upsert(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that conflicting rows are updated and new rows inserted."""
+    table = declarative_lite_db_connection.base.metadata.tables["items"]
+    declarative_lite_db_connection.bulk_insert(table, [{"id": 1, "name": "old"}])
+
+    result = declarative_lite_db_connection.bulk_upsert(table, [{"id": 1, "name": "new"}, {"id": 2, "name": "other"}], conflict_cols=["id"])
+
+    assert result.rows == 2
+    assert item_names(declarative_lite_db_connection) == {1: "new", 2: "other"}
+
+def test_bulk_invalid_chunk_size(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that the chunk size must be positive."""
+    with pytest.raises(ValueError):
+        declarative_lite_db_connection.bulk_insert(declarative_lite_db_connection.base.metadata.tables["items"], [{"id": 1}], chunk_size=0)
@@ -0,0 +1,155 @@
+import time
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, ForeignKey, select, update
+from sqlalchemy.orm import declarative_base, relationship, joinedload, selectinload
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.caching import MemoryBackend
+from sqltoolbox.backfill import backfill
+
+Base = declarative_base()
+
+class Role(Base):
+    __tablename__ = "roles"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=False)
+
+class User(Base):
+    __tablename__ = "users"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=False)
+    role_id = Column(ForeignKey("roles.id", ondelete="CASCADE"))
+
+class Post(Base):
+    __tablename__ = "posts"
+    id      = Column(Integer, primary_key=True)
+    user_id = Column(ForeignKey("users.id"))
+
+Role.users = relationship(User)
+User.posts = relationship(Post)
+
+@pytest.fixture
+def database(tmp_path: Path):
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "cache.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+    with database.autocommit_session as session:
+        session.add_all([Role(id=1, name="admin"), User(id=1, name="alice", role_id=1)])
+    database.enable_result_cache()
+    return database
+
+def role_name(database, role_id: int = 1) -> str:
+    with database.session as session:
+        return session.scalars(select(Role).where(Role.id == role_id)).one().name
+
+# Tests
+def test_hits_and_parameters(database: DeclarativeLiteDatabase):
+    """Test that identical selects are served from the cache and parameters are part of the key."""
+    database.enable_instrumentation(slow_query_seconds=None)
+    assert role_name(database) == "admin"
+    assert role_name(database) == "admin"
+    with database.session as session:
+        assert session.scalars(select(Role).where(Role.id == 2)).first() is None
+
+    stats = database.result_cache.stats
+    assert (stats.hits, stats.misses) == (1, 2)
+    assert stats.hit_rate == pytest.approx(1 / 3)
+    selects = [entry for entry in database.get_query_stats()["statements"] if entry["statement"].startswith("SELECT")]
+    assert sum(entry["count"] for entry in selects) == 2
+    database.disable_instrumentation()
+
+def test_streamed_and_refreshed_selects_bypass(database: DeclarativeLiteDatabase):
+    """Test that yield_per, stream_results and populate_existing selects are never cached."""
+    statement = select(Role).where(Role.id == 1)
+    for options in ({"yield_per": 10}, {"stream_results": True}, {"populate_existing": True}):
+        for _ in range(2):
+            with database.session as session:
+                assert session.scalars(statement, execution_options=options).one().name == "admin"
+    assert (database.result_cache.stats.hits, database.result_cache.stats.misses) == (0, 0)
+
+    with database.session as session:
+        role = session.get(Role, 1)
+        session.execute(sqlalchemy.text("UPDATE roles SET name = 'root'"))
+        refreshed = session.scalars(statement.execution_options(populate_existing=True)).one()
+        assert refreshed is role and role.name == "root"
+
+def test_invalidation_on_commit(database: DeclarativeLiteDatabase):
+    """Test that committed flushes and ORM updates evict the entries of the written tables."""
+    role_name(database)
+    with database.autocommit_session as session:
+        session.get(Role, 1).name = "root"
+        session.flush()
+        # Pending writes are read from the database within the transaction
+        assert session.scalars(select(Role.name)).one() == "root"
+    assert role_name(database) == "root"
+
+    with database.autocommit_session as session:
+        session.execute(update(Role).where(Role.id == 1).values(name="owner"))
+    assert role_name(database) == "owner"
+
+def test_foreign_key_cascade_and_rollback(database: DeclarativeLiteDatabase):
+    """Test that writes invalidate cascading tables and rolled back writes invalidate nothing."""
+    with database.session as session:
+        session.scalars(select(User)).all()
+
+    with database.session as session:
+        session.get(Role, 1).name = "other"
+        session.flush()
+        session.rollback()
+    assert database.result_cache.stats.invalidations == 0
+
+    # The get of the role and, through ON DELETE CASCADE, the select of the users
+    assert database.result_cache.invalidate("roles") == 2
+
+def test_eager_loaded_tables(database: DeclarativeLiteDatabase):
+    """Test that writes to the tables of eager loaded relationships evict the entries."""
+    joined = select(User).options(joinedload(User.posts))
+    nested = select(Role).options(selectinload(Role.users).selectinload(User.posts))
+    with database.session as session:
+        assert session.scalars(joined).unique().one().posts == []
+        session.scalars(nested).all()
+
+    with database.autocommit_session as session:
+        session.add(Post(id=1, user_id=1))
+    with database.session as session:
+        assert [post.id for post in session.scalars(joined).unique().one().posts] == [1]
+        assert [post.id for post in session.scalars(nested).one().users[0].posts] == [1]
+    assert database.result_cache.stats.hits == 0
+
+def test_bulk_writes_invalidate(database: DeclarativeLiteDatabase):
+    """Test that the Core writes of the database class evict the entries of their table."""
+    def count() -> int:
+        with database.session as session:
+            return len(session.scalars(select(Role)).all())
+
+    assert count() == 1
+    database.bulk_insert(Role, [{"id": 2, "name": "guest"}])
+    assert count() == 2
+    database.bulk_upsert(Role, [{"id": 3, "name": "owner"}], conflict_cols=["id"])
+    assert count() == 3
+    database.load_rows(Role, [{"id": 4, "name": "viewer"}])
+    assert count() == 4
+
+    role_name(database)
+    backfill(database.engine, "roles", values={"name": "member"}, cache=database.result_cache)
+    assert role_name(database) == "member"
+
+def test_memory_backend_eviction():
+    """Test the LRU and TTL eviction of the memory backend."""
+    backend = MemoryBackend(max_entries=2, ttl=0.05)
+    backend.set("a", 1, ["t"])
+    backend.set("b", 2, ["t"])
+    backend.get("a")
+    backend.set("c", 3, ["u"])
+
+    assert backend.get("b") is None and backend.get("a") == 1
+    assert backend.evictions == 1
+    time.sleep(0.06)
+    assert backend.get("c") is None
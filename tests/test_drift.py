@@ -0,0 +1,85 @@
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.drift import check_drift
+from sqltoolbox.backfill import backfill
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+@pytest.fixture
+def database(tmp_path: Path):
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "main.db"),
+        Base    = Base,
+    )
+
+def create_database(path: Path, drift: bool = False) -> str:
+    """Create a database matching the metadata, or missing the name column."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        if drift:
+            connection.exec_driver_sql("CREATE TABLE items (id INTEGER NOT NULL PRIMARY KEY)")
+        else:
+            Base.metadata.create_all(connection)
+    engine.dispose()
+    return str(path)
+
+# Tests
+def test_groups_and_shared_comparisons(database: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that identical schemas are compared once and databases are grouped by diffs."""
+    in_sync = [create_database(tmp_path / f"tenant{index}.db") for index in range(4)]
+    drifted = [create_database(tmp_path / f"drifted{index}.db", drift=True) for index in range(2)]
+
+    report = check_drift(database, names=in_sync + drifted, max_workers=3)
+
+    assert not report.ok
+    assert report.comparisons == 2
+    groups = report.groups
+    assert sorted(groups[()]) == sorted(in_sync)
+    assert [(diffs, sorted(names)) for diffs, names in groups.items() if diffs] == \
+        [(("add_column items items.name",), sorted(drifted))]
+    assert report.format()[-1].startswith("6 databases, 2 drifted, 0 failed, 2 comparisons")
+
+def test_index_drift_is_not_shared(database: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a database differing only by an index gets its own comparison."""
+    in_sync = create_database(tmp_path / "tenant.db")
+    indexed = create_database(tmp_path / "indexed.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{indexed}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX ix_items_name ON items (name)")
+    engine.dispose()
+
+    report = check_drift(database, names=[in_sync, indexed], max_workers=1)
+
+    assert report.comparisons == 2
+    assert report.groups == {(): [in_sync], ("remove_index ix_items_name(name)",): [indexed]}
+
+def test_backfill_progress_table_is_ignored(database: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that the progress table of a backfill is not reported as drift."""
+    name = create_database(tmp_path / "tenant.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{name}")
+    backfill(engine, "items", values={"name": "item"})
+    engine.dispose()
+
+    assert check_drift(database, names=[name]).ok
+
+def test_failures_are_reported(database: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a database that can not be opened is reported without stopping the others."""
+    names = [create_database(tmp_path / "ok.db"), str(tmp_path / "missing" / "no.db")]
+
+    report = check_drift(database, names=names)
+
+    assert list(report.groups) == [()]
+    assert list(report.errors) == [names[1]]
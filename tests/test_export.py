@@ -0,0 +1,81 @@
+import csv
+import uuid
+import pytest
+import decimal
+import datetime
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, JSON, Uuid, Interval, Numeric
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+class Event(Base):
+    __tablename__ = "events"
+    id      = Column(Integer, primary_key=True)
+    payload = Column(JSON)
+    key     = Column(Uuid)
+    elapsed = Column(Interval)
+    amount  = Column(Numeric(50, 10))
+
+@pytest.fixture
+def declarative_lite_db_connection( tmp_path: Path ):
+    """Generate a lite database connection with 25 items."""
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "export.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+    database.bulk_insert(Item, ({"id": i, "name": f"item{i}"} for i in range(25)))
+    return database
+
+# Tests
+def test_export_parquet(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a table is exported in batches with the model column types."""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    result = declarative_lite_db_connection.export(Item, tmp_path / "items.parquet", batch_size=10)
+    table = parquet.read_table(result.path)
+
+    assert (result.rows, result.batches) == (25, 3)
+    assert str(table.schema.field("id").type) == "int64"
+    assert str(table.schema.field("name").type) == "string"
+    assert table.column("name").to_pylist()[-1] == "item24"
+
+def test_export_parquet_types(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that JSON and UUID values are exported as strings and wide decimals as decimal256."""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    key = uuid.uuid4()
+    declarative_lite_db_connection.bulk_insert(Event, [
+        {"id": 1, "payload": {"tags": ["a"]}, "key": key, "elapsed": datetime.timedelta(seconds=90), "amount": decimal.Decimal("12.5")},
+        {"id": 2, "payload": None, "key": None, "elapsed": None, "amount": None},
+    ])
+    table = parquet.read_table(declarative_lite_db_connection.export(Event, tmp_path / "events.parquet").path)
+
+    assert str(table.schema.field("amount").type) == "decimal256(50, 10)"
+    assert table.to_pylist()[0] == {
+        "id": 1, "payload": '{"tags": ["a"]}', "key": str(key), "elapsed": datetime.timedelta(seconds=90), "amount": decimal.Decimal("12.5"),
+    }
+    assert table.to_pylist()[1]["payload"] is None
+
+def test_export_csv_select(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a select is exported to CSV with a header."""
+    result = declarative_lite_db_connection.export(sqlalchemy.select(Item.name).where(Item.id < 3), tmp_path / "items.csv")
+
+    with result.path.open(newline="") as file:
+        assert list(csv.reader(file)) == [["name"], ["item0"], ["item1"], ["item2"]]
+
+def test_export_unknown_format(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that the format must be known."""
+    with pytest.raises(ValueError):
+        declarative_lite_db_connection.export(Item, tmp_path / "items.xlsx")
@@ -0,0 +1,52 @@
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1].resolve()
+
+# Wall time allowed for `import sqltoolbox.factory` in a fresh interpreter. SQLAlchemy itself takes most of it.
+IMPORT_TIME_BUDGET = 1.5
+
+PROBE = """
+import sys, json, time, logging
+start = time.perf_counter()
+import sqltoolbox.factory
+seconds = time.perf_counter() - start
+print(json.dumps(dict(
+    seconds=seconds,
+    models=sorted(name for name in sys.modules if name.startswith('sqltoolbox.models.') and name != 'sqltoolbox.models.base'),
+    async_loaded='sqlalchemy.ext.asyncio' in sys.modules,
+    handlers=len(logging.getLogger('database').handlers),
+)))
+"""
+
+def probe(cwd: Path) -> dict:
+    """Import the factory in a fresh interpreter and return what it loaded."""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=cwd, env={"PYTHONPATH": str(ROOT)},
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)
+
+# Tests
+def test_factory_import_is_lazy(tmp_path: Path):
+    """Test that importing the factory needs no .env file and neither configures logging nor registers the models."""
+    result = probe(tmp_path)
+
+    assert result["models"] == []
+    assert result["handlers"] == 0
+    assert not result["async_loaded"]
+
+def test_factory_import_time_budget(tmp_path: Path):
+    """Test that the factory imports within the budget, best of three runs."""
+    seconds = min(probe(tmp_path)["seconds"] for _ in range(3))
+
+    assert seconds < IMPORT_TIME_BUDGET, f"import sqltoolbox.factory took {seconds:.3f}s"
+
+def test_lazy_attributes():
+    """Test that Base and the models are still importable from the factory."""
+    from sqltoolbox.factory import Base, User
+
+    assert Base.metadata.tables["users"] is User.__table__
+    assert {"users", "roles", "addresses"} <= set(Base.metadata.tables)
@@ -0,0 +1,67 @@
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.inspection import NameIndex
+
+Base = declarative_base()
+
+class Role(Base):
+    __tablename__ = "roles"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=False)
+
+class User(Base):
+    __tablename__ = "users"
+    id      = Column(Integer, primary_key=True)
+    role_id = Column(ForeignKey("roles.id"))
+
+@pytest.fixture
+def database(tmp_path: Path):
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "inspect.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+
+def count_catalog_queries(engine: sqlalchemy.engine.Engine) -> list:
+    statements = []
+    sqlalchemy.event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+# Tests
+def test_name_index():
+    """Test the prefix and suffix queries of the name index."""
+    index = NameIndex(["database_b_test", "database_a", "other_test", "data", "database_c_test"])
+
+    assert index.starting_with("database_") == ["database_a", "database_b_test", "database_c_test"]
+    assert index.ending_with("_test") == ["database_b_test", "database_c_test", "other_test"]
+    assert index.filter("database", "test") == ["database_b_test", "database_c_test"]
+    assert index.filter("zzz") == []
+    assert len(index.filter()) == 5
+
+def test_database_names_cached(database: DeclarativeLiteDatabase):
+    """Test that the schema names are queried once until refreshed and the inspector is created lazily."""
+    statements = count_catalog_queries(database.engine)
+
+    assert database.get_database_names(starts_with="ma") == ["main"]
+    assert database.get_database_names(ends_with="in") == ["main"]
+    assert len(statements) == 1
+    database.get_database_names(refresh=True)
+    assert len(statements) == 2
+
+def test_columns_and_foreign_keys(database: DeclarativeLiteDatabase):
+    """Test that columns and foreign keys are memoized per schema."""
+    inspector = database.cached_inspector
+
+    assert [column["name"] for column in inspector.get_columns("roles")] == ["id", "name"]
+    assert inspector.get_foreign_keys("users")[0]["referred_table"] == "roles"
+    assert set(inspector.get_table_names()) == {"roles", "users"}
+    with pytest.raises(sqlalchemy.exc.NoSuchTableError):
+        inspector.get_columns("missing")
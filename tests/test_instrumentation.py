@@ -0,0 +1,71 @@
+import logging
+import pytest
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.instrumentation import QueryStats, normalize_statement
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+@pytest.fixture
+def database():
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = ":memory:",
+        Base    = Base,
+        create_tables=True,
+    )
+    yield database
+    database.disable_instrumentation()
+
+# Tests
+def test_normalize_statement():
+    """Test that statements differing only by their values share one key."""
+    assert normalize_statement("SELECT * FROM items WHERE id = 1 AND name = 'a'") == \
+        normalize_statement("SELECT *\n  FROM items WHERE id = 42 AND name = 'it''s'")
+    assert normalize_statement("SELECT * FROM items WHERE id IN (?, ?, ?)") == "SELECT * FROM items WHERE id IN (?)"
+    assert normalize_statement("INSERT INTO items (id) VALUES (1), (2), (3)") == "INSERT INTO items (id) VALUES (?)"
+    assert normalize_statement("SELECT * FROM items WHERE id = $1 AND name = $12") == "SELECT * FROM items WHERE id = ? AND name = ?"
+
+def test_statement_aggregation(database: DeclarativeLiteDatabase):
+    """Test that executions are aggregated per statement and the snapshot can reset them."""
+    database.enable_instrumentation(slow_query_seconds=None)
+    with database.engine.begin() as connection:
+        connection.execute(sqlalchemy.insert(Item), [{"name": "a"}, {"name": "b"}])
+        for id in range(1, 4):
+            connection.execute(sqlalchemy.select(Item).where(Item.id == id)).all()
+
+    snapshot = database.get_query_stats(reset=True)
+    by_statement = {entry["statement"]: entry for entry in snapshot["statements"]}
+    select = next(entry for key, entry in by_statement.items() if key.startswith("SELECT"))
+    insert = next(entry for key, entry in by_statement.items() if key.startswith("INSERT"))
+
+    assert select["count"] == 3
+    assert 0 <= select["p50_seconds"] <= select["p95_seconds"] <= select["p99_seconds"]
+    assert insert["rows"] == 2
+    assert select["rows"] == 0 and "p50_rows" not in select
+    assert database.get_query_stats()["statements"] == []
+
+def test_bounded_and_slow_log(caplog: pytest.LogCaptureFixture):
+    """Test that the least recent statements are evicted and slow executions are logged."""
+    stats = QueryStats(slow_query_seconds=0.5, max_statements=2, sample_size=3)
+    for table in ("a", "b", "c"):
+        stats.record(f"SELECT * FROM {table}", 0.1)
+    with caplog.at_level(logging.WARNING, logger="database"):
+        for _ in range(5):
+            stats.record("SELECT * FROM c", 1.0)
+
+    snapshot = stats.snapshot()
+    assert [entry["statement"] for entry in snapshot["statements"]] == ["SELECT * FROM c", "SELECT * FROM b"]
+    assert snapshot["statements"][0]["count"] == 6
+    assert snapshot["statements"][0]["p50_seconds"] == 1.0
+    assert sum("Slow query" in record.message for record in caplog.records) == 5
@@ -0,0 +1,138 @@
+import json
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String, Index
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase, AutoMappedLiteDatabase
+from sqltoolbox.lite import build_template, template_fingerprint
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+    code    = Column(String(20), nullable=True)
+
+    __table_args__ = (Index("ix_items_name", "name"), Index("ix_items_code", "code", unique=True))
+
+@pytest.fixture
+def declarative_lite_db_connection( tmp_path: Path ):
+    """Generate a lite database connection with an indexed table."""
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "lite.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+
+def scalar(database: DeclarativeLiteDatabase, sql: str):
+    with database.engine.connect() as connection:
+        return connection.exec_driver_sql(sql).scalar()
+
+# Tests
+def test_load_jsonl(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a JSON lines file is loaded and the settings and indexes are restored."""
+    path = tmp_path / "items.jsonl"
+    path.write_text("\n".join(json.dumps({"id": i, "name": f"item{i}"}) for i in range(100)))
+
+    result = declarative_lite_db_connection.load_jsonl(Item, path, chunk_size=30)
+
+    assert (result.rows, result.chunks) == (100, 4)
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM items") == 100
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_name'") == 1
+    assert scalar(declarative_lite_db_connection, "PRAGMA journal_mode") == "delete"
+
+def test_load_csv(declarative_lite_db_connection: DeclarativeLiteDatabase, tmp_path: Path):
+    """Test that a CSV file is loaded with empty fields as NULL."""
+    path = tmp_path / "items.csv"
+    path.write_text("id,name\n1,first\n2,\n")
+
+    declarative_lite_db_connection.load_csv(Item, path)
+
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM items WHERE name IS NULL") == 1
+
+def test_bulk_load_failure_restores_indexes(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that a failed load is rolled back and the indexes are rebuilt."""
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        declarative_lite_db_connection.load_rows(Item, [{"id": 1, "name": "a"}, {"id": 1, "name": "b"}])
+
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM items") == 0
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_name'") == 1
+
+def test_bulk_load_drops_indexes_in_its_transaction(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that the dropped indexes are not committed before the load, so other connections keep them."""
+    with pytest.raises(RuntimeError):
+        with declarative_lite_db_connection.bulk_load(Item) as connection:
+            assert connection.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_name'").scalar_one() == 0
+            assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_name'") == 1
+            raise RuntimeError("interrupted")
+
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_name'") == 1
+
+def test_bulk_load_keeps_unique_indexes(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that unique indexes are enforced during the load instead of failing their rebuild after the commit."""
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        declarative_lite_db_connection.load_rows(Item, [{"id": 1, "code": "a"}, {"id": 2, "code": "a"}])
+
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM items") == 0
+    assert scalar(declarative_lite_db_connection, "SELECT count(*) FROM sqlite_master WHERE name = 'ix_items_code'") == 1
+
+def test_profile_pragmas(tmp_path: Path):
+    """Test that the profile PRAGMAs are applied to pooled connections and explicit ones override them."""
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "profile.db"),
+        Base    = Base,
+        profile = "read_heavy",
+        pragmas = {"busy_timeout": 1234},
+    )
+
+    assert scalar(database, "PRAGMA journal_mode") == "wal"
+    assert scalar(database, "PRAGMA busy_timeout") == 1234
+    assert isinstance(database.engine.pool, sqlalchemy.pool.QueuePool)
+
+def test_memory_database_pool():
+    """Test that in-memory databases share a single connection between threads."""
+    database = DeclarativeLiteDatabase(dialect="sqlite", driver="pysqlite", name=":memory:", Base=Base, create_tables=True)
+
+    assert isinstance(database.engine.pool, sqlalchemy.pool.StaticPool)
+    assert scalar(database, "SELECT count(*) FROM items") == 0
+
+def test_unknown_profile():
+    """Test that the profile must be known."""
+    with pytest.raises(ValueError):
+        DeclarativeLiteDatabase(dialect="sqlite", driver="pysqlite", name=":memory:", Base=Base, profile="fast")
+
+def test_template_clones(tmp_path: Path):
+    """Test that a template is built once and cloned into isolated file and in-memory databases."""
+    seeded = lambda connection: connection.execute(sqlalchemy.insert(Item), [{"id": 1, "name": "seed"}])
+    template = build_template(tmp_path / "templates", metadata=Base.metadata, setup=seeded)
+    assert build_template(tmp_path / "templates", metadata=Base.metadata, setup=seeded) == template
+    # Another seed with the same qualified name gets its own template
+    other = lambda connection: connection.execute(sqlalchemy.insert(Item), [{"id": 1, "name": "other"}])
+    assert template_fingerprint(Base.metadata, setup=other) != template_fingerprint(Base.metadata, setup=seeded)
+
+    clones = [
+        DeclarativeLiteDatabase.from_template(template, name=str(tmp_path / "clone.db"), Base=Base),
+        DeclarativeLiteDatabase.from_template(template, Base=Base),
+        DeclarativeLiteDatabase.from_template(template, Base=Base),
+    ]
+    clones[1].bulk_insert(Item, [{"id": 2, "name": "memory"}])
+
+    assert [scalar(clone, "SELECT count(*) FROM items") for clone in clones] == [1, 2, 1]
+    assert scalar(clones[0], "SELECT name FROM sqlite_master WHERE name = 'ix_items_name'") == "ix_items_name"
+    with pytest.raises(FileExistsError):
+        DeclarativeLiteDatabase.from_template(template, name=str(tmp_path / "clone.db"), Base=Base)
+
+def test_template_from_migrations(tmp_path: Path):
+    """Test a template migrated with the alembic revisions."""
+    template = build_template(tmp_path, script_location=str(Path(__file__).parents[1] / "single-alembic"))
+    clone = AutoMappedLiteDatabase.from_template(template)
+    assert {"users", "roles", "addresses", "alembic_version"} <= set(clone.get_table_names())
@@ -0,0 +1,55 @@
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.models.base import Base
+from sqltoolbox.models import User, Role, Address
+from sqltoolbox.loading import NPlusOneError, loading_profile
+
+@pytest.fixture
+def declarative_lite_db_connection( tmp_path: Path ):
+    """Generate a lite database connection with 5 users of one address each."""
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "loading.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+    with database.autocommit_session as session:
+        session.add(Role(id=1, name="admin"))
+        for index in range(1, 6):
+            session.add(User(id=index, name=f"user{index}", fullname=f"User {index}", password="secret", role_id=1,
+                             addresses=[Address(address=f"street {index}")]))
+    return database
+
+# Tests
+def test_lazy_load_detection(declarative_lite_db_connection: DeclarativeLiteDatabase, caplog: pytest.LogCaptureFixture):
+    """Test that lazy loads past the threshold are reported with the relationship and raised on demand."""
+    detector = declarative_lite_db_connection.enable_lazy_load_detection(threshold=3)
+    with declarative_lite_db_connection.session as session:
+        for user in session.scalars(sqlalchemy.select(User)):
+            user.addresses
+
+    assert [(relationship, count) for (relationship, _), count in detector.offenders.items()] == [("User.addresses", 5)]
+    assert sum("N+1 queries: User.addresses" in record.message for record in caplog.records) == 1
+
+    declarative_lite_db_connection.enable_lazy_load_detection(threshold=3, raise_error=True)
+    with declarative_lite_db_connection.session as session:
+        with pytest.raises(NPlusOneError, match="User.addresses"):
+            for user in session.scalars(sqlalchemy.select(User)):
+                user.addresses
+
+def test_loading_profile(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that a loading profile removes the lazy loads."""
+    declarative_lite_db_connection.enable_lazy_load_detection(threshold=0, raise_error=True)
+    statement = sqlalchemy.select(User).options(*loading_profile("user_with_role_and_addresses"))
+    with declarative_lite_db_connection.session as session:
+        users = session.scalars(statement).unique().all()
+        assert [user.role.name for user in users] == ["admin"] * 5
+        assert [address.address for user in users for address in user.addresses] == [f"street {index}" for index in range(1, 6)]
+
+    with pytest.raises(KeyError):
+        loading_profile("missing")
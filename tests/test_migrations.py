@@ -0,0 +1,159 @@
+import json
+import argparse
+import textwrap
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+from alembic.config import Config
+
+from sqltoolbox.migrations import run_concurrent_migrations, render_offline_scripts, format_report
+
+ENV = '''
+import sqlalchemy
+from alembic import context
+from sqltoolbox import migrations
+
+worker = migrations.current_worker()
+directory = context.get_x_argument(as_dictionary=True)["dir"]
+engine = sqlalchemy.create_engine(f"sqlite:///{directory}/{worker.name}.db")
+
+with worker.connection_slot(), engine.connect() as connection:
+    context.configure(connection=connection, transactional_ddl=True)
+    with context.begin_transaction():
+        if worker.name == "broken":
+            raise RuntimeError("broken database")
+        context.run_migrations()
+        if not worker.vote():
+            raise migrations.TwoPhaseRollback()
+'''
+
+REVISION = '''
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.create_table("items", sa.Column("id", sa.Integer(), primary_key=True))
+
+def downgrade() -> None:
+    op.drop_table("items")
+'''
+
+@pytest.fixture
+def alembic_config(tmp_path: Path):
+    """Generate an alembic config whose env.py migrates the sqlite database of a worker."""
+    script_location = tmp_path / "alembic"
+    (script_location / "versions").mkdir(parents=True)
+    (script_location / "env.py").write_text(ENV)
+    (script_location / "script.py.mako").write_text("")
+    (script_location / "versions" / "0001_items.py").write_text(REVISION)
+
+    ini_file = tmp_path / "alembic.ini"
+    ini_file.write_text(textwrap.dedent(f"""
+        [alembic]
+        script_location = {script_location}
+    """))
+
+    config = Config(str(ini_file))
+    config.cmd_opts = argparse.Namespace(x=[f"dir={tmp_path}"])
+    return config
+
+def table_names(directory: Path, name: str):
+    return sqlalchemy.inspect(sqlalchemy.create_engine(f"sqlite:///{directory}/{name}.db")).get_table_names()
+
+def version_rows(directory: Path, name: str):
+    with sqlalchemy.create_engine(f"sqlite:///{directory}/{name}.db").connect() as connection:
+        return connection.execute(sqlalchemy.text("SELECT count(*) FROM alembic_version")).scalar()
+
+# Tests
+def test_concurrent_migrations(alembic_config: Config, tmp_path: Path):
+    """Test that every database is migrated and committed on its own."""
+    results = run_concurrent_migrations(alembic_config, ["db1", "db2", "broken"], max_workers=2, max_connections=1)
+
+    assert {result.name: result.status for result in results} == {"db1": "committed", "db2": "committed", "broken": "failed"}
+    assert "items" in table_names(tmp_path, "db1")
+    assert "broken database" in "\n".join(format_report(results))
+
+def test_concurrent_migrations_twophase(alembic_config: Config, tmp_path: Path):
+    """Test that a failed database rolls back every prepared database."""
+    results = run_concurrent_migrations(alembic_config, ["db1", "db2", "broken"], max_workers=3, twophase=True)
+
+    assert {result.name: result.status for result in results} == {"db1": "rolled back", "db2": "rolled back", "broken": "failed"}
+    assert version_rows(tmp_path, "db1") == 0
+
+def test_concurrent_migrations_twophase_requires_workers(alembic_config: Config):
+    """Test that two-phase commit needs one worker per database."""
+    with pytest.raises(ValueError):
+        run_concurrent_migrations(alembic_config, ["db1", "db2"], max_workers=1, twophase=True)
+
+OFFLINE_ENV = '''
+from alembic import context
+from sqltoolbox import migrations
+
+worker = migrations.current_worker()
+with open(worker.sql_output, "w") as buffer:
+    context.configure(
+        url=context.config.get_section_option(worker.name, "sqlalchemy.url"),
+        output_buffer=buffer,
+        literal_binds=True,
+        starting_rev=context.config.get_section_option(worker.name, migrations.STARTING_REV_OPTION),
+        version_table=context.config.get_section_option(worker.name, "version_table", "alembic_version"),
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+'''
+
+SECOND_REVISION = '''
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.add_column("items", sa.Column("name", sa.String(50)))
+
+def downgrade() -> None:
+    op.drop_column("items", "name")
+'''
+
+def test_render_offline_scripts(alembic_config: Config, tmp_path: Path):
+    """Test that every database is rendered and identical offline scripts are written once."""
+    script_location = Path(alembic_config.get_main_option("script_location"))
+    (script_location / "env.py").write_text(OFFLINE_ENV)
+    (script_location / "versions" / "0002_name.py").write_text(SECOND_REVISION)
+    ini_file = Path(alembic_config.config_file_name)
+    ini_file.write_text(ini_file.read_text() + textwrap.dedent("""
+        [db1]
+        sqlalchemy.url = sqlite:///db1.db
+        [db2]
+        sqlalchemy.url = sqlite:///db2.db
+        [db3]
+        sqlalchemy.url = sqlite:///db3.db
+        starting_rev = 0001
+        [db4]
+        sqlalchemy.url = postgresql://localhost/db4
+        [db5]
+        sqlalchemy.url = sqlite:///db5.db
+        version_table = tenant_version
+    """))
+    config = Config(str(ini_file))
+
+    manifest = render_offline_scripts(config, ["db1", "db2", "db3", "db4", "db5"], output_dir=tmp_path / "sql")
+
+    assert len(manifest["scripts"]) == 4
+    assert manifest["databases"]["db1"] == manifest["databases"]["db2"]
+    assert manifest["databases"]["db5"] != manifest["databases"]["db1"]
+    assert "tenant_version" in (tmp_path / "sql" / manifest["databases"]["db5"]).read_text()
+    assert json.loads((tmp_path / "sql" / "manifest.json").read_text()) == manifest
+    from_base = (tmp_path / "sql" / manifest["databases"]["db1"]).read_text()
+    from_0001 = (tmp_path / "sql" / manifest["databases"]["db3"]).read_text()
+    assert "CREATE TABLE items" in from_base and "CREATE TABLE items" not in from_0001
+    assert "ALTER TABLE items ADD COLUMN name" in from_0001
@@ -0,0 +1,87 @@
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.pagination import decode_cursor, encode_cursor, dump_key, load_key
+
+Base = declarative_base()
+
+class Person(Base):
+    __tablename__ = "persons"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=False)
+
+@pytest.fixture
+def declarative_lite_db_connection( tmp_path: Path ):
+    """Generate a lite database connection with 25 persons, named in 5 groups."""
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "pagination.db"),
+        Base    = Base,
+        create_tables=True,
+    )
+    database.bulk_insert(Person, ({"id": i, "name": f"name{i % 5}"} for i in range(1, 26)))
+    return database
+
+def walk(database: DeclarativeLiteDatabase, statement: sqlalchemy.Select, **kwargs: typing.Any) -> typing.List[typing.List[typing.Any]]:
+    pages, cursor = [], None
+    while True:
+        page = database.paginate(statement, cursor=cursor, **kwargs)
+        pages.append(page)
+        if not page.has_next:
+            return pages
+        cursor = page.next_cursor
+
+# Tests
+def test_paginate_forward_and_backward(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that pages follow the primary key, and previous cursors lead back to the same pages."""
+    statement = sqlalchemy.select(Person).order_by(Person.name)
+    pages = walk(declarative_lite_db_connection, statement, limit=10)
+
+    assert [[person.id for person in page] for page in pages] == [list(range(1, 11)), list(range(11, 21)), list(range(21, 26))]
+    assert not pages[0].has_previous and pages[-1].has_previous
+
+    previous = declarative_lite_db_connection.paginate(statement, limit=10, cursor=pages[-1].previous_cursor)
+    assert [person.id for person in previous] == list(range(11, 21))
+    first = declarative_lite_db_connection.paginate(statement, limit=10, cursor=previous.previous_cursor)
+    assert [person.id for person in first] == list(range(1, 11))
+    assert not first.has_previous and first.next_cursor == pages[0].next_cursor
+
+def test_paginate_composite_key(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test a composite key with a descending column on a Core select."""
+    statement = sqlalchemy.select(Person.name, Person.id).where(Person.id > 5)
+    pages = walk(declarative_lite_db_connection, statement, limit=7, key=[Person.name.desc(), Person.id])
+    rows = [tuple(row) for page in pages for row in page]
+
+    assert len(pages) == 3
+    assert rows == sorted(((f"name{i % 5}", i) for i in range(6, 26)), key=lambda row: (-int(row[0][-1]), row[1]))
+
+    # The bound on the leading column seeks the index instead of scanning it
+    database, plans = declarative_lite_db_connection, []
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX ix_persons_name_id ON persons (name, id)")
+
+    @sqlalchemy.event.listens_for(database.engine, "before_cursor_execute")
+    def explain(connection, cursor, statement, parameters, context, executemany):
+        plans.extend(row[-1] for row in cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall())
+
+    database.paginate(statement, limit=7, cursor=pages[0].next_cursor, key=[Person.name.desc(), Person.id])
+    assert any(plan.startswith("SEARCH persons USING") and "name<?" in plan for plan in plans)
+
+def test_cursor_roundtrip():
+    """Test that cursors are opaque and reject tampering."""
+    import datetime
+    values = (datetime.datetime(2024, 1, 2, 3, 4, 5), 'x', 3)
+    assert decode_cursor(encode_cursor(values, 'prev')) == ('prev', values)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+    import uuid, decimal
+    values = (datetime.date(2024, 1, 2), decimal.Decimal("1.50"), uuid.uuid4(), None)
+    assert load_key(dump_key(values)) == values
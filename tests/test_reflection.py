@@ -0,0 +1,105 @@
+import pytest
+from pathlib import Path
+from types import SimpleNamespace
+
+import sqlalchemy
+
+from sqltoolbox.database import AutoMappedLiteDatabase, ReflectionCache
+from sqltoolbox.reflection import schema_fingerprint
+
+@pytest.fixture
+def database_name(tmp_path: Path):
+    """Generate a sqlite database with a single table."""
+    name = str(tmp_path / "reflected.db")
+    with sqlalchemy.create_engine(f"sqlite:///{name}").begin() as connection:
+        connection.execute(sqlalchemy.text("CREATE TABLE items (id INTEGER PRIMARY KEY, name VARCHAR(50))"))
+    return name
+
+@pytest.fixture
+def reflection_cache(tmp_path: Path):
+    return ReflectionCache(directory=tmp_path / "cache")
+
+def automapped(name: str, reflection_cache: ReflectionCache):
+    return AutoMappedLiteDatabase(dialect="sqlite", driver="pysqlite", name=name, reflection_cache=reflection_cache)
+
+# Tests
+def test_reflection_cache_hit(database_name: str, reflection_cache: ReflectionCache, monkeypatch: pytest.MonkeyPatch):
+    """Test that an unchanged schema is loaded from the cache without reflecting."""
+    assert "items" in automapped(database_name, reflection_cache).get_table_names()
+    assert list(Path(reflection_cache.directory).glob("*.pickle"))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("schema reflected")
+
+    monkeypatch.setattr(sqlalchemy.MetaData, "reflect", fail)
+    database = automapped(database_name, reflection_cache)
+
+    assert "items" in database.get_table_names()
+    assert hasattr(database.base.classes, "items")
+
+def test_reflection_cache_invalidation(database_name: str, reflection_cache: ReflectionCache):
+    """Test that a schema change is reflected again."""
+    automapped(database_name, reflection_cache)
+
+    with sqlalchemy.create_engine(f"sqlite:///{database_name}").begin() as connection:
+        connection.execute(sqlalchemy.text("CREATE TABLE tags (id INTEGER PRIMARY KEY)"))
+
+    assert "tags" in automapped(database_name, reflection_cache).get_table_names()
+
+    # A new index alone changes the fingerprint too
+    with sqlalchemy.create_engine(f"sqlite:///{database_name}").begin() as connection:
+        before = schema_fingerprint(connection)
+        connection.execute(sqlalchemy.text("CREATE INDEX ix_items_name ON items (name)"))
+        assert schema_fingerprint(connection) != before
+
+@pytest.mark.parametrize("dialect, catalogs", [
+    ("postgresql", ["information_schema.columns", "pg_indexes", "pg_constraint"]),
+    ("mysql", ["information_schema.columns", "information_schema.statistics"]),
+])
+def test_fingerprint_catalogs(dialect: str, catalogs: list):
+    """Test that the fingerprint covers the columns, the indexes and the constraints of the server dialects."""
+    queries = []
+    connection = SimpleNamespace(dialect=SimpleNamespace(name=dialect), execute=lambda query: queries.append(str(query)) or [])
+    schema_fingerprint(connection)
+
+    assert [catalog for catalog in catalogs if not any(catalog in query for query in queries)] == []
+
+@pytest.fixture
+def related_database_name(tmp_path: Path):
+    """Generate a sqlite database with a foreign key between two tables and an unrelated table."""
+    name = str(tmp_path / "related.db")
+    with sqlalchemy.create_engine(f"sqlite:///{name}").begin() as connection:
+        connection.execute(sqlalchemy.text("CREATE TABLE roles (id INTEGER PRIMARY KEY)"))
+        connection.execute(sqlalchemy.text("CREATE TABLE users (id INTEGER PRIMARY KEY, role_id INTEGER REFERENCES roles(id))"))
+        connection.execute(sqlalchemy.text("CREATE TABLE tags (id INTEGER PRIMARY KEY)"))
+    return name
+
+def test_lazy_reflection(related_database_name: str):
+    """Test that a table and its foreign key neighbours are reflected on first access only."""
+    database = AutoMappedLiteDatabase(dialect="sqlite", driver="pysqlite", name=related_database_name, lazy=True)
+    assert not database.get_table_names()
+
+    users = database.base.classes.users
+
+    assert set(database.get_table_names()) == {"users", "roles"}
+    assert hasattr(users, "roles")
+
+def test_lazy_reflection_referencing_tables(related_database_name: str, reflection_cache: ReflectionCache):
+    """Test that the tables referencing a lazily reflected table are mapped with it, and lazy refuses a cache."""
+    database = AutoMappedLiteDatabase(dialect="sqlite", driver="pysqlite", name=related_database_name, lazy=True)
+
+    roles = database.base.classes.roles
+
+    assert set(database.get_table_names()) == {"users", "roles"}
+    assert "users_collection" in sqlalchemy.inspect(roles).relationships
+    with pytest.raises(ValueError):
+        AutoMappedLiteDatabase(dialect="sqlite", driver="pysqlite", name=related_database_name, lazy=True,
+                               reflection_cache=reflection_cache)
+
+def test_lazy_reflection_allowlist(related_database_name: str):
+    """Test that tables outside the allowlist are not reflected."""
+    database = AutoMappedLiteDatabase(dialect="sqlite", driver="pysqlite", name=related_database_name, lazy=True, only=["tags"])
+
+    assert database.base.classes.tags is database.base.classes["tags"]
+    with pytest.raises(AttributeError):
+        database.base.classes.users
@@ -0,0 +1,67 @@
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase, EngineRegistry
+
+@pytest.fixture
+def base():
+    Base = declarative_base()
+
+    class Item(Base):
+        __tablename__ = "items"
+        id      = Column(Integer, primary_key=True)
+
+    return Base
+
+@pytest.fixture
+def registry():
+    return EngineRegistry(max_engines=2)
+
+@pytest.fixture
+def lite_db_connection( base: typing.Any, registry: EngineRegistry ):
+    """Generate a lite database connection sharing engines through a registry."""
+    return DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = "data/test.db",
+        Base    = base,
+        registry= registry,
+    )
+
+# Tests
+def test_registry_shares_engines(lite_db_connection: DeclarativeLiteDatabase, registry: EngineRegistry):
+    """Test that engines with the same connection string and arguments are shared."""
+    assert lite_db_connection.generate_engine() is lite_db_connection.engine
+    assert registry.stats.hits == 1
+    assert registry.stats.misses == 1
+
+def test_registry_lru_eviction(lite_db_connection: DeclarativeLiteDatabase, registry: EngineRegistry):
+    """Test that the least recently used engine is evicted above the size limit."""
+    engines = lite_db_connection.get_engines_from_list(["data/a.db", "data/b.db"])
+
+    assert registry.stats.evictions == 1
+    assert len(registry) == 2
+    assert lite_db_connection.connection_string not in registry
+    assert lite_db_connection.get_engines_from_list(["data/b.db"])["data/b.db"] is engines["data/b.db"]
+
+def test_registry_keeps_engines_in_use(registry: EngineRegistry, tmp_path: Path):
+    """Test that engines with checked out connections are not evicted, and evicted engines stay usable."""
+    urls = [f"sqlite:///{tmp_path / name}.db" for name in "abc"]
+    engines = [registry.get(url, {}, lambda url=url: sqlalchemy.create_engine(url)) for url in urls[:2]]
+
+    with engines[0].connect():
+        registry.get(urls[2], {}, lambda: sqlalchemy.create_engine(urls[2]))
+        assert urls[0] in registry and urls[1] not in registry
+
+    with engines[1].connect() as connection:
+        assert connection.exec_driver_sql("SELECT 1").scalar_one() == 1
+
+def test_registry_rejects_invalid_size():
+    """Test that the registry size must be positive."""
+    with pytest.raises(ValueError):
+        EngineRegistry(max_engines=0)
@@ -0,0 +1,109 @@
+import math
+import threading
+import pytest
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+from sqltoolbox.database import DeclarativeDatabase
+from sqltoolbox.replicas import ReplicaRouter, RoutingSession
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+def sqlite_engine(path: Path, name: str) -> sqlalchemy.engine.Engine:
+    """Generate a sqlite engine with a single item named after the database."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{path / name}.db")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.insert(Item), [{"id": 1, "name": name}])
+    return engine
+
+@pytest.fixture
+def router(tmp_path: Path):
+    return ReplicaRouter(
+        primary=sqlite_engine(tmp_path, "primary"),
+        replicas=[sqlite_engine(tmp_path, "replica1"), sqlite_engine(tmp_path, "replica2")],
+        sticky_seconds=60,
+    )
+
+@pytest.fixture
+def session_factory(router: ReplicaRouter):
+    return sessionmaker(class_=RoutingSession, router=router)
+
+def read_name(session) -> str:
+    return session.scalar(sqlalchemy.select(Item.name).where(Item.id == 1))
+
+# Tests
+def test_reads_round_robin(session_factory: sessionmaker):
+    """Test that reads outside a write transaction alternate between the replicas."""
+    names = []
+    for _ in range(2):
+        with session_factory() as session:
+            names.append(read_name(session))
+
+    assert sorted(names) == ["replica1", "replica2"]
+
+def test_writes_and_sticky_reads(session_factory: sessionmaker):
+    """Test that writes go to the primary and only the following reads of the writing session stick to it."""
+    with session_factory() as session, session_factory() as other:
+        session.add(Item(id=2, name="new"))
+        session.flush()
+        assert read_name(session) == "primary"
+        session.commit()
+
+        assert read_name(session) == "primary"
+        assert read_name(other).startswith("replica")
+
+def test_replica_ejection(router: ReplicaRouter):
+    """Test that stopped replicas are ejected and reads fall back to the primary, and an unknown lag is healthy."""
+    router.lag_function = lambda connection: math.inf
+
+    assert set(router.check_health().values()) == {False}
+    assert router.engine_for_read() is router.primary
+
+    router.lag_function = lambda connection: None
+    assert set(router.check_health().values()) == {True}
+
+def test_background_health_check(router: ReplicaRouter):
+    """Test that the reads do not wait for the health checks."""
+    checking, release = threading.Event(), threading.Event()
+
+    def blocked_lag(connection):
+        checking.set()
+        assert release.wait(timeout=5)
+        return math.inf
+
+    router.lag_function = blocked_lag
+    assert router.engine_for_read() in router.replicas
+    assert checking.wait(timeout=5)
+    assert router.healthy_replicas == router.replicas
+
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "replica-health-check":
+            thread.join(timeout=5)
+    assert router.healthy_replicas == []
+
+def test_auth_database_replica_urls():
+    """Test that replica engines reuse the connection data with their own host."""
+    database = DeclarativeDatabase(
+        dialect = "mysql",
+        driver  = "pymysql",
+        name    = "test",
+        user    = "root",
+        password= "",
+        Base    = Base,
+        replica_hosts = ["replica1", "replica2:3307"],
+        router_args = {"health_check_interval": None},
+    )
+
+    assert [engine.url.host for engine in database.router.replicas] == ["replica1", "replica2"]
+    assert database.router.replicas[1].url.port == 3307
+    assert isinstance(database.session, RoutingSession)
@@ -0,0 +1,101 @@
+import time
+import pytest
+import typing
+from pathlib import Path
+from types import SimpleNamespace
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.scatter import _server_timeout, concat, gather, scatter, sum_by, top_k
+
+Base = declarative_base()
+
+class Member(Base):
+    __tablename__ = "members"
+    id      = Column(Integer, primary_key=True)
+    role    = Column(String(50), nullable=False)
+
+@pytest.fixture
+def tenants( tmp_path: Path ) -> typing.Tuple[DeclarativeLiteDatabase, typing.List[str]]:
+    """Generate three tenant databases with 1, 2 and 3 admins and one user each."""
+    names = []
+    for tenant in range(1, 4):
+        database = DeclarativeLiteDatabase(
+            dialect = "sqlite",
+            driver  = "pysqlite",
+            name    = str(tmp_path / f"tenant{tenant}.db"),
+            Base    = Base,
+            create_tables=True,
+        )
+        database.bulk_insert(Member, [{"role": "admin"}] * tenant + [{"role": "user"}])
+        names.append(database.name)
+    return database, names
+
+# Tests
+def test_gather_and_merge(tenants: typing.Tuple[DeclarativeLiteDatabase, typing.List[str]]):
+    """Test that the rows of every database are merged."""
+    database, names = tenants
+    statement = sqlalchemy.select(Member.role, sqlalchemy.func.count()).group_by(Member.role)
+    report = gather(database, statement, names=names + ["missing/tenant.db"], max_workers=2)
+
+    assert sorted(report.errors) == ["missing/tenant.db"]
+    assert sum_by(report.results) == {"admin": 6, "user": 3}
+    assert len(concat(report.results)) == 6
+    assert top_k(report.results, 2, key=lambda row: row[2]) == [(names[2], "admin", 3), (names[1], "admin", 2)]
+
+def test_scatter_timeout(tenants: typing.Tuple[DeclarativeLiteDatabase, typing.List[str]], tmp_path: Path):
+    """Test that a slow database times out and is interrupted without delaying the others."""
+    database, names = tenants
+    slow = str(tmp_path / "slow.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{slow}")
+    with engine.begin() as connection:
+        # An endless count for this tenant only
+        connection.execute(sqlalchemy.text(
+            "CREATE VIEW members AS WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+            "SELECT x AS id, 'admin' AS role FROM c"
+        ))
+    engine.dispose()
+
+    statement = sqlalchemy.select(sqlalchemy.func.count()).select_from(Member)
+    results = list(scatter(database, statement, names=[slow, *names], max_workers=4, timeout=0.5))
+
+    assert [result.name for result in results][-1] == slow
+    assert results[-1].timed_out
+    assert sum_by(results, keys=0) == {(): 9}
+
+def test_timeout_while_connecting(tenants: typing.Tuple[DeclarativeLiteDatabase, typing.List[str]], monkeypatch: pytest.MonkeyPatch):
+    """Test that a database timing out while connecting does not run the statement once connected."""
+    database, names = tenants
+    executed = []
+    generate_engine = database.generate_engine
+
+    def slow_engine(name: str) -> sqlalchemy.engine.Engine:
+        engine = generate_engine(name)
+        if name == names[0]:
+            sqlalchemy.event.listen(engine, "connect", lambda *args: time.sleep(0.5))
+            sqlalchemy.event.listen(engine, "before_cursor_execute", lambda connection, cursor, sql, *args: executed.append(sql))
+        return engine
+
+    monkeypatch.setattr(database, "generate_engine", slow_engine)
+    statement = sqlalchemy.select(sqlalchemy.func.count()).select_from(Member)
+    results = list(scatter(database, statement, names=names, timeout=0.2))
+
+    assert [result.name for result in results if result.timed_out] == [names[0]]
+    time.sleep(0.5)
+    assert not any("members" in sql for sql in executed)
+
+@pytest.mark.parametrize("dialect, is_mariadb, expected", [
+    ("postgresql", False, ["SET LOCAL statement_timeout = 1500"]),
+    ("mysql", False, ["SET SESSION max_execution_time = 1500", "SET SESSION max_execution_time = DEFAULT"]),
+    ("mysql", True, ["SET SESSION max_statement_time = 1.500", "SET SESSION max_statement_time = DEFAULT"]),
+])
+def test_server_timeout(dialect: str, is_mariadb: bool, expected: typing.List[str]):
+    """Test the statements limiting the execution time on the servers whose drivers can not be interrupted."""
+    statements = []
+    connection = SimpleNamespace(dialect=SimpleNamespace(name=dialect, is_mariadb=is_mariadb), exec_driver_sql=statements.append)
+    with _server_timeout(connection, 1.5):
+        pass
+    assert statements == expected
@@ -0,0 +1,85 @@
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+from sqltoolbox.models.base import Base
+from sqltoolbox.models import User, Role, Address
+from sqltoolbox.sharding import ShardedDatabase
+
+@pytest.fixture
+def sharded_database( tmp_path: Path ) -> typing.Iterator[ShardedDatabase]:
+    """Generate a database sharded over three SQLite files, with 20 users of two addresses each."""
+    names = [str(tmp_path / f"shard{index}.db") for index in range(3)]
+    database = DeclarativeLiteDatabase(dialect="sqlite", driver="pysqlite", name=names[0], Base=Base)
+    sharded = ShardedDatabase.from_database(database, names, shard_keys={User: 'id', Address: 'user_id'}, create_tables=True)
+
+    with sharded.autocommit_session as session:
+        session.add(Role(id=1, name="admin"))
+        for index in range(1, 21):
+            user = User(id=index, name=f"user{index}", fullname=f"User {index}", password="secret", role_id=1)
+            user.addresses = [Address(address=f"street {index}"), Address(address=f"avenue {index}")]
+            session.add(user)
+    yield sharded
+    sharded.close()
+
+def count_rows(engine: sqlalchemy.engine.Engine, table: str) -> int:
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text(f"SELECT count(*) FROM {table}")).scalar_one()
+
+# Tests
+def test_writes_are_colocated(sharded_database: ShardedDatabase):
+    """Test that users are spread by id, their addresses follow them and roles stay on the default shard."""
+    shards = sharded_database.shards
+    assert sum(count_rows(engine, "users") for engine in shards.values()) == 20
+    assert sum(count_rows(engine, "users") > 0 for engine in shards.values()) == 3
+    assert [count_rows(engine, "roles") for engine in shards.values()] == [1, 0, 0]
+
+    for shard_id, engine in shards.items():
+        with engine.connect() as connection:
+            user_ids = connection.execute(sqlalchemy.text("SELECT user_id FROM addresses")).scalars().all()
+        assert {sharded_database.shard_of(User, user_id) for user_id in user_ids} == {shard_id}
+
+def test_routing_and_fan_out(sharded_database: ShardedDatabase):
+    """Test that key lookups query one shard and unkeyed selects are merged from every shard."""
+    queried = []
+    for shard_id, engine in sharded_database.shards.items():
+        sqlalchemy.event.listen(engine, "before_cursor_execute", lambda *args, shard_id=shard_id: queried.append(shard_id))
+
+    with sharded_database.session as session:
+        user = session.get(User, 7)
+        assert sqlalchemy.inspect(user).identity_token == sharded_database.shard_of(User, 7)
+        assert sorted(address.address for address in user.addresses) == ["avenue 7", "street 7"]
+
+        assert set(queried) == {sharded_database.shard_of(User, 7)}
+
+        queried.clear()
+        selected = session.scalars(sqlalchemy.select(Address).where(Address.user_id.in_([3, 4]))).all()
+        assert len(selected) == 4
+        assert set(queried) == {sharded_database.shard_of(User, 3), sharded_database.shard_of(User, 4)}
+
+        users = session.scalars(sqlalchemy.select(User)).all()
+        assert sorted(user.id for user in users) == list(range(1, 21))
+        assert session.get(User, 7) is next(user for user in users if user.id == 7)
+
+def test_routing_execute_time_parameters(sharded_database: ShardedDatabase):
+    """Test that keys bound at execute time are routed to their shard and missing ones fan out."""
+    queried = []
+    for shard_id, engine in sharded_database.shards.items():
+        sqlalchemy.event.listen(engine, "before_cursor_execute", lambda *args, shard_id=shard_id: queried.append(shard_id))
+
+    with sharded_database.session as session:
+        statement = sqlalchemy.select(Address).where(Address.user_id == sqlalchemy.bindparam("user_id"))
+        for user_id in (3, 7, 11):
+            queried.clear()
+            addresses = session.scalars(statement, {"user_id": user_id}).all()
+            assert sorted(address.address for address in addresses) == [f"avenue {user_id}", f"street {user_id}"]
+            assert set(queried) == {sharded_database.shard_of(User, user_id)}
+
+        queried.clear()
+        statement = sqlalchemy.select(Address).where(Address.user_id.in_(sqlalchemy.bindparam("user_ids", expanding=True)))
+        addresses = session.scalars(statement, {"user_ids": [3, 4]}).all()
+        assert len(addresses) == 4
+        assert set(queried) == {sharded_database.shard_of(User, 3), sharded_database.shard_of(User, 4)}
@@ -0,0 +1,48 @@
+import pytest
+import typing
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.orm import declarative_base
+
+from sqltoolbox.database import DeclarativeLiteDatabase
+
+Base = declarative_base()
+
+class Item(Base):
+    __tablename__ = "items"
+    id      = Column(Integer, primary_key=True)
+    name    = Column(String(50), nullable=True)
+
+@pytest.fixture
+def base():
+    return Base
+
+@pytest.fixture
+def declarative_lite_db_connection( base: typing.Any, tmp_path: Path ):
+    """Generate a lite database connection with 25 items."""
+    database = DeclarativeLiteDatabase(
+        dialect = "sqlite",
+        driver  = "pysqlite",
+        name    = str(tmp_path / "stream.db"),
+        Base    = base,
+        create_tables=True,
+    )
+    database.bulk_insert(base.metadata.tables["items"], ({"id": i, "name": f"item{i}"} for i in range(25)))
+    return database
+
+# Tests
+def test_stream_orm(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that ORM entities are yielded in batches."""
+    batches = list(declarative_lite_db_connection.stream(sqlalchemy.select(Item).order_by(Item.id), batch_size=10, scalars=True))
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert isinstance(batches[0][0], Item)
+
+def test_stream_core(declarative_lite_db_connection: DeclarativeLiteDatabase):
+    """Test that rows are yielded without ORM entities."""
+    batches = list(declarative_lite_db_connection.stream(sqlalchemy.select(Item), batch_size=20, orm=False))
+
+    assert [len(batch) for batch in batches] == [20, 5]
+    assert batches[1][-1].name == "item24"